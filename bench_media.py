@@ -0,0 +1,92 @@
+__author__ = 'looser'
+
+from optparse import OptionParser
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from make_synthetic_library import make_camera_tree, make_date_folders, make_takeout
+
+# Runs each media script over a fresh synthetic library and prints files/s and peak memory,
+# HandBrake is replaced with fake_handbrake.py so encodes only cost a copy
+# example args: -n 100000 --encodes 200 [move.py inplace-update-meta.py]
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKE_HANDBRAKE = os.path.join(HERE, "fake_handbrake.py")
+
+
+def run_script(args, env):
+    """ Runs a script to completion, returns (exit code, seconds, peak RSS in MB). """
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable] + args, cwd=HERE, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    # wait4 gives the rusage of this child alone, ru_maxrss is in KB on Linux
+    (_, status, usage) = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    errors = process.stderr.read().decode(errors="replace")
+    process.stderr.close()
+    if process.returncode != 0:
+        print(errors, file=sys.stderr)
+    return process.returncode, elapsed, usage.ru_maxrss / 1024.0
+
+
+def benchmarks(options):
+    """ (script, how many files it sees, setup(top) returning the script args) for every script. """
+    n = options.count
+    encodes = min(n, options.encodes)
+
+    def library(top, count=n):
+        make_camera_tree(os.path.join(top, "vid"), count, options.depth, options.size)
+        return os.path.join(top, "vid")
+
+    def folders(top):
+        make_date_folders(os.path.join(top, "pictures"), n, files_per_folder=1)
+        return [os.path.join(top, "pictures")]
+
+    def takeout(top):
+        make_takeout(os.path.join(top, "takeout"), n, options.size)
+        os.makedirs(os.path.join(top, "copy"))
+        return ["--from", "2000-01-01", "--to", "2100-01-01", "--cache", os.path.join(top, "cache.sqlite"),
+                os.path.join(top, "takeout"), os.path.join(top, "copy")]
+
+    return [
+        ("bench_renamer.py", n, lambda top: ["-n", str(n)]),
+        ("inplace-update-meta.py", n, lambda top: [library(top)]),
+        ("move.py", n, lambda top: ["-e", "mod,mp4,3gp", library(top), os.path.join(top, "moved")]),
+        ("folder-mover.py", n, folders),
+        ("find_videos_by_json.py", n, takeout),
+        ("copy-and-encode.py", encodes, lambda top: [library(top, encodes), os.path.join(top, "processed"),
+                                                     os.path.join(top, "backup")]),
+        ("process_new_videos.py", encodes, lambda top: [library(top, encodes)]),
+    ]
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog [options] [script ...]")
+    parser.add_option("-n", "--count", dest="count", type="int", default=10000, help="files per library")
+    parser.add_option("--encodes", dest="encodes", type="int", default=100,
+                      help="files for the encoding scripts, every one is a process start")
+    parser.add_option("--depth", dest="depth", type="int", default=3)
+    parser.add_option("--size", dest="size", type="int", default=0, help="bytes per file (sparse)")
+    parser.add_option("--dir", dest="dir", help="where to build the libraries, default is the temp dir")
+    (options, args) = parser.parse_args()
+
+    failed = False
+    print("%-24s %8s %9s %12s %9s" % ("script", "files", "seconds", "files/s", "peak MB"))
+    for (script, count, setup) in benchmarks(options):
+        if args and script not in args:
+            continue
+        with tempfile.TemporaryDirectory(dir=options.dir) as top:
+            script_args = setup(top)
+            env = dict(os.environ, HANDBRAKE_CLI=FAKE_HANDBRAKE,
+                       # rename journals go with the library instead of the home dir
+                       HOME=top)
+            (ret, elapsed, peak) = run_script([script] + script_args, env)
+        failed |= ret != 0
+        print("%-24s %8d %9.2f %12.0f %9.1f%s" % (script, count, elapsed, count / elapsed, peak,
+                                                  "" if ret == 0 else "  FAILED (%d)" % (ret,)))
+    if failed:
+        sys.exit(1)
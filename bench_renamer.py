@@ -0,0 +1,100 @@
+__author__ = 'looser'
+
+from datetime import datetime, timedelta
+from optparse import OptionParser
+import os
+import random
+import re
+import time
+
+from renamer import apply_timestamp_convention, proper_name, proper_names, _proper_stem
+
+# Times renamer over synthetic camera file names, against proper_name as it was before proper_names
+# example args: -n 1000000
+
+
+def synthetic_names(count, seed=0):
+    """ Mix of the names cameras and phones give: JVC MOVxxx, VID_yyyymmdd_hhmmss, video-yyyy-mm-dd-..., renamed. """
+    rnd = random.Random(seed)
+    start = datetime(2008, 1, 1)
+    for i in range(count):
+        taken = start + timedelta(seconds=rnd.randrange(15 * 365 * 24 * 3600))
+        folder = os.path.join("vid", str(taken.year), "%02d" % (taken.month,))
+        kind = i % 4
+        if kind == 0:
+            name = "MOV%03X.MOD" % (rnd.randrange(0x1000),)
+        elif kind == 1:
+            name = taken.strftime("VID_%Y%m%d_%H%M%S.mp4")
+        elif kind == 2:
+            name = taken.strftime("video-%Y-%m-%d-%H-%M-%S.3gp")
+        else:
+            name = taken.strftime("%Y.%m.%d_%H-%M-%S_MOV") + "%03d.mp4" % (rnd.randrange(1000),)
+        yield os.path.join(folder, name), taken
+
+
+def baseline_proper_name(file, timestamp):
+    """ renamer.proper_name before the regexes were compiled once and stems memoized, the baseline. """
+    (folder, full_name) = os.path.split(file)
+    (name, ext) = os.path.splitext(full_name)
+
+    fix_hex = re.match(r"^MOV[0-9A-F]{3}$", name)
+
+    existing_date = re.search(r"[-._ ]?(?P<Y>\d{4})[-._ ]?(?P<m>\d{2})[-._ ]?(?P<d>\d{2})[-._ ]?(?P<H>\d{2})[-._ ]?"
+                              r"(?P<M>\d{2})[-._ ]?(?P<S>\d{2})[-._ ]?", name)
+    if existing_date:
+        name = name.replace(existing_date.group(0), "").__str__()
+
+        dup_match = re.search(r"[-._ ]?\d\d\d\d\.\d\d\.\d\d$", name)
+        if dup_match:
+            name = name.replace(dup_match.group(0), "")
+
+        name = "_{0}".format(name) if name else ""
+        name = "%s.%s.%s_%s-%s-%s%s" % (
+            existing_date.group("Y"),
+            existing_date.group("m"),
+            existing_date.group("d"),
+            existing_date.group("H"),
+            existing_date.group("M"),
+            existing_date.group("S"),
+            name
+        )
+    else:
+        date_match = re.search(r"\d\d\d\d\.\d\d\.\d\d[_ ]", name)
+        if not date_match:
+            name = apply_timestamp_convention(name, timestamp)
+        elif not re.match(r"\d\d\d\d\.\d\d\.\d\d_\d\d-\d\d-\d\d", name):
+            name = name.replace(date_match.group(0), "")
+            name = apply_timestamp_convention(name, timestamp)
+
+    if fix_hex:
+        match = re.search(r"MOV([0-9A-F]{3})", name)
+        if match:
+            number = int(match.group(1), 16)
+            name = name.replace(match.group(0), "MOV" + ("%03d" % (number,)))
+
+    return os.path.join(folder, name + ext)
+
+
+def timed(label, count, fn):
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    print("%-20s %8.2fs %10.0f names/s" % (label, elapsed, count / elapsed))
+    return result
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-n", "--count", dest="count", type="int", default=1000000)
+    (options, _) = parser.parse_args()
+
+    files = list(synthetic_names(options.count))
+    expected = timed("baseline proper_name", options.count,
+                     lambda: [baseline_proper_name(file, timestamp) for (file, timestamp) in files])
+    # every run starts with an empty memo, else the first run warms it for the next
+    _proper_stem.cache_clear()
+    got = timed("proper_names", options.count, lambda: list(proper_names(files)))
+    _proper_stem.cache_clear()
+    timed("proper_name", options.count, lambda: [proper_name(file, timestamp) for (file, timestamp) in files])
+    if got != expected:
+        print("DIFFERENT RESULTS!!!")
@@ -0,0 +1,128 @@
+__author__ = 'looser'
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import json
+from optparse import OptionParser
+import os
+
+from move_plan import MovePlan
+
+# journals live outside the library, so the scripts that walk it never see them
+DEFAULT_JOURNAL_DIR = os.path.join(os.path.expanduser("~"), ".rename-journals")
+
+
+def _write_synced(path, lines, mode):
+    with open(path, mode, encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_journal(journal_file):
+    """ Returns ([(src, dst)], status) where status is "applying", "done" or "rolled back". """
+    renames = []
+    status = "applying"
+    with open(journal_file, encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            if "src" in entry:
+                renames.append((entry["src"], entry["dst"]))
+            elif "status" in entry:
+                status = entry["status"]
+    return renames, status
+
+
+def check_and_apply(batch, workers=1, existing=None):
+    """
+    Common use from the scripts: drop and report clashing renames, apply the rest and print them.
+    Returns the renames done.
+    """
+    for ((src, dst), reason) in batch.problems(existing).items():
+        print("NOT RENAMED %s => %s: %s" % (src, dst, reason))
+        batch.drop([(src, dst)])
+    failed = batch.apply(workers)
+    for (src, dst, error) in failed:
+        print("ERROR %s => %s: %s" % (src, dst, error))
+    failed = {(src, dst) for (src, dst, _) in failed}
+    done = [rename for rename in batch.renames if rename not in failed]
+    for (src, dst) in done:
+        print("%s => %s" % (src, dst))
+    if batch.journal_file:
+        print("%d renames journaled in %s" % (len(done), batch.journal_file))
+    return done
+
+
+class RenameBatch:
+    """
+    Renames many files as one unit. The whole batch is checked for clashes before anything is renamed,
+    and written to a journal with one fsync, so an interrupted or unwanted batch can be rolled back.
+    """
+    def __init__(self, journal_dir=DEFAULT_JOURNAL_DIR, label="rename"):
+        self.journal_dir = journal_dir
+        self.label = label
+        self.plan = MovePlan()
+        self.journal_file = None
+
+    def add(self, src, dst):
+        self.plan.add(src, dst)
+
+    @property
+    def renames(self):
+        return self.plan.moves
+
+    def problems(self, existing=None):
+        """ Maps renames that would fail or overwrite something to the reason, see MovePlan.problems. """
+        return self.plan.problems(existing)
+
+    def drop(self, renames):
+        self.plan.drop(renames)
+
+    def apply(self, workers=1):
+        """ Journals and renames everything, returns [(src, dst, error)] for the renames that failed. """
+        if not self.renames:
+            return []
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self.journal_file = os.path.join(self.journal_dir, "%s-%s-%d.jsonl" % (
+            datetime.now().strftime("%Y%m%d-%H%M%S"), self.label, os.getpid()))
+        _write_synced(self.journal_file, [{"src": src, "dst": dst} for (src, dst) in self.renames], "w")
+
+        def rename(move):
+            try:
+                os.rename(*move)
+                return None
+            except OSError as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            errors = list(pool.map(rename, self.renames))
+        _write_synced(self.journal_file, [{"status": "done"}], "a")
+        return [(src, dst, error) for ((src, dst), error) in zip(self.renames, errors) if error is not None]
+
+
+def rollback(journal_file):
+    """ Renames back whatever a journaled batch renamed, returns the number of files put back. """
+    (renames, _) = read_journal(journal_file)
+    restored = 0
+    for (src, dst) in reversed(renames):
+        if os.path.lexists(dst) and not os.path.lexists(src):
+            os.rename(dst, src)
+            restored += 1
+    _write_synced(journal_file, [{"status": "rolled back"}], "a")
+    return restored
+
+
+if __name__ == "__main__":
+    # Lists the rename journals or rolls one back
+    # example args: --rollback C:\Users\me\.rename-journals\20240101-101010-inplace-update-meta-123.jsonl
+    parser = OptionParser()
+    parser.add_option("--journal-dir", dest="journal_dir", default=DEFAULT_JOURNAL_DIR)
+    parser.add_option("--rollback", dest="rollback", help="journal file of the batch to undo")
+    (options, args) = parser.parse_args()
+    if options.rollback:
+        print("%d files renamed back" % (rollback(options.rollback),))
+    elif os.path.isdir(options.journal_dir):
+        for name in sorted(os.listdir(options.journal_dir)):
+            (renames, status) = read_journal(os.path.join(options.journal_dir, name))
+            print("%s: %d renames, %s" % (name, len(renames), status))
@@ -0,0 +1,202 @@
+__author__ = 'looser'
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from optparse import OptionParser
+import os
+import sqlite3
+
+from file_hash import full_hash
+from media_date import capture_date
+from renamer import proper_name
+
+VIDEO_EXTENSIONS = [".mod", ".avi", ".mp4", ".mov", ".3gp", ".m4v", ".asf"]
+PICTURE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".heic", ".gif"]
+MEDIA_EXTENSIONS = VIDEO_EXTENSIONS + PICTURE_EXTENSIONS
+# dirs stat'ed or listed at once, NAS round trips dominate
+DEFAULT_WORKERS = 8
+
+
+class Catalog:
+    """
+    SQLite index of the media files under one or more roots: size, mtime, inode, capture date,
+    what renamer.proper_name makes of the file and optionally a content hash.
+    refresh() only lists dirs whose mtime changed, the rest of the tree is taken from the catalog.
+    """
+    def __init__(self, db_file, extensions=MEDIA_EXTENSIONS, workers=DEFAULT_WORKERS):
+        self.extensions = {ext.lower() for ext in extensions}
+        self.workers = workers
+        self.db = sqlite3.connect(db_file)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER);
+            CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+            CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, dir TEXT NOT NULL, name TEXT NOT NULL,
+                ext TEXT NOT NULL, size INTEGER, mtime_ns INTEGER, inode INTEGER, capture_date TEXT,
+                proper_name TEXT, hash TEXT);
+            CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+        """)
+
+    def refresh(self, top, full=False):
+        """
+        Brings the catalog up to date with the tree under top, returns number of dirs listed.
+        Dir mtimes don't change when a file is rewritten in place, full=True lists every dir to catch that.
+        """
+        top = os.path.normpath(top)
+        known = {} if full else dict(self.db.execute("SELECT path, mtime_ns FROM dirs"))
+        children = {}
+        parents = {}
+        for (path, parent) in self.db.execute("SELECT path, parent FROM dirs"):
+            children.setdefault(parent, []).append(path)
+            parents[path] = parent
+        listed = 0
+        # a subtree of a catalogued root stays linked to it, else the root's refresh no longer reaches it
+        up = os.path.dirname(top)
+        level = [(top, up if up in parents else parents.get(top))]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while level:
+                next_level = []
+                scans = pool.map(lambda dir: self._scan(dir[0], known.get(dir[0])), level)
+                for ((path, parent), result) in zip(level, scans):
+                    if result is None:
+                        # gone, with everything below it
+                        self._forget_dir(path)
+                    elif result == "unreadable":
+                        # left as catalogued, like walker skips dirs it can't list
+                        pass
+                    elif result == "unchanged":
+                        if parents.get(path) != parent:
+                            # refreshed on its own before its parent was catalogued
+                            self.db.execute("UPDATE dirs SET parent = ? WHERE path = ?", (parent, path))
+                        next_level.extend((sub, path) for sub in children.get(path, []))
+                    else:
+                        listed += 1
+                        (mtime_ns, files, subdirs) = result
+                        self._store_dir(pool, path, parent, mtime_ns, files, subdirs)
+                        next_level.extend((sub, path) for sub in subdirs)
+                self.db.commit()
+                level = next_level
+        return listed
+
+    def _scan(self, path, known_mtime):
+        """
+        Runs on the pool: None if path is gone, "unreadable", "unchanged",
+        or (mtime_ns, [file details], [subdirs]).
+        """
+        files = []
+        subdirs = []
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+            if mtime_ns == known_mtime:
+                return "unchanged"
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            if not entry.is_symlink():
+                                subdirs.append(entry.path)
+                        elif os.path.splitext(entry.name)[1].lower() in self.extensions:
+                            stat = entry.stat()
+                            files.append((entry.path, entry.name, stat.st_size, stat.st_mtime_ns, stat.st_ino))
+                    except OSError:
+                        # dangling symlink or removed while listing, only this entry is skipped
+                        pass
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        except OSError:
+            return "unreadable"
+        return mtime_ns, files, subdirs
+
+    def _store_dir(self, pool, path, parent, mtime_ns, files, subdirs):
+        self.db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)", (path, parent, mtime_ns))
+        for (sub,) in self.db.execute("SELECT path FROM dirs WHERE parent = ?", (path,)).fetchall():
+            if sub not in subdirs:
+                self._forget_dir(sub)
+        known = {row[0]: row[1:] for row in self.db.execute(
+            "SELECT path, size, mtime_ns, inode FROM files WHERE dir = ?", (path,))}
+        current = {file[0] for file in files}
+        self.db.executemany("DELETE FROM files WHERE path = ?", [(gone,) for gone in known if gone not in current])
+        changed = [file for file in files if known.get(file[0]) != file[2:]]
+        dates = pool.map(capture_date, [file[0] for file in changed])
+        self.db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL)",
+                            [self._details(path, taken, *file) for (file, taken) in zip(changed, dates)])
+
+    def _details(self, dir, taken, path, name, size, mtime_ns, inode):
+        timestamp = taken or datetime.fromtimestamp(mtime_ns / 1e9)
+        return (path, dir, name, os.path.splitext(name)[1].lower(), size, mtime_ns, inode,
+                taken.isoformat() if taken else None, proper_name(path, timestamp))
+
+    def _forget_dir(self, path):
+        for (sub,) in self.db.execute("SELECT path FROM dirs WHERE parent = ?", (path,)).fetchall():
+            self._forget_dir(sub)
+        self.db.execute("DELETE FROM files WHERE dir = ?", (path,))
+        self.db.execute("DELETE FROM dirs WHERE path = ?", (path,))
+
+    def moved(self, src, dst):
+        """ Keeps the catalog right after a script moved or renamed a file, the new name needn't be canonical. """
+        (dir, name) = os.path.split(dst)
+        self.db.execute("DELETE FROM files WHERE path = ?", (dst,))
+        row = self.db.execute("SELECT capture_date, mtime_ns FROM files WHERE path = ?", (src,)).fetchone()
+        if row is not None:
+            (taken, mtime_ns) = row
+            timestamp = datetime.fromisoformat(taken) if taken else datetime.fromtimestamp(mtime_ns / 1e9)
+            self.db.execute("UPDATE files SET path = ?, dir = ?, name = ?, ext = ?, proper_name = ? WHERE path = ?",
+                            (dst, dir, name, os.path.splitext(name)[1].lower(), proper_name(dst, timestamp), src))
+        self.db.commit()
+
+    def set_mtime(self, path, mtime):
+        """ After os.utime, which the dir mtime doesn't show. """
+        self.db.execute("UPDATE files SET mtime_ns = ? WHERE path = ?", (int(mtime * 1e9), path))
+
+    def _under(self, top):
+        top = os.path.join(os.path.normpath(top), "")
+        return "(dir = ? OR substr(dir, 1, ?) = ?)", [top[:-1], len(top), top]
+
+    def files(self, top, extensions=None):
+        """ Yields (path, size, mtime_ns) of the files under top. """
+        (where, params) = self._under(top)
+        if extensions is not None:
+            extensions = [ext.lower() for ext in extensions]
+            where += " AND ext IN (%s)" % ",".join("?" * len(extensions))
+            params += extensions
+        yield from self.db.execute("SELECT path, size, mtime_ns FROM files WHERE " + where + " ORDER BY path", params)
+
+    def non_canonical(self, top, extensions=VIDEO_EXTENSIONS):
+        """ Yields (path, proper_name) of the files under top that renamer would rename. """
+        (where, params) = self._under(top)
+        extensions = [ext.lower() for ext in extensions]
+        yield from self.db.execute("SELECT path, proper_name FROM files WHERE " + where +
+                                   " AND ext IN (%s) AND path != proper_name ORDER BY path"
+                                   % ",".join("?" * len(extensions)), params + extensions)
+
+    def hash_missing(self, top):
+        """ Fills in content hashes that are not known yet, returns how many were computed. """
+        (where, params) = self._under(top)
+        paths = [path for (path,) in self.db.execute("SELECT path FROM files WHERE hash IS NULL AND " + where, params)]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for (path, digest) in zip(paths, pool.map(full_hash, paths)):
+                self.db.execute("UPDATE files SET hash = ? WHERE path = ?", (digest, path))
+        self.db.commit()
+        return len(paths)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+if __name__ == "__main__":
+    # Refreshes the catalog, example args: --hash --non-canonical D:\catalog.sqlite D:\vid
+    parser = OptionParser()
+    parser.add_option("--full", dest="full", action="store_true", default=False, help="list every dir")
+    parser.add_option("--hash", dest="hash", action="store_true", default=False, help="compute missing hashes")
+    parser.add_option("--non-canonical", dest="non_canonical", action="store_true", default=False,
+                      help="print videos whose name is not what renamer would make of it")
+    (options, args) = parser.parse_args()
+    catalog = Catalog(args[0])
+    for top in args[1:]:
+        print("%s: listed %d dirs" % (top, catalog.refresh(top, options.full)))
+        if options.hash:
+            print("%s: hashed %d files" % (top, catalog.hash_missing(top)))
+        if options.non_canonical:
+            for (path, proper) in catalog.non_canonical(top):
+                print("%s => %s" % (path, proper))
+    catalog.close()
@@ -1,38 +1,246 @@
+from optparse import OptionParser
 import os
-import shutil
 import sys
+import threading
 
-from hb_encoder import HbEncoder
+from encode_farm import EncodeFarm, work, worker_name
+from encode_journal import EncodeJournal, JOURNAL_NAME
+from encode_queue import EncodeQueue, default_workers
+from encode_report import EncodeReport
+from pipeline import ByteBudget, Stage
+from transfer import copy_file, move_verified
+from walker import walk_files, DEFAULT_WORKERS
 
 # Encodes the MOD files from my video dir:
 # 1) encode to a temp folder
-# 2) move original to backup
+# 2) move original to backup (and --mirror dirs) in one read of it, it's only removed once every copy was read
+#    back from disk with the right size, head and tail, --read-back compares the whole of every copy instead
+#    (twice the I/O, twice the NAS traffic)
 # 3) copy encoded back to original location
+# Scan, encodes and copies (2 and 3) run as stages of their own, joined by short queues, so the copies of
+# one file happen while the next one encodes. With --temp-budget encoded files leave the temp folder once
+# copied back, and encodes wait while the temp folder would hold more than the budget.
+# Progress is journaled in the temp folder, so a rerun picks up where the last one stopped.
+# With --farm the same command can run on several hosts that mount the same share, they share out the
+# encodes through the farm dir (see encode_farm.py) instead of the journal.
+# example args: -j 4 --io-jobs 2 --temp-budget 50 "D:\vid" "D:\temp\processed" "D:\backup"
+# farm example: -j 2 --farm /mnt/share/farm /mnt/share/vid /mnt/share/processed /mnt/share/backup
 
-source = sys.argv[1]
-destination = sys.argv[2]
-backup = sys.argv[3]
-
-encoder = HbEncoder()
-for root, dirs, files in os.walk(source):
-    for file in files:
-        (no_ext_name, ext) = os.path.splitext(file)
-        if ext.lower() == ".mod":
-            relative_dir = root[(len(source) + 1):]
-            src = os.path.join(root, file)
-            print("Processing {0}".format(src))
-
-            processed_dst = os.path.join(destination, relative_dir)
-            backup_dst = os.path.join(backup, relative_dir)
-            processed_file = os.path.join(processed_dst, no_ext_name + ".mp4")
-
-            os.makedirs(processed_dst, exist_ok=True)
-            os.makedirs(backup_dst, exist_ok=True)
-
-            if encoder.encode(src, processed_file) != 0:
-                print("NOT ENCODED!!!")
-                continue
-
-            shutil.copy2(src, backup_dst)
-            os.remove(src)
-            shutil.copy2(processed_file, root)
+parser = OptionParser()
+parser.add_option("-j", "--jobs", dest="jobs", type="int", default=default_workers(),
+                  help="number of encodes to run at once")
+parser.add_option("--io-jobs", dest="io_jobs", type="int", default=2, help="number of files to copy back at once")
+parser.add_option("--scan-jobs", dest="scan_jobs", type="int", default=DEFAULT_WORKERS,
+                  help="number of dirs to list at once")
+parser.add_option("--temp-budget", dest="temp_budget", type="float",
+                  help="GB of encoded files the temp folder may hold, they are removed once copied back")
+parser.add_option("--mirror", dest="mirrors", action="append", default=[],
+                  help="another backup root (e.g. on the NAS) written in the same pass, can be repeated")
+parser.add_option("--read-back", dest="read_back", action="store_true", default=False,
+                  help="compare the whole of every backup copy, not only size, head and tail, "
+                       "before the original is removed")
+parser.add_option("--farm", dest="farm", help="dir on the share to coordinate workers on other hosts through")
+parser.add_option("--journal", dest="journal", help="progress journal, default is " + JOURNAL_NAME + " in the temp folder")
+parser.add_option("--report", dest="report", help="CSV (or .json) file to append per-encode metrics to")
+parser.add_option("--split-over", dest="split_over", type="float",
+                  help="encode sources bigger than this many GB in segments at once (needs ffmpeg to join them)")
+
+(options, args) = parser.parse_args()
+if options.farm and options.temp_budget:
+    parser.error("--temp-budget is not supported with --farm")
+
+source = args[0]
+destination = args[1]
+backup = args[2]
+
+
+def paths_for(src):
+    """ Encoded file and backup dirs (backup first, then the mirrors) of a source under this run's source dir. """
+    (root, file) = os.path.split(src)
+    relative_dir = root[(len(source) + 1):]
+    processed_file = os.path.join(destination, relative_dir, os.path.splitext(file)[0] + ".mp4")
+    return processed_file, [os.path.join(top, relative_dir) for top in [backup] + options.mirrors]
+
+
+def backup_and_copy_back(src, processed_file, backup_dsts, done, mark):
+    """ Steps after the encode that are not in done yet, mark(stage) records each one. """
+    root = os.path.dirname(src)
+    if "backed_up" not in done:
+        for dst in backup_dsts:
+            os.makedirs(dst, exist_ok=True)
+        # one read of the original for all copies, a rename for a backup on the same filesystem
+        move_verified(src, backup_dsts, options.read_back)
+        mark("backed_up")
+        mark("removed")
+    elif "removed" not in done:
+        os.remove(src)
+        mark("removed")
+    if "copied_back" not in done:
+        copy_file(processed_file, root)
+        mark("copied_back")
+    if budget is not None:
+        # the temp folder is only a temp folder then
+        os.remove(processed_file)
+
+
+def copy_stage(job):
+    """ I/O stage: backup and copy back, then frees what the file took of the budget. """
+    (src, size, mtime_ns, done, reserved) = job
+    try:
+        (processed_file, backup_dsts) = paths_for(src)
+        backup_and_copy_back(src, processed_file, backup_dsts, done,
+                             lambda stage: journal.mark(src, size, mtime_ns, stage))
+    finally:
+        if budget is not None:
+            budget.release(reserved)
+
+
+def encode_stage(job):
+    (src, processed_file, size, mtime_ns) = job
+    if budget is not None:
+        # the encode comes out smaller than the MOD, so the source size is a safe guess until it's done
+        budget.acquire(size)
+    reserved = 0
+    try:
+        ret = queue.encode(src, processed_file, size)
+        if budget is not None and ret == 0:
+            # raises when the encoder claims success without an output, the whole guess is released then
+            reserved = os.path.getsize(processed_file)
+    finally:
+        if budget is not None:
+            budget.release(size - reserved)
+    if ret != 0:
+        print("NOT ENCODED!!! {0}".format(src))
+        return False
+    journal.mark(src, size, mtime_ns, "encoded")
+    copies.put((src, size, mtime_ns, {"encoded"}, reserved))
+
+
+def resume(src, size, mtime_ns, done):
+    print("Resuming {0}".format(src))
+    (processed_file, _) = paths_for(src)
+    reserved = 0
+    if budget is not None:
+        reserved = os.path.getsize(processed_file) if os.path.exists(processed_file) else 0
+        budget.acquire(reserved)
+    copies.put((src, size, mtime_ns, done, reserved))
+
+
+def farm_job(farm, job):
+    """
+    Encode, backup and copy back of one farm job, whatever a worker that died on it got done is skipped.
+    Paths all come from the job, relative to the farm dir, workers may mount the share elsewhere.
+    """
+    src = job.source
+    processed_file = job.target
+    backup_dsts = [farm.resolve(dst) for dst in job.data["backups"]]
+    done = job.done_stages()
+    if "encoded" not in done and queue.encoder.is_encoded(processed_file):
+        # encoded by a worker that died before recording it, or by a run without --farm
+        job.mark("encoded")
+        done.add("encoded")
+    if "encoded" not in done:
+        if not os.path.exists(src):
+            print("NOT ENCODED!!! {0} is gone".format(src))
+            return 1
+        reason = queue.encoder.skip_reason(src, processed_file)
+        if reason is not None:
+            print("Skipping {0}: {1}".format(src, reason))
+            return 0
+        print("Processing {0}".format(src))
+        os.makedirs(os.path.dirname(processed_file), exist_ok=True)
+        # a worker that lost its claim may still be encoding the same file, only whole encodes get renamed in
+        encoding = "{0}.{1}.mp4".format(processed_file, farm.worker)
+        ret = queue.encode(src, encoding, job.data["size"])
+        if ret != 0:
+            print("NOT ENCODED!!! {0}".format(src))
+            if os.path.exists(encoding):
+                os.remove(encoding)
+            return ret
+        os.replace(encoding, processed_file)
+        job.mark("encoded")
+    if not job.heartbeat():
+        # another worker took the job over, it does the backup and copy back
+        print("Lost claim on {0}, leaving it to its new worker".format(src))
+        return 1
+    backup_and_copy_back(src, processed_file, backup_dsts, done, job.mark)
+    return 0
+
+
+def run_farm():
+    """ Adds the MOD files found here to the farm and works on the farm's jobs until all are done. """
+    submitter = EncodeFarm(options.farm)
+    new = 0
+    for file in walk_files(source, [".mod"], options.scan_jobs):
+        (processed_file, backup_dsts) = paths_for(file.path)
+        new += submitter.submit(file.path, processed_file, file.size,
+                                backups=[submitter.relative(dst) for dst in backup_dsts])
+    print("{0} new jobs, {1} to do".format(new, len(submitter.remaining())))
+    # a farm worker per encode slot, each with a name of its own
+    farms = [EncodeFarm(options.farm, worker="{0}-{1}".format(worker_name(), i)) for i in range(options.jobs)]
+    workers = [threading.Thread(target=work, args=(farm, lambda job, farm=farm: farm_job(farm, job)))
+               for farm in farms]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    failed = [id for id in submitter.done() if submitter.result(id)["ret"] != 0]
+    if failed:
+        print("{0} files failed".format(len(failed)))
+        sys.exit(1)
+
+
+os.makedirs(destination, exist_ok=True)
+queue = EncodeQueue(options.jobs, report=EncodeReport(options.report) if options.report else None,
+                   split_over=options.split_over and options.split_over * 1e9)
+budget = ByteBudget(options.temp_budget * 1e9) if options.temp_budget else None
+if options.farm:
+    run_farm()
+    sys.exit(0)
+
+journal = EncodeJournal(options.journal or os.path.join(destination, JOURNAL_NAME))
+copies = Stage("copy", copy_stage, options.io_jobs)
+encodes = Stage("encode", encode_stage, options.jobs)
+
+# originals that are already gone won't show up in the walk below
+for (src, size, mtime_ns, done) in journal.pending("removed", "copied_back"):
+    resume(src, size, mtime_ns, done)
+
+to_encode = []
+for file in walk_files(source, [".mod"], options.scan_jobs):
+    no_ext_name = os.path.splitext(file.name)[0]
+    relative_dir = file.root[(len(source) + 1):]
+    src = file.path
+
+    processed_dst = os.path.join(destination, relative_dir)
+    backup_dst = os.path.join(backup, relative_dir)
+    processed_file = os.path.join(processed_dst, no_ext_name + ".mp4")
+
+    stat = file.stat()
+    done = journal.done_stages(src, stat.st_size, stat.st_mtime_ns)
+    if "encoded" not in done and queue.encoder.is_encoded(processed_file):
+        # encoded by an earlier run that didn't get to record it
+        journal.mark(src, stat.st_size, stat.st_mtime_ns, "encoded")
+        done.add("encoded")
+    if "encoded" in done and os.path.exists(processed_file):
+        resume(src, stat.st_size, stat.st_mtime_ns, done)
+        continue
+    reason = queue.encoder.skip_reason(src, processed_file)
+    if reason is not None:
+        print("Skipping {0}: {1}".format(src, reason))
+        continue
+    print("Processing {0}".format(src))
+
+    os.makedirs(processed_dst, exist_ok=True)
+    os.makedirs(backup_dst, exist_ok=True)
+
+    to_encode.append((src, processed_file, stat.st_size, stat.st_mtime_ns))
+
+# biggest first, so the batch doesn't end with one long encode
+for job in sorted(to_encode, key=lambda job: job[2], reverse=True):
+    encodes.put(job)
+failed = encodes.close() + copies.close()
+journal.close()
+if failed:
+    print("{0} files failed".format(failed))
+    sys.exit(1)
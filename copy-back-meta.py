@@ -1,27 +1,144 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from optparse import OptionParser
 import os
-from renamer import proper_name
-import shutil
-import sys
-
-# Copies back metadata from backup
-
-backup = sys.argv[1]
-target = sys.argv[2]
-
-for root, dirs, files in os.walk(backup):
-    for file in files:
-        (no_ext_name, ext) = os.path.splitext(file)
-        new_name = no_ext_name + ".mp4"
-        relative_dir = root[(len(backup) + 1):]
-        full_new_name = os.path.join(target, os.path.join(relative_dir, new_name))
-        if not os.path.exists(full_new_name):
-            print("ERROR %s" % (full_new_name,))
-            continue
-        create_time = datetime.fromtimestamp(os.path.getmtime(os.path.join(root, file)))
-        rename_to = proper_name(full_new_name, create_time)
-        if rename_to != full_new_name:
-            shutil.move(full_new_name, rename_to)
-            print("%s => %s" % (full_new_name, rename_to))
+from bulk_rename import RenameBatch
+from catalog import Catalog
+from renamer import proper_names
+from walker import walk_files
 
+# Copies back metadata from backup: encoded files in the library get the name and mtime their original had
+# Both trees are indexed once, matched in memory on relative dir + name without extension, then fixed in batches.
+# example args: [--catalog D:\catalog.sqlite] "D:\backup" "D:\vid"
 
+parser = OptionParser()
+parser.add_option("--catalog", dest="catalog", help="SQLite catalog (see catalog.py) to query instead of walking")
+parser.add_option("-j", "--jobs", dest="jobs", type="int", default=8, help="renames to run at once")
+parser.add_option("-v", "--verbose", dest="verbose", action="store_true", default=False,
+                  help="list every file in the summary")
+(options, args) = parser.parse_args()
+
+backup = args[0]
+target = args[1]
+BATCH_SIZE = 256
+SHOWN_PER_PROBLEM = 10
+
+
+def relative_key(top, path):
+    """ (relative dir, stem), case folded where the filesystem does that. """
+    (root, name) = os.path.split(path)
+    return os.path.normcase(root[(len(top) + 1):]), os.path.normcase(os.path.splitext(name)[0])
+
+
+def index(top, files):
+    """ files as (path, mtime), returns key -> [(path, mtime)]. """
+    by_key = {}
+    for (path, mtime) in files:
+        by_key.setdefault(relative_key(top, path), []).append((path, mtime))
+    return by_key
+
+
+def set_time(action):
+    (_, path, mtime) = action
+    try:
+        os.utime(path, (mtime, mtime))
+        return None
+    except OSError as e:
+        return "%s: %s" % (path, e)
+
+
+catalog = None
+if options.catalog:
+    catalog = Catalog(options.catalog)
+    catalog.refresh(backup)
+    catalog.refresh(target)
+    backup_files = [(path, mtime_ns / 1e9) for (path, _, mtime_ns) in catalog.files(backup)]
+    target_files = [(path, mtime_ns / 1e9) for (path, _, mtime_ns) in catalog.files(target)]
+else:
+    backup_files = [(file.path, file.mtime) for file in walk_files(backup)]
+    target_files = [(file.path, file.mtime) for file in walk_files(target)]
+
+targets = index(target, target_files)
+existing = {os.path.normcase(path): (path, mtime) for (path, mtime) in target_files}
+listed = set(existing)
+problems = {"missing": [], "not mp4": [], "ambiguous": [], "name taken": [], "failed": []}
+matched = []
+unmatched = []
+for (key, originals) in index(backup, backup_files).items():
+    (path, mtime) = originals[0]
+    candidates = targets.get(key, [])
+    mp4s = [candidate for candidate in candidates if candidate[0].lower().endswith(".mp4")]
+    if len(originals) > 1 or len(mp4s) > 1:
+        problems["ambiguous"].append(path)
+    elif mp4s:
+        matched.append((mp4s[0], mtime))
+    elif candidates:
+        problems["not mp4"].append(candidates[0][0])
+    else:
+        relative_dir = os.path.dirname(path)[(len(backup) + 1):]
+        new_name = os.path.splitext(os.path.basename(path))[0] + ".mp4"
+        unmatched.append((os.path.join(target, relative_dir, new_name), mtime))
+
+actions = []
+up_to_date = 0
+# renamed by an earlier run already?
+for ((path, mtime), rename_to) in zip(
+        unmatched, proper_names((path, datetime.fromtimestamp(mtime)) for (path, mtime) in unmatched)):
+    (renamed_path, current_mtime) = existing.get(os.path.normcase(rename_to), (None, None))
+    if renamed_path is None:
+        problems["missing"].append(path)
+    elif int(current_mtime) == int(mtime):
+        up_to_date += 1
+    else:
+        actions.append((renamed_path, renamed_path, mtime))
+for (((path, current_mtime), mtime), rename_to) in zip(
+        matched, proper_names((path, datetime.fromtimestamp(mtime)) for ((path, _), mtime) in matched)):
+    if rename_to == path and int(current_mtime) == int(mtime):
+        up_to_date += 1
+    elif rename_to != path and os.path.normcase(rename_to) in existing:
+        problems["name taken"].append(rename_to)
+    else:
+        existing[os.path.normcase(rename_to)] = (rename_to, mtime)
+        actions.append((path, rename_to, mtime))
+
+# renames go as one journaled batch, bulk_rename.py --rollback undoes it
+renames = RenameBatch(label="copy-back-meta")
+for (path, rename_to, _) in actions:
+    if rename_to != path:
+        renames.add(path, rename_to)
+not_renamed = renames.problems(listed)
+renames.drop(not_renamed)
+not_renamed.update({(src, dst): error for (src, dst, error) in renames.apply(options.jobs)})
+for ((path, rename_to), reason) in not_renamed.items():
+    problems["failed"].append("%s: %s" % (path, reason))
+actions = [action for action in actions if (action[0], action[1]) not in not_renamed]
+if catalog is not None:
+    for (path, rename_to, _) in actions:
+        if rename_to != path:
+            catalog.moved(path, rename_to)
+
+with ThreadPoolExecutor(max_workers=options.jobs) as pool:
+    for start in range(0, len(actions), BATCH_SIZE):
+        batch = actions[start:start + BATCH_SIZE]
+        for ((path, rename_to, mtime), error) in zip(batch, pool.map(set_time, batch)):
+            if error is not None:
+                problems["failed"].append(error)
+            elif catalog is not None:
+                catalog.set_mtime(rename_to, mtime)
+        print("%d of %d fixed" % (min(start + BATCH_SIZE, len(actions)), len(actions)))
+
+if catalog is not None:
+    catalog.close()
+
+renamed = sum(1 for (path, rename_to, _) in actions if rename_to != path)
+print("%d backup files: %d renamed, %d times fixed, %d already fine"
+      % (len(backup_files), renamed, len(actions) - renamed, up_to_date))
+if renames.journal_file:
+    print("renames journaled in " + renames.journal_file)
+for (problem, paths) in problems.items():
+    if paths:
+        print("%d %s:" % (len(paths), problem))
+        for path in (paths if options.verbose else paths[:SHOWN_PER_PROBLEM]):
+            print("  " + path)
+        if not options.verbose and len(paths) > SHOWN_PER_PROBLEM:
+            print("  ... (-v lists all)")
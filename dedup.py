@@ -0,0 +1,198 @@
+__author__ = 'looser'
+
+from concurrent.futures import ThreadPoolExecutor
+from optparse import OptionParser
+import os
+import shutil
+import sqlite3
+
+from catalog import MEDIA_EXTENSIONS
+from file_hash import full_hash, is_fully_covered, partial_hash
+from stat_cache import StatCache
+from transfer import clone_file
+from walker import walk_files, DEFAULT_WORKERS
+
+# Finds byte-identical files anywhere in the library and optionally links the extra copies to one file
+# Files are bucketed by size, a bucket is narrowed down by a hash of head and tail (file_hash.partial_hash),
+# only what is still equal then gets a full hash. Hashes are cached by inode, size and mtime.
+# The listing goes into a temp SQLite db and buckets are hashed a batch at a time, so memory stays flat.
+# example args: [--link hardlink|reflink] [--all] --cache D:\temp\dedup.sqlite "D:\vid" "D:\Pictures"
+
+# files hashed together, the memory used is about this many paths
+BATCH_FILES = 1000
+
+
+class FileRecord:
+    __slots__ = ("path", "size", "dev", "inode", "mtime_ns")
+
+    def __init__(self, path, size, dev, inode, mtime_ns):
+        self.path = path
+        self.size = size
+        self.dev = dev
+        self.inode = inode
+        self.mtime_ns = mtime_ns
+
+    def key(self):
+        return "%d:%d" % (self.dev, self.inode)
+
+    def stamp(self):
+        return "%d:%d" % (self.size, self.mtime_ns)
+
+
+class Deduplicator:
+    """
+    Finds groups of identical files under a set of roots. Hard links of one file count as one file.
+    cache (StatCache) keeps partial and full hashes between runs.
+    """
+    def __init__(self, cache=None, extensions=MEDIA_EXTENSIONS, workers=DEFAULT_WORKERS):
+        self.cache = cache
+        self.extensions = extensions
+        self.workers = workers
+        # "" is a temp db on disk that goes away on close
+        self.db = sqlite3.connect("")
+        self.db.execute("CREATE TABLE files (path TEXT, size INTEGER, dev INTEGER, inode INTEGER, mtime_ns INTEGER)")
+
+    def scan(self, top):
+        """ Lists the files under top, returns how many. """
+        count = 0
+        for file in walk_files(top, self.extensions, self.workers):
+            if file.entry.is_symlink():
+                continue
+            stat = file.stat()
+            if not stat.st_ino:
+                # Windows listings come without inode numbers
+                stat = os.stat(file.path)
+            if stat.st_size == 0:
+                continue
+            self.db.execute("INSERT INTO files VALUES (?, ?, ?, ?, ?)",
+                            (file.path, stat.st_size, stat.st_dev, stat.st_ino, stat.st_mtime_ns))
+            count += 1
+        self.db.commit()
+        return count
+
+    def _buckets(self):
+        """ Lists of FileRecord of equal size, one per inode, only sizes more than one inode has. """
+        rows = self.db.execute("""
+            SELECT path, size, dev, inode, mtime_ns FROM files WHERE size IN
+                (SELECT size FROM files GROUP BY size HAVING COUNT(DISTINCT dev || ':' || inode) > 1)
+            ORDER BY size, dev, inode""")
+        bucket = []
+        for row in rows:
+            record = FileRecord(*row)
+            if bucket and bucket[-1].size != record.size:
+                yield bucket
+                bucket = []
+            if not bucket or bucket[-1].key() != record.key():
+                bucket.append(record)
+        if bucket:
+            yield bucket
+
+    def _hash(self, kind, record):
+        hashed = self.cache.get(kind + ":" + record.key(), record.stamp()) if self.cache is not None else None
+        if hashed is None:
+            hashed = partial_hash(record.path, record.size) if kind == "partial" else full_hash(record.path)
+            if self.cache is not None:
+                self.cache.put(kind + ":" + record.key(), record.stamp(), hashed)
+        return hashed
+
+    def _narrow(self, pool, kind, buckets):
+        """ Splits each bucket by hash, keeps the parts with more than one file. """
+        records = [record for bucket in buckets for record in bucket]
+        hashes = dict(zip((id(record) for record in records), pool.map(lambda r: self._safe_hash(kind, r), records)))
+        narrowed = []
+        for bucket in buckets:
+            by_hash = {}
+            for record in bucket:
+                if hashes[id(record)] is not None:
+                    by_hash.setdefault(hashes[id(record)], []).append(record)
+            narrowed.extend(group for group in by_hash.values() if len(group) > 1)
+        return narrowed
+
+    def _safe_hash(self, kind, record):
+        try:
+            return self._hash(kind, record)
+        except OSError as e:
+            print("cannot read '%s': %s" % (record.path, e))
+            return None
+
+    def groups(self):
+        """ Yields lists of FileRecord with identical content, biggest files last. """
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            batch = []
+            for bucket in self._buckets():
+                batch.append(bucket)
+                if sum(len(bucket) for bucket in batch) >= BATCH_FILES:
+                    yield from self._confirm(pool, batch)
+                    batch = []
+            yield from self._confirm(pool, batch)
+
+    def _confirm(self, pool, buckets):
+        survivors = self._narrow(pool, "partial", buckets)
+        covered = [group for group in survivors if is_fully_covered(group[0].size)]
+        return covered + self._narrow(pool, "full", [group for group in survivors
+                                                     if not is_fully_covered(group[0].size)])
+
+    def close(self):
+        self.db.close()
+
+
+def replace_with_link(keep, duplicate, how):
+    """
+    Replaces duplicate by a hardlink to keep or a reflink of it, through a temp name so duplicate is never missing.
+    A hardlink shares keep's mtime, a reflink keeps duplicate's own. Returns False when keep or duplicate
+    changed since they were hashed.
+    """
+    for record in (keep, duplicate):
+        stat = os.stat(record.path)
+        if (stat.st_size, stat.st_mtime_ns) != (record.size, record.mtime_ns):
+            return False
+    temp = duplicate.path + ".dedup"
+    try:
+        if how == "hardlink":
+            os.link(keep.path, temp)
+        else:
+            clone_file(keep.path, temp)
+            shutil.copystat(duplicate.path, temp)
+        os.replace(temp, duplicate.path)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+    return True
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog [options] dir ...")
+    parser.add_option("--all", dest="all", action="store_true", default=False,
+                      help="every file, not only videos and pictures")
+    parser.add_option("--link", dest="link", help="replace extra copies by a hardlink or reflink to the first one")
+    parser.add_option("--cache", dest="cache", default=os.path.expanduser("~/.dedup-hashes.sqlite"))
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=DEFAULT_WORKERS, help="files to hash at once")
+    (options, args) = parser.parse_args()
+    if options.link not in (None, "hardlink", "reflink"):
+        parser.error("--link is hardlink or reflink")
+
+    cache = StatCache(options.cache, "dedup_hashes")
+    dedup = Deduplicator(cache, None if options.all else MEDIA_EXTENSIONS, options.jobs)
+    listed = sum(dedup.scan(top) for top in args)
+    (groups, extra_bytes, linked) = (0, 0, 0)
+    for group in dedup.groups():
+        # the oldest is most likely the original
+        group.sort(key=lambda record: (record.mtime_ns, record.path))
+        groups += 1
+        extra_bytes += group[0].size * (len(group) - 1)
+        print("%d bytes" % (group[0].size,))
+        for record in group:
+            print("  " + record.path)
+        if options.link:
+            for duplicate in group[1:]:
+                try:
+                    if replace_with_link(group[0], duplicate, options.link):
+                        linked += 1
+                    else:
+                        print("changed since hashed, left alone: %s or %s" % (group[0].path, duplicate.path))
+                except OSError as e:
+                    print("cannot link '%s': %s" % (duplicate.path, e))
+    dedup.close()
+    cache.close()
+    print("%d files, %d duplicate groups, %.1f GB in extra copies%s"
+          % (listed, groups, extra_bytes / 1e9, ", %d linked" % (linked,) if options.link else ""))
@@ -0,0 +1,257 @@
+__author__ = 'looser'
+
+import hashlib
+import json
+import os
+import random
+import socket
+import threading
+import time
+
+# Jobs shared by encode workers on any number of hosts that mount the same share, no server needed.
+# The farm dir holds:
+#   manifest/<id>.json  one file per job, written once by whoever finds the source first
+#   locks/<id>.lock     claim of a worker, created with O_EXCL, its mtime is the lease and gets renewed
+#   state/<id>.<stage>  steps done so far, so a job taken over from a dead worker doesn't redo them
+#   done/<id>.json      result, written with a rename, so writing it twice does no harm
+#   clock/<worker>      touched to read the file server's time, lock mtimes are the server's time too
+# Paths in jobs are relative to the farm dir, so hosts that mount the share elsewhere still agree on them.
+
+# a claim not renewed for this long belongs to a dead worker and is taken over
+LEASE = 600
+
+
+def worker_name():
+    return "%s-%d" % (socket.gethostname(), os.getpid())
+
+
+def job_id(relative_source):
+    return hashlib.sha1(relative_source.encode("utf-8")).hexdigest()
+
+
+def _write_atomic(path, data):
+    part = "%s.%s.tmp" % (path, worker_name())
+    with open(part, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(part, path)
+
+
+class FarmJob:
+    """
+    A claimed job. data is what was submitted: source, target (both relative to the farm dir), size and whatever
+    else the submitter added. source and target are those paths on this host.
+    """
+    def __init__(self, farm, id, data, token):
+        self.farm = farm
+        self.id = id
+        self.data = data
+        self.token = token
+        self.source = farm.resolve(data["source"])
+        self.target = farm.resolve(data["target"])
+        self.lock_file = farm.path("locks", id + ".lock")
+        # set once a heartbeat finds the job taken over, the other worker then owns its result
+        self.lost = False
+
+    def done_stages(self):
+        prefix = self.id + "."
+        return {name[len(prefix):] for name in os.listdir(self.farm.path("state")) if name.startswith(prefix)}
+
+    def mark(self, stage):
+        open(self.farm.path("state", "%s.%s" % (self.id, stage)), "a").close()
+
+    def owned(self):
+        try:
+            with open(self.lock_file, encoding="utf-8") as f:
+                return f.read() == self.token
+        except OSError:
+            return False
+
+    def heartbeat(self):
+        """ Renews the lease, False when another worker took the job over meanwhile. """
+        if self.lost or not self.owned():
+            self.lost = True
+            return False
+        os.utime(self.lock_file)
+        return True
+
+    def finish(self, ret):
+        """ Records the result and gives up the claim. A job finished twice keeps the last result. """
+        _write_atomic(self.farm.path("done", self.id + ".json"),
+                      {"ret": ret, "worker": self.farm.worker, "finished": time.time()})
+        self.release()
+
+    def release(self):
+        """ Gives up the claim without a result, the job goes back to the queue. """
+        if self.owned():
+            os.remove(self.lock_file)
+
+
+class EncodeFarm:
+    """
+    Work queue in a dir on a shared filesystem. Workers claim() jobs, biggest first, with an O_EXCL lock file
+    per job. Claims live for lease seconds past the last heartbeat, after that any worker may take the job over.
+    """
+    def __init__(self, farm_dir, lease=LEASE, worker=None):
+        self.farm_dir = farm_dir
+        self.lease = lease
+        self.worker = worker or worker_name()
+        self.jobs = {}
+        for sub in ("manifest", "locks", "state", "done", "clock"):
+            os.makedirs(self.path(sub), exist_ok=True)
+
+    def path(self, *parts):
+        return os.path.join(self.farm_dir, *parts)
+
+    def relative(self, path):
+        """
+        path as stored in jobs: relative to the farm dir with / separators. A path on another drive than the farm
+        (Windows) can't be made relative and stays absolute.
+        """
+        try:
+            relative = os.path.relpath(os.path.abspath(path), os.path.abspath(self.farm_dir))
+        except ValueError:
+            return os.path.abspath(path)
+        return relative.replace(os.sep, "/")
+
+    def resolve(self, path):
+        """ Path on this host of a path stored in a job. """
+        return os.path.normpath(os.path.join(self.farm_dir, path.replace("/", os.sep)))
+
+    def submit(self, source, target, size, **extra):
+        """
+        Adds a job unless one for source is there already, returns True if it was new. Jobs are keyed on the
+        relative source, so the same file submitted by hosts with other mount points is one job.
+        """
+        source = self.relative(source)
+        id = job_id(source)
+        data = dict(extra, source=source, target=self.relative(target), size=size)
+        try:
+            fd = os.open(self.path("manifest", id + ".json"), os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        return True
+
+    def _load(self):
+        """ Jobs of the manifest, job files are never changed once written so each is read once. """
+        for name in os.listdir(self.path("manifest")):
+            id = name[:-len(".json")]
+            if name.endswith(".json") and id not in self.jobs:
+                try:
+                    with open(self.path("manifest", name), encoding="utf-8") as f:
+                        self.jobs[id] = json.load(f)
+                except ValueError:
+                    # still being written by its submitter
+                    pass
+        return self.jobs
+
+    def done(self):
+        return {name[:-len(".json")] for name in os.listdir(self.path("done")) if name.endswith(".json")}
+
+    def result(self, id):
+        with open(self.path("done", id + ".json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def remaining(self):
+        """ Ids of jobs without a result yet, claimed or not. """
+        return set(self._load()) - self.done()
+
+    def now(self):
+        """ The file server's clock, so hosts with skewed clocks agree on when a lease runs out. """
+        clock = self.path("clock", self.worker)
+        open(clock, "a").close()
+        os.utime(clock)
+        return os.stat(clock).st_mtime
+
+    def claim(self):
+        """ Takes the biggest job that nobody holds, or a dead worker's. None when there is none right now. """
+        remaining = self.remaining()
+        locked = set(name[:-len(".lock")] for name in os.listdir(self.path("locks")) if name.endswith(".lock"))
+        # unlocked ones first, ties shuffled so workers starting together don't all race for the same job
+        order = sorted(remaining, key=lambda id: (id in locked, -self.jobs[id]["size"], random.random()))
+        now = None
+        for id in order:
+            if id in locked:
+                now = now or self.now()
+                if not self._steal(id, now):
+                    continue
+            token = "%s %f" % (self.worker, time.time())
+            try:
+                fd = os.open(self.path("locks", id + ".lock"), os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+            except FileExistsError:
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(token)
+            if id in self.done():
+                # finished by someone while we were looking
+                os.remove(self.path("locks", id + ".lock"))
+                continue
+            return FarmJob(self, id, self.jobs[id], token)
+        return None
+
+    def _steal(self, id, now):
+        """ Removes the lock of id if its lease ran out, True if the job can be claimed now. """
+        lock = self.path("locks", id + ".lock")
+        try:
+            stat = os.stat(lock)
+        except FileNotFoundError:
+            return True
+        if stat.st_mtime + self.lease > now:
+            return False
+        # rename, so of several workers seeing the same dead lock only one gets it out of the way
+        stale = "%s.stale-%s" % (lock, self.worker)
+        try:
+            os.rename(lock, stale)
+        except FileNotFoundError:
+            return True
+        if os.stat(stale).st_mtime + self.lease > now:
+            # someone else already replaced the dead lock with a fresh one, put it back
+            try:
+                os.link(stale, lock)
+            except FileExistsError:
+                pass
+            os.remove(stale)
+            return False
+        os.remove(stale)
+        print("Taking over %s from a dead worker" % (self.jobs[id]["source"],))
+        return True
+
+
+def work(farm, process, poll=30):
+    """
+    Claims and processes jobs until every job in the farm has a result. process(job) returns the exit code.
+    While it runs the claim is renewed every lease / 4 seconds, process should stop short of steps that mustn't
+    run twice once job.heartbeat() says the claim is lost. Returns number of jobs this worker finished.
+    """
+    finished = 0
+    while True:
+        job = farm.claim()
+        if job is None:
+            if not farm.remaining():
+                return finished
+            # the rest is claimed, wait in case one of those workers dies
+            time.sleep(poll)
+            continue
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(farm.lease / 4):
+                if not job.heartbeat():
+                    print("Lost claim on %s" % (job.data["source"],))
+                    return
+        beating = threading.Thread(target=heartbeat, daemon=True)
+        beating.start()
+        try:
+            ret = process(job)
+        except BaseException:
+            stop.set()
+            job.release()
+            raise
+        stop.set()
+        beating.join()
+        if job.lost:
+            # its result is up to the worker that took it over
+            continue
+        job.finish(ret)
+        finished += 1
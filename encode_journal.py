@@ -0,0 +1,50 @@
+__author__ = 'looser'
+
+import sqlite3
+import threading
+
+JOURNAL_NAME = ".encode-journal.sqlite"
+
+
+class EncodeJournal:
+    """
+    Remembers which stages of the encode pipeline are done for every source file, keyed by path, size and mtime.
+    A journal entry for a file that changed since is dropped, so the file is processed from scratch.
+    """
+    def __init__(self, db_file):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_file, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS stages ("
+                        "source TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, stage TEXT NOT NULL, "
+                        "PRIMARY KEY (source, stage))")
+        self.db.commit()
+
+    def done_stages(self, source, size, mtime_ns):
+        """ Set of stages finished for this exact version of source. """
+        with self.lock:
+            rows = self.db.execute("SELECT size, mtime_ns, stage FROM stages WHERE source = ?", (source,)).fetchall()
+            if any((row_size, row_mtime) != (size, mtime_ns) for (row_size, row_mtime, _) in rows):
+                self.db.execute("DELETE FROM stages WHERE source = ?", (source,))
+                self.db.commit()
+                return set()
+            return {stage for (_, _, stage) in rows}
+
+    def mark(self, source, size, mtime_ns, stage):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?)", (source, size, mtime_ns, stage))
+            self.db.commit()
+
+    def pending(self, started_stage, final_stage):
+        """ Lists (source, size, mtime_ns, stages) for files that got past started_stage but not to final_stage. """
+        with self.lock:
+            rows = self.db.execute("SELECT source, size, mtime_ns, stage FROM stages WHERE source IN "
+                                   "(SELECT source FROM stages WHERE stage = ? EXCEPT "
+                                   "SELECT source FROM stages WHERE stage = ?) ORDER BY source",
+                                   (started_stage, final_stage)).fetchall()
+        entries = {}
+        for (source, size, mtime_ns, stage) in rows:
+            entries.setdefault((source, size, mtime_ns), set()).add(stage)
+        return [key + (stages,) for (key, stages) in entries.items()]
+
+    def close(self):
+        self.db.close()
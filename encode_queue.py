@@ -0,0 +1,101 @@
+__author__ = 'looser'
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from hb_encoder import HbEncoder
+
+
+def default_workers():
+    # x264 already spreads one encode over several cores, so one job per 4 cores keeps the box busy
+    return max(1, (os.cpu_count() or 1) // 4)
+
+
+def _hms(seconds):
+    return "%02d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class ProgressBoard:
+    """
+    Progress of all jobs of a queue, printed as one status line with the ETA of the whole batch.
+    The batch ETA assumes the remaining bytes encode as fast as the ones done so far.
+    """
+    def __init__(self, print_every=30):
+        self.print_every = print_every
+        self.lock = threading.Lock()
+        self.sizes = {}
+        self.running = {}
+        self.finished_bytes = 0
+        self.started = None
+        self.printed = 0
+
+    def queued(self, source, size):
+        self.sizes[source] = size
+
+    def update(self, source, progress):
+        with self.lock:
+            if self.started is None:
+                self.started = time.time()
+            self.running[source] = progress
+            if time.time() - self.printed >= self.print_every:
+                self.printed = time.time()
+                print(self.status(), flush=True)
+
+    def finished(self, source):
+        with self.lock:
+            self.running.pop(source, None)
+            self.finished_bytes += self.sizes.get(source, 0)
+
+    def status(self):
+        total = sum(self.sizes.values())
+        done = self.finished_bytes + sum(self.sizes.get(source, 0) * progress.percent / 100
+                                         for (source, progress) in self.running.items())
+        fps = sum(progress.fps or 0 for progress in self.running.values())
+        elapsed = time.time() - (self.started or time.time())
+        eta = (total - done) * elapsed / done if done else None
+        return "%d running, %.1f%% of %.1f GB, %.0f fps, batch ETA %s" % (
+            len(self.running), 100.0 * done / total if total else 0, total / 1e9, fps,
+            _hms(eta) if eta is not None else "?")
+
+
+class EncodeQueue:
+    """
+    Runs several HandBrake encodes at once. Biggest sources go first so the batch doesn't end with one long job.
+    Without an encoder given, HandBrake progress feeds the ProgressBoard and metrics go to report (EncodeReport),
+    sources bigger than split_over bytes are encoded in segments (see HbEncoder).
+    """
+    def __init__(self, workers=None, encoder=None, report=None, split_over=None):
+        self.workers = workers or default_workers()
+        self.board = ProgressBoard()
+        self.encoder = encoder or HbEncoder(on_progress=self.board.update, report=report, split_over=split_over)
+        self.jobs = []
+
+    def add(self, source, target, on_done=None, size=None):
+        """ Queues an encode, on_done(source, target, ret) is called from the worker once this job has finished. """
+        size = os.path.getsize(source) if size is None else size
+        self.board.queued(source, size)
+        self.jobs.append((size, source, target, on_done))
+
+    def run(self):
+        """ Encodes everything queued so far, returns list of (source, target, ret) in the order jobs were run. """
+        jobs = sorted(self.jobs, key=lambda job: job[0], reverse=True)
+        self.jobs = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(self._encode, source, target, on_done) for (_, source, target, on_done) in jobs]
+        return [future.result() for future in futures]
+
+    def encode(self, source, target, size=None):
+        """ Encodes one file right away in the calling thread, with progress on the board. Returns exit code. """
+        if size is not None:
+            self.board.queued(source, size)
+        ret = self.encoder.encode(source, target)
+        self.board.finished(source)
+        return ret
+
+    def _encode(self, source, target, on_done):
+        ret = self.encode(source, target)
+        if on_done is not None:
+            on_done(source, target, ret)
+        return source, target, ret
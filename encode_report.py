@@ -0,0 +1,51 @@
+__author__ = 'looser'
+
+import csv
+import json
+import os
+import threading
+from datetime import datetime
+
+
+class EncodeMetrics:
+    """ Numbers about one finished encode, used to tune concurrency and presets. """
+    FIELDS = ("source", "target", "ret", "started", "duration", "avg_fps", "input_bytes", "output_bytes", "ratio")
+
+    def __init__(self, source, target, ret, started, duration, avg_fps, input_bytes, output_bytes):
+        self.source = source
+        self.target = target
+        self.ret = ret
+        self.started = started
+        self.duration = duration
+        self.avg_fps = avg_fps
+        self.input_bytes = input_bytes
+        self.output_bytes = output_bytes
+        self.ratio = round(input_bytes / output_bytes, 3) if output_bytes else None
+
+    @staticmethod
+    def measure(source, target, ret, started, finished, avg_fps):
+        return EncodeMetrics(source, target, ret, datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+                             round(finished - started, 1), avg_fps,
+                             os.path.getsize(source), os.path.getsize(target) if os.path.exists(target) else 0)
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+
+class EncodeReport:
+    """ Appends EncodeMetrics to a CSV file, or as JSON lines when the file name ends with .json. """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def add(self, metrics):
+        with self.lock:
+            is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            with open(self.path, "a", newline="", encoding="utf-8") as f:
+                if self.path.lower().endswith(".json"):
+                    f.write(json.dumps(metrics.as_dict()) + "\n")
+                    return
+                writer = csv.DictWriter(f, fieldnames=EncodeMetrics.FIELDS)
+                if is_new:
+                    writer.writeheader()
+                writer.writerow(metrics.as_dict())
@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+# Stand-in for HandBrakeCLI in benchmarks: copies -i to -o and prints progress the way HandBrake does
+# example: HANDBRAKE_CLI=./fake_handbrake.py python3 copy-and-encode.py ...
+import shutil
+import sys
+
+args = sys.argv[1:]
+shutil.copyfile(args[args.index("-i") + 1], args[args.index("-o") + 1])
+sys.stdout.write("Encoding: task 1 of 1, 50.00 %\r")
+sys.stdout.write("Encoding: task 1 of 1, 100.00 % (1000.00 fps, avg 1000.00 fps, ETA 00h00m00s)\r")
+sys.stdout.write("\nEncode done!\n")
@@ -0,0 +1,31 @@
+__author__ = 'looser'
+
+import hashlib
+
+CHUNK_SIZE = 1024 * 1024
+# bytes hashed from each end of a file by partial_hash
+EDGE_SIZE = 64 * 1024
+
+
+def partial_hash(path, size):
+    """ Hash of the first and last EDGE_SIZE bytes, cheap way to tell most same-sized files apart. """
+    h = hashlib.blake2b(str(size).encode())
+    with open(path, "rb") as f:
+        h.update(f.read(EDGE_SIZE))
+        if size > EDGE_SIZE:
+            f.seek(max(EDGE_SIZE, size - EDGE_SIZE))
+            h.update(f.read(EDGE_SIZE))
+    return h.hexdigest()
+
+
+def is_fully_covered(size):
+    """ True when partial_hash already read every byte of a file this size. """
+    return size <= 2 * EDGE_SIZE
+
+
+def full_hash(path):
+    h = hashlib.blake2b()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
@@ -1,68 +1,370 @@
 __author__ = 'looser'
 
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import json
 import os
 import re
 import shutil
+import tempfile
+import threading
+import time
+import zipfile
 from datetime import datetime
+from optparse import OptionParser
 
-def copy_with_new_name(source, copy_dir):
-    file_name = os.path.basename(source)
+from file_hash import full_hash, is_fully_covered, partial_hash, EDGE_SIZE
+from stat_cache import StatCache
+from transfer import copy_file, CHUNK_SIZE, PART_SUFFIX
+from walker import walk_dirs
+
+class CopyDirIndex:
+    """
+    Files already in copy_dir, grouped by size. Hashes are only computed for files whose size clashes,
+    first over head and tail, then over the whole file.
+    """
+    def __init__(self, copy_dir):
+        self.by_size = {}
+        self.names = set()
+        self.hashes = {}
+        # taken around name picking, and per size around check and copy when copies run in threads
+        self.lock = threading.Lock()
+        self.size_locks = {}
+        with os.scandir(copy_dir) as entries:
+            for entry in entries:
+                # copies out of zips that a crash left unfinished are not content of copy_dir
+                if entry.is_file() and not entry.name.endswith(PART_SUFFIX):
+                    self.add(entry.path, entry.stat().st_size)
+
+    def add(self, path, size):
+        self.by_size.setdefault(size, []).append(path)
+        self.names.add(os.path.normcase(os.path.basename(path)))
+
+    def size_lock(self, size):
+        with self.lock:
+            return self.size_locks.setdefault(size, threading.Lock())
+
+    def _hash(self, kind, path, size):
+        key = (kind, path)
+        if key not in self.hashes:
+            self.hashes[key] = partial_hash(path, size) if kind == 'partial' else full_hash(path)
+        return self.hashes[key]
+
+    def find_duplicate(self, source, size):
+        """ Path of a file in copy_dir with the same content as source, None if there is none. """
+        return self.duplicate_of(size, lambda: partial_hash(source, size), lambda: full_hash(source))
+
+    def duplicate_of(self, size, partial, full):
+        """
+        Like find_duplicate for content that is not a file, partial() and full() give its partial_hash
+        and full_hash. They are only called when a file of the same size is there.
+        """
+        candidates = self.by_size.get(size, [])
+        if candidates:
+            partial_value = partial()
+            candidates = [c for c in candidates if self._hash('partial', c, size) == partial_value]
+        if candidates and not is_fully_covered(size):
+            full_value = full()
+            candidates = [c for c in candidates if self._hash('full', c, size) == full_value]
+        return candidates[0] if candidates else None
+
+
+def copy_with_new_name(source, copy_dir, index=None):
+    """ Copies source into copy_dir unless the same content is there already, renames on name clashes. """
+    if index is None:
+        index = CopyDirIndex(copy_dir)
+    size = os.path.getsize(source)
+    duplicate = index.find_duplicate(source, size)
+    if duplicate is not None:
+        print("Skip duplicate: %s = %s" % (source, duplicate))
+        return duplicate
+
+    copy_to = free_name(os.path.basename(source), copy_dir, index)
+    copy_file(source, copy_to)
+    index.add(copy_to, size)
+    return copy_to
+
+
+def free_name(file_name, copy_dir, index):
+    """ Path for file_name in copy_dir that is not taken yet, with _1, _2, ... added on clashes. """
     copy_to = os.path.join(copy_dir, file_name)
 
     # Check if the destination file already exists
     counter = 1
-    while os.path.exists(copy_to):
+    while os.path.normcase(os.path.basename(copy_to)) in index.names:
         # If it does, create a new file name with a counter
         new_file_name = f"{os.path.splitext(file_name)[0]}_{counter}{os.path.splitext(file_name)[1]}"
         copy_to = os.path.join(copy_dir, new_file_name)
         counter += 1
         print("New filename: " + copy_to)
-
-    shutil.copy(source, copy_to)
+    return copy_to
 
 copy_dir = 'D:\\temp\\copy'
 work_dir = 'D:\\temp\\Google Фото'
+# creation times already read from the JSON sidecars, so runs with another date window don't parse them again
+cache_file = 'D:\\temp\\takeout-timestamps.sqlite'
 suffixes = ('-измененный', '-', '(1)', '(2)', '(3)', '(4)', '2', '9', '4')
-for root, dirs, files in os.walk(work_dir):
-    for file in files:
-        if file.endswith("json"):
-            continue
-        full_name = os.path.join(root, file)
-        file_name, extension = os.path.splitext(full_name)
-
-        names_to_test = [file_name + extension + '.json', file_name + '.json']
-        for s in suffixes:
-            if file_name.endswith(s):
-                shortened = re.sub(re.escape(s) + '$', '', file_name)
-                names_to_test.append(shortened + extension + '.json')
-                names_to_test.append(shortened + '.json')
-                names_to_test.append(shortened + extension + s + '.json')
-
-        json_name = False
-        for name in names_to_test:
-            if os.path.isfile(name):
-                json_name = name
-                break
-
-        if file.endswith('.MP') or file.endswith('.MP~2'):
-            json_name = full_name + '.jpg.json'
-
-        if not json_name:
-            print("Skip no JSON: " + full_name)
-            continue
-
-        with open(json_name) as fp:
-            data = json.load(fp)
-            if not data['creationTime']['timestamp']:
-                print("No timestamp: " + json_name)
-            date = datetime.fromtimestamp(int(data['creationTime']['timestamp']))
-            if date < datetime(2022, 12, 1) or date >= datetime(2023, 12, 10):
+
+
+def sidecar_index(files):
+    """
+    Maps JSON sidecar stems (file name without .json) of one directory to their entries. Keys are normcase'd,
+    so on Windows IMG_1.jpg finds IMG_1.JPG.JSON as the filesystem would.
+    """
+    names = ((os.path.normcase(file.name), file) for file in files)
+    return {name[:-len('.json')]: file for (name, file) in names if name.endswith(os.path.normcase('.json'))}
+
+
+def find_sidecar(file_name, sidecars):
+    """ Finds the JSON that Takeout wrote for the media file, the name is often shortened or suffixed. """
+    if file_name.endswith('.MP') or file_name.endswith('.MP~2'):
+        return sidecars.get(os.path.normcase(file_name + '.jpg'))
+
+    name, extension = os.path.splitext(file_name)
+    stems_to_test = [name + extension, name]
+    for s in suffixes:
+        if name.endswith(s):
+            shortened = re.sub(re.escape(s) + '$', '', name)
+            stems_to_test.append(shortened + extension)
+            stems_to_test.append(shortened)
+            stems_to_test.append(shortened + extension + s)
+
+    for stem in map(os.path.normcase, stems_to_test):
+        if stem in sidecars:
+            return sidecars[stem]
+    return None
+
+
+def creation_timestamp(sidecar, cache):
+    """ creationTime.timestamp from the sidecar JSON, '' when it has none. """
+    mtime = sidecar.stat().st_mtime_ns
+    timestamp = cache.get(sidecar.path, mtime)
+    if timestamp is None:
+        with open(sidecar.path) as fp:
+            timestamp = json.load(fp)['creationTime']['timestamp']
+        cache.put(sidecar.path, mtime, timestamp)
+    return timestamp
+
+
+# zip flag for names stored as UTF-8, without it zipfile decodes them as cp437
+ZIP_UTF8_FLAG = 0x800
+
+
+def member_name(info):
+    """ Name of a zip member, also for zippers that write UTF-8 names without setting the flag. """
+    if info.flag_bits & ZIP_UTF8_FLAG:
+        return info.filename
+    try:
+        return info.filename.encode('cp437').decode('utf-8')
+    except UnicodeError:
+        return info.filename
+
+
+class ZipMember:
+    """ File inside a Takeout zip, with the name/path/size of walker.LibraryFile that the matching code uses. """
+    def __init__(self, archive, info):
+        self.archive = archive
+        self.info = info
+        self.filename = member_name(info)
+        self.name = self.filename.rpartition('/')[2]
+        self.path = os.path.join(archive, self.filename)
+        self.size = info.file_size
+
+
+class ZipReader:
+    """ Opens members with one ZipFile per archive and thread, so threads don't fight over one file position. """
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.opened = []
+
+    def open(self, member):
+        handles = self.local.__dict__.setdefault('handles', {})
+        if member.archive not in handles:
+            handles[member.archive] = zipfile.ZipFile(member.archive)
+            with self.lock:
+                self.opened.append(handles[member.archive])
+        return handles[member.archive].open(member.info)
+
+    def close(self):
+        for handle in self.opened:
+            handle.close()
+
+
+def list_archive(archive):
+    """ Members of one zip as (dir inside the export, [ZipMember]) pairs, only the central directory is read. """
+    dirs = {}
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            if not info.is_dir():
+                member = ZipMember(archive, info)
+                dirs.setdefault(member.filename.rpartition('/')[0], []).append(member)
+    return dirs
+
+
+def zip_dirs(archives, workers=4):
+    """
+    Members of all archives grouped by dir like walk_dirs does. Takeout splits one album over several zips,
+    a sidecar may sit in another archive than its media file, so the dirs are merged across archives.
+    """
+    dirs = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for listed in pool.map(list_archive, archives):
+            for (root, members) in listed.items():
+                dirs.setdefault(root, []).extend(members)
+    return sorted(dirs.items())
+
+
+def member_timestamp(member, reader, cache):
+    """ creationTime.timestamp from a sidecar inside a zip, cached by member name and CRC. """
+    stamp = "%d:%d" % (member.info.CRC, member.size)
+    timestamp = cache.get(member.filename, stamp)
+    if timestamp is None:
+        with reader.open(member) as fp:
+            timestamp = json.load(fp)['creationTime']['timestamp']
+        cache.put(member.filename, stamp, timestamp)
+    return timestamp
+
+
+def archive_timestamps(sidecars, reader, cache, workers=4):
+    """ Reads the given sidecar members, each archive in a thread of its own. Returns {member path: timestamp}. """
+    by_archive = {}
+    for sidecar in sidecars:
+        by_archive.setdefault(sidecar.archive, []).append(sidecar)
+
+    def read_archive(members):
+        # central directory order, so the reads go forward through the archive
+        members.sort(key=lambda member: member.info.header_offset)
+        return [(member.path, member_timestamp(member, reader, cache)) for member in members]
+
+    timestamps = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for pairs in pool.map(read_archive, by_archive.values()):
+            timestamps.update(pairs)
+    return timestamps
+
+
+def member_hashes(member, reader):
+    """ (partial_hash, full_hash) of a zip member's content, as file_hash computes them for files, in one read. """
+    partial = hashlib.blake2b(str(member.size).encode())
+    full = hashlib.blake2b()
+    (head, tail) = (b'', b'')
+    with reader.open(member) as src:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+            full.update(chunk)
+            if len(head) < EDGE_SIZE:
+                head += chunk[:EDGE_SIZE - len(head)]
+            tail = (tail + chunk)[-EDGE_SIZE:]
+    partial.update(head)
+    if member.size > EDGE_SIZE:
+        # partial_hash doesn't read the head twice when the file is shorter than two edges
+        partial.update(tail[max(0, 2 * EDGE_SIZE - member.size):])
+    return partial.hexdigest(), full.hexdigest()
+
+
+def copy_member(member, reader, copy_dir, index):
+    """
+    Streams a zip member into copy_dir, like copy_with_new_name does for extracted files. When copy_dir holds
+    files of the same size the member is hashed on the way through first and only written if none of them
+    has the same content. Safe to call from several threads: members of the same size go one at a time,
+    so duplicates among them are still found.
+    """
+    with index.size_lock(member.size):
+        hashes = []
+
+        def hashed(kind):
+            if not hashes:
+                hashes.extend(member_hashes(member, reader))
+            return hashes[kind]
+        duplicate = index.duplicate_of(member.size, lambda: hashed(0), lambda: hashed(1))
+        if duplicate is not None:
+            print("Skip duplicate: %s = %s" % (member.path, duplicate))
+            return duplicate
+        (handle, part) = tempfile.mkstemp(PART_SUFFIX, '.' + member.name, copy_dir)
+        try:
+            with reader.open(member) as src, os.fdopen(handle, 'wb') as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            # what unzipping would have set
+            mtime = time.mktime(member.info.date_time + (0, 0, -1))
+            os.utime(part, (mtime, mtime))
+        except BaseException:
+            os.remove(part)
+            raise
+        with index.lock:
+            copy_to = free_name(member.name, copy_dir, index)
+            index.add(copy_to, member.size)
+        os.replace(part, copy_to)
+        return copy_to
+
+
+def selected(dirs, timestamp_of, date_from, date_to):
+    """ Media files of dirs ((root, files) pairs) whose sidecar dates them to [date_from, date_to). """
+    for root, files in dirs:
+        sidecars = sidecar_index(files)
+        for file in files:
+            if file.name.endswith("json"):
+                continue
+
+            json_file = find_sidecar(file.name, sidecars)
+            if json_file is None:
+                print("Skip no JSON: " + file.path)
+                continue
+
+            timestamp = timestamp_of(json_file)
+            if not timestamp:
+                print("No timestamp: " + json_file.path)
+                continue
+            date = datetime.fromtimestamp(int(timestamp))
+            if date < date_from or date >= date_to:
                 # print('Skip cuz date outside: %s / %s' % (date, file))
                 continue
+            yield file
+
+
+def copy_from_archives(archives, copy_dir, index, cache, date_from, date_to, workers=4, archive_workers=4):
+    """ Copies the media of Takeout zips that fall in the date window without unpacking anything else. """
+    dirs = zip_dirs(archives, archive_workers)
+    reader = ZipReader()
+    needed = []
+    for (_, members) in dirs:
+        sidecars = sidecar_index(members)
+        needed.extend(sidecar for sidecar in (find_sidecar(member.name, sidecars) for member in members
+                                              if not member.name.endswith("json")) if sidecar is not None)
+    try:
+        timestamps = archive_timestamps(needed, reader, cache, archive_workers)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            copies = [pool.submit(copy_member, member, reader, copy_dir, index)
+                      for member in selected(dirs, lambda sidecar: timestamps[sidecar.path], date_from, date_to)]
+        for copy in copies:
+            copy.result()
+    finally:
+        reader.close()
+
 
-        file_name = os.path.basename(full_name)
-        copy_to = os.path.join(copy_dir, file_name)
-        if not os.path.exists(copy_to):
-            shutil.copy(full_name, copy_to)
+if __name__ == "__main__":
+    # example args: --from 2022-12-01 --to 2023-12-10 "D:\temp\Google Фото" "D:\temp\copy"
+    # Takeout zips found under work dir are read in place, no need to extract them first
+    parser = OptionParser()
+    parser.add_option("--from", dest="date_from", default="2022-12-01", help="first day to copy")
+    parser.add_option("--to", dest="date_to", default="2023-12-10", help="day after the last one to copy")
+    parser.add_option("--cache", dest="cache_file", default=cache_file)
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=4, help="copies out of zips to run at once")
+    parser.add_option("--archives", dest="archives", type="int", default=4, help="zips to read at once")
+    (options, args) = parser.parse_args()
+    if args:
+        (work_dir, copy_dir) = args
+    date_from = datetime.strptime(options.date_from, "%Y-%m-%d")
+    date_to = datetime.strptime(options.date_to, "%Y-%m-%d")
 
+    cache = StatCache(options.cache_file, "sidecar_timestamps")
+    index = CopyDirIndex(copy_dir)
+    archives = []
+    extracted = []
+    for root, files in walk_dirs(work_dir):
+        archives.extend(file.path for file in files if file.name.lower().endswith(".zip"))
+        extracted.append((root, [file for file in files if not file.name.lower().endswith(".zip")]))
+    for file in selected(extracted, lambda sidecar: creation_timestamp(sidecar, cache), date_from, date_to):
+        copy_with_new_name(file.path, copy_dir, index)
+    if archives:
+        copy_from_archives(archives, copy_dir, index, cache, date_from, date_to, options.jobs, options.archives)
+    cache.close()
@@ -1,32 +1,34 @@
 __author__ = 'looser'
 from optparse import OptionParser
 import os
-import shutil
 import re
+import sys
+
+from move_plan import MovePlan, run_plan
 
 # Moves YYYMMDD folders into year subfolders
 # example args: "D:\Pictures"
 # will move /2012.01.01 to /2012/01.01
+# the whole move is planned and checked first, -n only prints the plan
 
 parser = OptionParser()
+parser.add_option("-n", "--dry-run", dest="dry_run", action="store_true", default=False)
+parser.add_option("-k", "--skip-problems", dest="skip_problems", action="store_true", default=False,
+                  help="move everything else when some moves would fail")
+parser.add_option("-j", "--jobs", dest="jobs", type="int", default=4, help="renames to run at once")
 
-(_, args) = parser.parse_args()
+(options, args) = parser.parse_args()
 
 target = args[0]
 
-for file in os.listdir(target):
-    match = re.match("^(\d{4})\.", file)
-    src = os.path.join(target, file)
-    if match and os.path.isdir(src):
-        year = match.group(1)
-        year_dir = os.path.join(target, year)
-        dst = os.path.join(year_dir, file.replace(year + ".", ""))
-        print("{0} => {1}".format(src, dst))
-        os.makedirs(year_dir, exist_ok=True)
-        shutil.move(src, dst)
-
-
-
-
-
-
+plan = MovePlan()
+with os.scandir(target) as entries:
+    for entry in entries:
+        match = re.match("^(\d{4})\.", entry.name)
+        if match and entry.is_dir():
+            year = match.group(1)
+            year_dir = os.path.join(target, year)
+            plan.add(entry.path, os.path.join(year_dir, entry.name.replace(year + ".", "")))
+
+if not run_plan(plan, options.dry_run, options.skip_problems, options.jobs):
+    sys.exit(1)
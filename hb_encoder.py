@@ -1,21 +1,204 @@
 __author__ = 'looser'
 
-from subprocess import call
+from concurrent.futures import ThreadPoolExecutor
+import os
+import re
+import shutil
+import threading
+import time
+from subprocess import Popen, PIPE, DEVNULL, call
+
+from encode_report import EncodeMetrics
+import media_probe
+
+HANDBRAKE_CLI = os.environ.get("HANDBRAKE_CLI", "C:/Program Files/Handbrake/HandBrakeCLI.exe")
+FFMPEG = os.environ.get("FFMPEG", "ffmpeg")
+# segment encodes of target go to target + this, scripts watching the target dir should leave it alone
+SEGMENTS_SUFFIX = ".segments"
+# what HandBrakeCLI prints on stdout while encoding, the part in brackets only shows up after a few seconds
+PROGRESS = re.compile(r"Encoding: task (\d+) of (\d+), ([\d.]+) %"
+                      r"(?: \(([\d.]+) fps, avg ([\d.]+) fps, ETA (\d+)h(\d+)m(\d+)s\))?")
+
+
+class EncodeProgress:
+    """ One progress line of HandBrakeCLI. fps, avg_fps and eta (seconds) are None until HandBrake knows them. """
+    def __init__(self, percent, fps=None, avg_fps=None, eta=None):
+        self.percent = percent
+        self.fps = fps
+        self.avg_fps = avg_fps
+        self.eta = eta
+
+    @staticmethod
+    def parse(line):
+        match = PROGRESS.search(line)
+        if not match:
+            return None
+        # with several passes/tasks the percentage is per task
+        (task, tasks) = (int(match.group(1)), int(match.group(2)))
+        percent = ((task - 1) * 100.0 + float(match.group(3))) / tasks
+        if match.group(4) is None:
+            return EncodeProgress(percent)
+        eta = int(match.group(6)) * 3600 + int(match.group(7)) * 60 + int(match.group(8))
+        return EncodeProgress(percent, float(match.group(4)), float(match.group(5)), eta)
+
+
+def _lines(stream):
+    """ Splits HandBrake's output on \\r as well, progress is redrawn in place. """
+    buffered = b""
+    for chunk in iter(lambda: stream.read1(4096), b""):
+        buffered += chunk
+        parts = re.split(b"[\r\n]", buffered)
+        buffered = parts.pop()
+        for part in parts:
+            yield part.decode("utf-8", "replace")
+    if buffered:
+        yield buffered.decode("utf-8", "replace")
+
+
+def ffmpeg_concat(parts, target):
+    """ Joins mp4 files without re-encoding (ffmpeg concat demuxer). Returns the exit code. """
+    # next to the parts, not the target, so it's not mistaken for a new file there
+    list_file = os.path.join(os.path.dirname(parts[0]), "parts.txt")
+    with open(list_file, "w", encoding="utf-8") as f:
+        for part in parts:
+            f.write("file '%s'\n" % (os.path.abspath(part).replace("'", "'\\''"),))
+    try:
+        return call([FFMPEG, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_file,
+                     "-c", "copy", "-movflags", "+faststart", target], stdin=DEVNULL)
+    finally:
+        os.remove(list_file)
+
+
+class SegmentsProgress:
+    """ Folds the progress of the segments of one source into one EncodeProgress, weighted by segment size. """
+    def __init__(self, source, sizes, on_progress):
+        self.source = source
+        self.sizes = sizes
+        self.on_progress = on_progress
+        self.lock = threading.Lock()
+        self.progress = {}
+
+    def update(self, segment, progress):
+        with self.lock:
+            self.progress[segment] = progress
+            running = self.progress.values()
+            percent = sum(self.sizes[i] * p.percent for (i, p) in self.progress.items()) / sum(self.sizes)
+            fps = sum(p.fps or 0 for p in running) or None
+            avg_fps = sum(p.avg_fps or 0 for p in running) or None
+            eta = max(p.eta for p in running) if all(p.eta is not None for p in running) else None
+            self.on_progress(self.source, EncodeProgress(percent, fps, avg_fps, eta))
+
 
 class HbEncoder:
     """
     Uses CLI of HandBrake to encode videos from JVC camera that were shoot with 16x9 setting.
+    on_progress(source, EncodeProgress) is called as HandBrake reports progress,
+    report (EncodeReport) gets the metrics of every finished encode.
+    Sources bigger than split_over bytes are encoded in segments at once, each HandBrakeCLI reads its own time
+    range of the source from a GOP start on, the parts are joined with concat(parts, target), ffmpeg_concat
+    by default. The joined file gets the source's mtime.
     """
+    # what comes out, files that already look like this are not encoded again
+    CODEC = "avc1"
+    WIDTH = 1024
+    HEIGHT = 576
+
+    # one multi-hour recording shouldn't hold up the whole batch, 4 parts keep a few cores busy on it
+    SEGMENTS = 4
+
+    def __init__(self, on_progress=None, report=None, handbrake=HANDBRAKE_CLI, split_over=None, segments=SEGMENTS,
+                 concat=ffmpeg_concat):
+        self.on_progress = on_progress
+        self.report = report
+        self.handbrake = handbrake
+        self.split_over = split_over
+        self.segments = segments
+        self.concat = concat
+
+    def command(self, source, target, start=None, duration=None):
+        """ start and duration are 90 kHz ticks, to encode only that much of source. """
+        ranged = []
+        if start:
+            ranged += ["--start-at", "pts:%d" % (start,)]
+        if duration:
+            # counted from start-at
+            ranged += ["--stop-at", "pts:%d" % (duration,)]
+        return [self.handbrake,
+                "-i", source, "-t", "1", "-c", "1"] + ranged + [
+                "-o", target,
+                "-f", "mp4", "--detelecine", "--decomb", "--denoise=weak", "-w", str(self.WIDTH), "-l", str(self.HEIGHT),
+                "-e", "x264", "-q", "19", "--cfr", "-a", "1", "-E", "ffaac", "-B", "0", "-6", "auto", "-R", "Auto",
+                "-D", "0", "--gain=0",
+                "--audio-copy-mask", "aac", "--audio-fallback", "aac", "-x", "b-adapt=2:rc-lookahead=50", "--verbose=0"]
+
+    def is_encoded(self, path):
+        """ True for a complete mp4 in the format this encoder produces. """
+        return media_probe.is_encoded(path, self.CODEC, self.WIDTH, self.HEIGHT)
+
+    def skip_reason(self, source, target):
+        """ Why encoding source would be wasted (valid output exists or source is in the target format), or None. """
+        return media_probe.skip_reason(source, target, self.CODEC, self.WIDTH, self.HEIGHT)
+
     def encode(self, source, target):
-        cmd = ("C:/Program Files/Handbrake/HandBrakeCLI.exe "
-               + "-i \"" + source + "\" -t 1 -c 1 "
-               + "-o \"" + target + "\" "
-               + "-f mp4 --detelecine --decomb --denoise=\"weak\" -w 1024 -l 576 "
-               + "-e x264 -q 19 --cfr  -a 1 -E ffaac -B 0 -6 auto -R Auto -D 0 --gain=0 "
-               + "--audio-copy-mask aac --audio-fallback aac -x b-adapt=2:rc-lookahead=50 --verbose=0"
-        )
-        ret = call(cmd)
+        started = time.time()
+        points = []
+        if self.split_over is not None and self.segments > 1 and os.path.getsize(source) > self.split_over:
+            points = media_probe.split_times(source, self.segments)
+        if points:
+            (ret, avg_fps) = self._encode_segments(source, target, points)
+        else:
+            (ret, avg_fps) = self._handbrake(source, target, lambda progress: self._progress(source, progress))
+        if self.report is not None:
+            self.report.add(EncodeMetrics.measure(source, target, ret, started, time.time(), avg_fps))
         return ret
 
+    def _progress(self, source, progress):
+        if self.on_progress is not None:
+            self.on_progress(source, progress)
+
+    def _handbrake(self, source, target, on_progress, start=None, duration=None):
+        """ Runs one HandBrakeCLI, returns (exit code, last average fps it reported). """
+        avg_fps = None
+        process = Popen(self.command(source, target, start, duration), stdout=PIPE, stderr=DEVNULL)
+        for line in _lines(process.stdout):
+            progress = EncodeProgress.parse(line)
+            if progress is None:
+                continue
+            avg_fps = progress.avg_fps or avg_fps
+            on_progress(progress)
+        return process.wait(), avg_fps
+
+    def _encode_segments(self, source, target, points):
+        """ Encodes the time ranges of source between points, (offset, ticks) pairs, at once and joins them. """
+        work_dir = target + SEGMENTS_SUFFIX
+        os.makedirs(work_dir, exist_ok=True)
+        try:
+            offsets = [0] + [offset for (offset, _) in points] + [os.path.getsize(source)]
+            ticks = [0] + [tick for (_, tick) in points] + [None]
+            progress = SegmentsProgress(source, [end - start for (start, end) in zip(offsets, offsets[1:])],
+                                        self._progress)
+            name = os.path.splitext(os.path.basename(source))[0]
+
+            def encode_segment(i):
+                encoded = os.path.join(work_dir, "%s.%03d.mp4" % (name, i))
+                # the last one runs to the end of the source
+                duration = ticks[i + 1] - ticks[i] if ticks[i + 1] is not None else None
+                return self._handbrake(source, encoded, lambda p: progress.update(i, p), ticks[i],
+                                       duration) + (encoded,)
+
+            with ThreadPoolExecutor(max_workers=len(points) + 1) as pool:
+                results = list(pool.map(encode_segment, range(len(points) + 1)))
+            failed = [ret for (ret, _, _) in results if ret != 0]
+            if failed:
+                return failed[0], None
+            ret = self.concat([encoded for (_, _, encoded) in results], target)
+            if ret == 0:
+                stat = os.stat(source)
+                os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            return ret, sum(avg_fps or 0 for (_, avg_fps, _) in results) or None
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
 if __name__ == "__main__":
-    HbEncoder().encode("D:\\temp\\MOV042.MOD", "D:\\temp\\processed\MOV042.m4v")
\ No newline at end of file
+    HbEncoder().encode("D:\\temp\\MOV042.MOD", "D:\\temp\\processed\MOV042.m4v")
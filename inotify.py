@@ -0,0 +1,71 @@
+__author__ = 'looser'
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+
+# from linux/inotify.h
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """ Thin ctypes wrapper over the Linux inotify API, no dependencies. """
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name:
+            raise OSError("inotify needs Linux libc")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify is not available here")
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed", path)
+        self.watches[wd] = path
+        return wd
+
+    def read(self, timeout=None):
+        """
+        Waits up to timeout seconds (None is forever) and returns [(dir, name, mask)].
+        When the kernel's queue overflowed and events were lost, that comes as (None, "", IN_Q_OVERFLOW).
+        """
+        (ready, _, _) = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        at = 0
+        while at + EVENT_HEADER.size <= len(data):
+            (wd, mask, _, length) = EVENT_HEADER.unpack_from(data, at)
+            name = os.fsdecode(data[at + EVENT_HEADER.size:at + EVENT_HEADER.size + length].rstrip(b"\x00"))
+            at += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, name, mask))
+            elif mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+            elif wd in self.watches:
+                events.append((self.watches[wd], name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
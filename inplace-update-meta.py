@@ -1,26 +1,53 @@
 from datetime import datetime
+from optparse import OptionParser
 import os
 import re
-from renamer import proper_name
-import shutil
-import sys
+from bulk_rename import RenameBatch, check_and_apply
+from catalog import Catalog, VIDEO_EXTENSIONS
+from media_date import capture_dates
+from renamer import proper_names
+from walker import walk_files
 
 # Updates the metadata in the library
+# example args: [--catalog D:\catalog.sqlite] "D:\vid"
 
-target = sys.argv[1]
+parser = OptionParser()
+parser.add_option("--catalog", dest="catalog", help="SQLite catalog (see catalog.py) to query instead of walking")
+parser.add_option("-j", "--jobs", dest="jobs", type="int", default=8, help="renames to run at once")
+(options, args) = parser.parse_args()
 
-for root, dirs, files in os.walk(target):
-    for file in files:
-        if re.match(".*((Makhm|Family) video|2007\.07 London)", root):
-            continue
-        (unused, ext) = os.path.splitext(file)
-        if not (ext.lower()[1:] in ["mod","avi","mp4","mov","3gp","m4v","asf"]):
-            continue
-        full_name = os.path.join(root, file)
-        create_time = datetime.fromtimestamp(os.path.getmtime(full_name))
-        rename_to = proper_name(full_name, create_time)
-        if rename_to != full_name:
-            shutil.move(full_name, rename_to)
-            print("%s => %s" % (full_name, rename_to))
+target = args[0]
 
 
+def skipped(root):
+    return re.match(".*((Makhm|Family) video|2007\.07 London)", root)
+
+
+def library_videos():
+    files = list(walk_files(target, VIDEO_EXTENSIONS, skip_dir=skipped))
+    # the date the camera wrote into the file beats mtime, which copies tend to change
+    for (file, (_, taken)) in zip(files, capture_dates(file.path for file in files)):
+        yield file.path, taken or datetime.fromtimestamp(file.mtime)
+
+
+if options.catalog:
+    catalog = Catalog(options.catalog)
+    catalog.refresh(target)
+    renames = [(path, proper) for (path, proper) in catalog.non_canonical(target) if not skipped(os.path.dirname(path))]
+else:
+    catalog = None
+    videos = list(library_videos())
+    renames = [(full_name, rename_to) for ((full_name, _), rename_to) in zip(videos, proper_names(videos))]
+
+# one journaled batch, bulk_rename.py --rollback undoes it
+batch = RenameBatch(label="inplace-update-meta")
+for (full_name, rename_to) in renames:
+    if rename_to != full_name:
+        batch.add(full_name, rename_to)
+
+for (full_name, rename_to) in check_and_apply(batch, options.jobs):
+    if catalog is not None:
+        catalog.moved(full_name, rename_to)
+
+if catalog is not None:
+    catalog.close()
@@ -0,0 +1,107 @@
+__author__ = 'looser'
+
+from datetime import datetime, timedelta
+import json
+from optparse import OptionParser
+import os
+import random
+
+from bench_renamer import synthetic_names
+
+# Builds fake media trees to measure the scripts at library scale, files are empty or sparse
+# example args: -n 100000 --depth 3 --size 1048576 D:\temp\synthetic
+
+
+def _make_file(path, size, tag=b""):
+    """ tag is written first, so files the scripts compare by content don't all come out equal. """
+    with open(path, "wb") as f:
+        f.write(tag)
+        if size > len(tag):
+            # sparse, the rest takes no disk space
+            f.truncate(size)
+
+
+def make_camera_tree(top, count, depth=2, size=0, seed=0):
+    """
+    Camera/phone videos the way the library holds them: top/<year>/<month>/<sub dirs>/name,
+    depth levels of dirs in total (at least 1), names from bench_renamer.synthetic_names.
+    """
+    rnd = random.Random(seed)
+    names = set()
+    for (path, taken) in synthetic_names(count, seed):
+        parts = [str(taken.year), "%02d" % (taken.month,)][:depth]
+        parts += ["event%d" % (rnd.randrange(4),) for _ in range(depth - len(parts))]
+        folder = os.path.join(top, *parts)
+        os.makedirs(folder, exist_ok=True)
+        name = os.path.basename(path)
+        if name in names:
+            # MOVxxx repeat, as they do on the real camera, the scripts would refuse to put them side by side
+            name = "%d_%s" % (len(names), name)
+        names.add(name)
+        full_name = os.path.join(folder, name)
+        _make_file(full_name, size, name.encode())
+        timestamp = taken.timestamp()
+        os.utime(full_name, (timestamp, timestamp))
+    return len(names)
+
+
+def make_date_folders(top, count, files_per_folder=5, seed=0):
+    """ YYYY.MM.DD picture folders like folder-mover.py expects, count is the number of folders. """
+    rnd = random.Random(seed)
+    start = datetime(2005, 1, 1)
+    made = set()
+    while len(made) < count:
+        name = (start + timedelta(days=rnd.randrange(20 * 365))).strftime("%Y.%m.%d")
+        if name in made:
+            continue
+        made.add(name)
+        os.makedirs(os.path.join(top, name))
+        for i in range(files_per_folder):
+            _make_file(os.path.join(top, name, "IMG_%04d.jpg" % (i,)), 0)
+    return len(made)
+
+
+def make_takeout(top, count, size=0, seed=0):
+    """
+    Google Takeout dump: media plus .json sidecars with creationTime.timestamp, including edited copies
+    (-измененный), numbered duplicates and names whose sidecar drops the extension.
+    """
+    rnd = random.Random(seed)
+    start = datetime(2020, 1, 1)
+    made = 0
+    for i in range(count):
+        taken = start + timedelta(seconds=rnd.randrange(5 * 365 * 24 * 3600))
+        folder = os.path.join(top, "Google Фото", "Photos from %d" % (taken.year,))
+        os.makedirs(folder, exist_ok=True)
+        (stem, ext) = ("IMG_%d" % (i,), rnd.choice([".jpg", ".mp4", ".MP"]))
+        kind = i % 5
+        if ext == ".MP":
+            # motion photo, its sidecar is named after the jpg
+            (media, sidecar) = (stem + ext, stem + ext + ".jpg.json")
+        elif kind == 3:
+            (media, sidecar) = (stem + "-измененный" + ext, stem + ext + ".json")
+        elif kind == 4:
+            (media, sidecar) = (stem + "(1)" + ext, stem + ext + "(1).json")
+        else:
+            (media, sidecar) = (stem + ext, stem + ext + ".json")
+        _make_file(os.path.join(folder, media), size, media.encode())
+        with open(os.path.join(folder, sidecar), "w", encoding="utf-8") as f:
+            json.dump({"title": media, "creationTime": {"timestamp": str(int(taken.timestamp()))}}, f)
+        made += 1
+    return made
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-n", "--count", dest="count", type="int", default=10000, help="number of media files")
+    parser.add_option("--depth", dest="depth", type="int", default=2, help="dir levels under the library")
+    parser.add_option("--size", dest="size", type="int", default=0, help="bytes per file (sparse)")
+    parser.add_option("--seed", dest="seed", type="int", default=0)
+    (options, args) = parser.parse_args()
+    top = args[0]
+    print("vid: %d files" % (make_camera_tree(os.path.join(top, "vid"), options.count, options.depth,
+                                                options.size, options.seed),))
+    print("pictures: %d folders" % (make_date_folders(os.path.join(top, "pictures"), max(1, options.count // 20),
+                                                      seed=options.seed),))
+    print("takeout: %d files" % (make_takeout(os.path.join(top, "takeout"), options.count, options.size,
+                                             options.seed),))
@@ -0,0 +1,108 @@
+__author__ = 'looser'
+
+import mmap
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from media_probe import iter_boxes
+
+# seconds between 1904-01-01, where MP4 times count from, and the unix epoch
+MP4_EPOCH_OFFSET = 2082844800
+# top level boxes a QuickTime/MP4 file can start with
+MP4_FIRST_BOXES = (b"ftyp", b"moov", b"mdat", b"wide", b"free", b"skip")
+EXIF_DATE_TIME_ORIGINAL = 0x9003
+EXIF_DATE_TIME = 0x0132
+EXIF_IFD_POINTER = 0x8769
+# reading capture dates is mostly waiting for the disk/NAS
+DEFAULT_WORKERS = 16
+
+
+def capture_date(path):
+    """ When the picture or video was taken according to the file itself, None if it doesn't say. """
+    try:
+        with open(path, "rb") as f:
+            head = f.read(8)
+            if head[:2] == b"\xff\xd8":
+                return _jpeg_date(f)
+            if head[4:8] in MP4_FIRST_BOXES:
+                return _mp4_date(f)
+    except (OSError, ValueError, struct.error):
+        pass
+    return None
+
+
+def capture_dates(paths, workers=DEFAULT_WORKERS):
+    """ capture_date for many files at once, yields (path, datetime or None) in the order of paths. """
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        yield from zip(paths, pool.map(capture_date, paths))
+
+
+def _mp4_date(f):
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for (box_type, start, end) in iter_boxes(data, 0, len(data)):
+            if box_type != b"moov":
+                continue
+            for (child, payload, child_end) in iter_boxes(data, start, end):
+                if child == b"mvhd":
+                    if data[payload] == 1:
+                        created = struct.unpack(">Q", data[payload + 4:payload + 12])[0]
+                    else:
+                        created = struct.unpack(">I", data[payload + 4:payload + 8])[0]
+                    # cameras without a clock leave it at 0
+                    if created <= MP4_EPOCH_OFFSET:
+                        return None
+                    return datetime.fromtimestamp(created - MP4_EPOCH_OFFSET)
+    return None
+
+
+def _jpeg_date(f):
+    """ Walks the JPEG segments up to APP1 and reads only that one. """
+    f.seek(2)
+    while True:
+        marker = f.read(4)
+        if len(marker) < 4 or marker[0] != 0xff or marker[1] in (0xd9, 0xda):
+            # end of image or start of scan, no more metadata after this
+            return None
+        length = struct.unpack(">H", marker[2:])[0]
+        if marker[1] == 0xe1:
+            segment = f.read(length - 2)
+            if segment[:6] == b"Exif\x00\x00":
+                return _exif_date(segment[6:])
+        else:
+            f.seek(length - 2, 1)
+
+
+def _exif_date(tiff):
+    endian = "<" if tiff[:2] == b"II" else ">"
+
+    def ifd_entries(offset):
+        count = struct.unpack(endian + "H", tiff[offset:offset + 2])[0]
+        for i in range(count):
+            entry = offset + 2 + i * 12
+            (tag, kind, n) = struct.unpack(endian + "HHI", tiff[entry:entry + 8])
+            yield tag, kind, n, tiff[entry + 8:entry + 12]
+
+    def ascii_value(n, value):
+        at = struct.unpack(endian + "I", value)[0]
+        return tiff[at:at + n].rstrip(b"\x00 ").decode("ascii", "replace")
+
+    ifd0 = struct.unpack(endian + "I", tiff[4:8])[0]
+    fallback = None
+    for (tag, kind, n, value) in ifd_entries(ifd0):
+        if tag == EXIF_DATE_TIME:
+            fallback = ascii_value(n, value)
+        elif tag == EXIF_IFD_POINTER:
+            for (exif_tag, _, exif_n, exif_value) in ifd_entries(struct.unpack(endian + "I", value)[0]):
+                if exif_tag == EXIF_DATE_TIME_ORIGINAL:
+                    return _parse_exif_time(ascii_value(exif_n, exif_value))
+    return _parse_exif_time(fallback)
+
+
+def _parse_exif_time(text):
+    try:
+        return datetime.strptime(text, "%Y:%m:%d %H:%M:%S") if text else None
+    except ValueError:
+        # unset dates come as "0000:00:00 00:00:00" or blanks
+        return None
@@ -0,0 +1,172 @@
+__author__ = 'looser'
+
+import mmap
+import struct
+
+# MPEG-PS headers sit at the start, no need to look further
+PS_SCAN_SIZE = 256 * 1024
+# moov of an hour long mp4 is a few MB, anything bigger is not worth parsing
+MAX_MOOV_SIZE = 64 * 1024 * 1024
+
+PACK_START = b"\x00\x00\x01\xba"
+SEQUENCE_HEADER = b"\x00\x00\x01\xb3"
+# boxes that only hold other boxes, on the way from moov to the sample description
+CONTAINER_BOXES = (b"moov", b"trak", b"mdia", b"minf", b"stbl")
+
+
+class MediaInfo:
+    """ What the probe found out. codec is the MP4 sample entry type (avc1, hvc1, ...) or mpeg1/mpeg2 for PS. """
+    def __init__(self, container, codec=None, width=None, height=None):
+        self.container = container
+        self.codec = codec
+        self.width = width
+        self.height = height
+
+    def __repr__(self):
+        return "MediaInfo(%r, %r, %r, %r)" % (self.container, self.codec, self.width, self.height)
+
+
+def probe(path):
+    """ Looks at the container headers only. Returns MediaInfo, or None for files that are neither MPEG-PS nor MP4. """
+    with open(path, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return None
+        with data:
+            if data[:4] == PACK_START:
+                return _probe_ps(data)
+            if data[4:8] == b"ftyp":
+                return _probe_mp4(data)
+    return None
+
+
+def _probe_ps(data):
+    head = data[:PS_SCAN_SIZE]
+    # MPEG-2 packs have '01' in the top bits of the byte after the start code, MPEG-1 has '0010'
+    codec = "mpeg2" if head[4] >> 6 == 1 else "mpeg1"
+    at = head.find(SEQUENCE_HEADER)
+    if at < 0 or at + 7 > len(head):
+        return MediaInfo("mpeg-ps", codec)
+    (b1, b2, b3) = head[at + 4:at + 7]
+    return MediaInfo("mpeg-ps", codec, (b1 << 4) | (b2 >> 4), ((b2 & 0x0f) << 8) | b3)
+
+
+def split_points(path, segments):
+    """
+    Offsets that cut an MPEG-PS file into about equal parts that each start with a pack holding a sequence header,
+    which JVC cameras write in front of every GOP, so every part decodes on its own. The first part starts at 0,
+    which is not in the list. Only the bytes around the cut points are read.
+    """
+    points = []
+    with open(path, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return points
+        with data:
+            if data[:4] != PACK_START:
+                return points
+            for i in range(1, segments):
+                at = data.find(SEQUENCE_HEADER, max(len(data) * i // segments, points[-1] + 4 if points else 0))
+                if at < 0:
+                    break
+                pack = data.rfind(PACK_START, 0, at)
+                if pack > (points[-1] if points else 0):
+                    points.append(pack)
+    return points
+
+
+def pack_clock(header):
+    """ System clock reference of a pack, header starts at the pack start code. 90 kHz ticks. """
+    (b0, b1, b2, b3, b4) = header[4:9]
+    if b0 >> 6 == 1:
+        # MPEG-2
+        return ((b0 >> 3) & 7) << 30 | (b0 & 3) << 28 | b1 << 20 | (b2 >> 3) << 15 | (b2 & 3) << 13 | b3 << 5 | b4 >> 3
+    return ((b0 >> 1) & 7) << 30 | b1 << 22 | (b2 >> 1) << 15 | b3 << 7 | b4 >> 1
+
+
+def split_times(path, segments):
+    """
+    split_points with the time of each point, as (offset, 90 kHz ticks since the start of the file), which is
+    what HandBrakeCLI's --start-at pts: takes. Points where the clock doesn't move on are left out.
+    """
+    points = split_points(path, segments)
+    if not points:
+        return []
+    times = []
+    with open(path, "rb") as f:
+        first = pack_clock(f.read(9))
+        for point in points:
+            f.seek(point)
+            # the clock is 33 bits and may wrap once during a recording
+            ticks = (pack_clock(f.read(9)) - first) % (1 << 33)
+            if ticks > (times[-1][1] if times else 0):
+                times.append((point, ticks))
+    return times
+
+
+def iter_boxes(data, start, end):
+    """ Yields (type, payload start, box end) for the boxes in data[start:end]. """
+    while start + 8 <= end:
+        (size, box_type) = struct.unpack(">I4s", data[start:start + 8])
+        header = 8
+        if size == 1:
+            if start + 16 > end:
+                return
+            size = struct.unpack(">Q", data[start + 8:start + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header or start + size > end:
+            # truncated, like an encode that was killed halfway
+            return
+        yield box_type, start + header, start + size
+        start += size
+
+
+def _probe_mp4(data):
+    info = MediaInfo("mp4")
+    for (box_type, start, end) in iter_boxes(data, 0, len(data)):
+        if box_type == b"moov" and end - start <= MAX_MOOV_SIZE:
+            info.container = "mp4+moov"
+            _find_video(data[start:end], info)
+    return info
+
+
+def _find_video(moov, info):
+    """ Fills codec and size from the first video sample entry under moov. """
+    def walk(start, end):
+        for (box_type, payload, box_end) in iter_boxes(moov, start, end):
+            if box_type in CONTAINER_BOXES:
+                if walk(payload, box_end):
+                    return True
+            elif box_type == b"stsd":
+                # full box header, entry count, then sample entries
+                for (entry_type, entry, _) in iter_boxes(moov, payload + 8, box_end):
+                    if entry_type in (b"avc1", b"avc3", b"hvc1", b"hev1", b"mp4v") and entry + 28 <= box_end:
+                        info.codec = entry_type.decode()
+                        (info.width, info.height) = struct.unpack(">HH", moov[entry + 24:entry + 28])
+                        return True
+        return False
+    walk(0, len(moov))
+
+
+def is_encoded(path, codec, width, height):
+    """ True for a complete MP4 (moov written) with the given video codec and size. """
+    try:
+        info = probe(path)
+    except OSError:
+        return False
+    return info is not None and info.container == "mp4+moov" and (info.codec, info.width, info.height) == (codec, width, height)
+
+
+def skip_reason(source, target, codec, width, height):
+    """ Why encoding source to target would be wasted, None when it needs encoding. """
+    if is_encoded(target, codec, width, height):
+        return "already encoded to " + target
+    info = probe(source)
+    if info is not None and (info.codec, info.width, info.height) == (codec, width, height):
+        return "already %s %dx%d" % (codec, width, height)
+    return None
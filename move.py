@@ -1,13 +1,24 @@
+from functools import lru_cache
 from optparse import OptionParser
 import os
-import shutil
 import re
+import sys
+
+from catalog import Catalog
+from move_plan import MovePlan, run_plan
+from walker import walk_files
 
 # extracts files by extension and copies away keeping dir structure (with yyyymmdd prefix)
+# the whole move is planned and checked first, -n only prints the plan
 # example args: -e "mod,avi,mp4,mov,3gp,m4v,asf" "D:\Pictures" "D:\vid"
 
 parser = OptionParser()
 parser.add_option("-e", "--extensions", dest="extensions")
+parser.add_option("-n", "--dry-run", dest="dry_run", action="store_true", default=False)
+parser.add_option("-k", "--skip-problems", dest="skip_problems", action="store_true", default=False,
+                  help="move everything else when some moves would fail")
+parser.add_option("-j", "--jobs", dest="jobs", type="int", default=4, help="renames to run at once per device")
+parser.add_option("--catalog", dest="catalog", help="SQLite catalog (see catalog.py) to query instead of walking")
 
 (options, args) = parser.parse_args()
 
@@ -16,6 +27,7 @@ print (extensions)
 source = args[0]
 destination = args[1]
 
+@lru_cache(maxsize=None)
 def find_date_folder(path):
     if not path.startswith(source):
         return None
@@ -24,20 +36,21 @@ def find_date_folder(path):
         return folder
     return find_date_folder(parent)
 
-for root, dirs, files in os.walk(source):
-    for file in files:
-        (unused, ext) = os.path.splitext(file)
-        if ext.lower() in extensions:
-            folder = find_date_folder(root)
-            src = os.path.join(root, file)
-            if folder is None: dst = os.path.join(destination, "misc")
-            else: dst = os.path.join(destination, folder)
-            os.makedirs(dst, exist_ok=True)
-            shutil.move(src, dst)
-            print("{0} => {1}".format(src, dst))
-
-
-
-
-
-
+if options.catalog:
+    catalog = Catalog(options.catalog)
+    catalog.refresh(source)
+    files = [path for (path, _, _) in catalog.files(source, extensions)]
+    catalog.close()
+else:
+    files = [file.path for file in walk_files(source, extensions)]
+
+plan = MovePlan()
+for path in files:
+    (root, name) = os.path.split(path)
+    folder = find_date_folder(root)
+    if folder is None: dst = os.path.join(destination, "misc")
+    else: dst = os.path.join(destination, folder)
+    plan.add(path, os.path.join(dst, name))
+
+if not run_plan(plan, options.dry_run, options.skip_problems, options.jobs):
+    sys.exit(1)
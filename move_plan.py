@@ -0,0 +1,142 @@
+__author__ = 'looser'
+
+import errno
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from transfer import move_file
+
+
+class MovePlan:
+    """
+    Collects all moves first and checks them as a whole (clashes, permissions, devices) before touching anything.
+    Moves are (src, dst) with dst the full new path, src can be a file or a dir.
+    """
+    def __init__(self):
+        self.moves = []
+        self._devices = {}
+
+    def add(self, src, dst):
+        self.moves.append((src, dst))
+
+    def __len__(self):
+        return len(self.moves)
+
+    def device(self, path):
+        """ st_dev of path, or of its nearest existing parent for paths that are yet to be created. """
+        if path not in self._devices:
+            try:
+                self._devices[path] = os.stat(path).st_dev
+            except FileNotFoundError:
+                parent = os.path.dirname(path)
+                self._devices[path] = self.device(parent) if parent != path else None
+        return self._devices[path]
+
+    def _writable(self, path):
+        while not os.path.exists(path):
+            parent = os.path.dirname(path)
+            if parent == path:
+                return False
+            path = parent
+        return os.access(path, os.W_OK)
+
+    def problems(self, existing=None):
+        """
+        Maps each move that would fail to the reason.
+        existing - normcase'd paths known to exist, from a listing done anyway, saves a stat per move
+        """
+        def exists(path):
+            return os.path.normcase(path) in existing if existing is not None else os.path.lexists(path)
+
+        problems = {}
+        targets = {}
+        writable = {}
+        for (src, dst) in self.moves:
+            key = os.path.normcase(dst)
+            (src_dir, dst_dir) = (os.path.dirname(src) or ".", os.path.dirname(dst))
+            if src_dir not in writable:
+                writable[src_dir] = os.access(src_dir, os.W_OK)
+            if dst_dir not in writable:
+                writable[dst_dir] = self._writable(dst_dir)
+            if not exists(src):
+                problems[(src, dst)] = "source is gone"
+            elif key in targets:
+                problems[(src, dst)] = "same target as " + targets[key]
+            elif exists(dst):
+                problems[(src, dst)] = "target exists"
+            elif not writable[src_dir]:
+                problems[(src, dst)] = "can't remove from source dir"
+            elif not writable[dst_dir]:
+                problems[(src, dst)] = "can't write target dir"
+            targets.setdefault(key, src)
+        return problems
+
+    def drop(self, moves):
+        moves = set(moves)
+        self.moves = [move for move in self.moves if move not in moves]
+
+    def groups(self):
+        """ Moves grouped by (source device, target device). """
+        groups = {}
+        for (src, dst) in self.moves:
+            groups.setdefault((self.device(src), self.device(os.path.dirname(dst))), []).append((src, dst))
+        return groups
+
+    def print(self):
+        for ((src_dev, dst_dev), moves) in self.groups().items():
+            how = "rename" if src_dev == dst_dev else "copy across devices"
+            print("%d moves (%s):" % (len(moves), how))
+            for (src, dst) in moves:
+                print("  {0} => {1}".format(src, dst))
+
+    def execute(self, workers=4):
+        """
+        Applies the plan. Device pairs are worked on at the same time, renames within one device run up to workers
+        at once, copies across devices one by one so they don't fight over the disks. Returns the failed moves.
+        """
+        groups = self.groups()
+        with ThreadPoolExecutor(max_workers=max(1, len(groups))) as pool:
+            futures = [pool.submit(self._execute_group, moves, workers if src_dev == dst_dev else 1)
+                       for ((src_dev, dst_dev), moves) in groups.items()]
+            return [failed for future in futures for failed in future.result()]
+
+    def _execute_group(self, moves, workers):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda move: self._move(*move), moves))
+        return [move for (move, ok) in zip(moves, results) if not ok]
+
+    def _move(self, src, dst):
+        try:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if os.path.isdir(src):
+                # shutil.move would put src inside a dir that exists at dst
+                if os.path.lexists(dst):
+                    raise FileExistsError(errno.EEXIST, "File exists", dst)
+                shutil.move(src, dst)
+            else:
+                move_file(src, dst)
+        except FileExistsError:
+            print("ERROR {0} => {1}: target appeared since the plan was made, not overwritten".format(src, dst))
+            return False
+        except OSError as e:
+            print("ERROR {0} => {1}: {2}".format(src, dst, e))
+            return False
+        print("{0} => {1}".format(src, dst))
+        return True
+
+
+def run_plan(plan, dry_run, skip_problems, workers):
+    """ Common tail of the scripts that move things: report problems, then print or apply the plan. """
+    problems = plan.problems()
+    for ((src, dst), reason) in problems.items():
+        print("PROBLEM {0} => {1}: {2}".format(src, dst, reason))
+    if problems:
+        if not skip_problems:
+            print("%d of %d moves have problems, nothing moved" % (len(problems), len(plan.moves)))
+            return False
+        plan.drop(problems)
+    if dry_run:
+        plan.print()
+        return True
+    return not plan.execute(workers)
@@ -0,0 +1,185 @@
+__author__ = 'looser'
+
+from itertools import combinations
+import math
+from multiprocessing import Pool
+from optparse import OptionParser
+import os
+import time
+from PIL import Image
+
+from catalog import PICTURE_EXTENSIONS
+from stat_cache import StatCache
+from walker import walk_files
+
+# Finds pictures that look the same: re-saved edits, resized copies, burst shots
+# Every picture gets a 64 bit dHash and pHash, computed on all cores and cached by path and mtime,
+# the chosen hash goes into a multi-index hash table, so a lookup doesn't compare against every picture.
+# example args: -r 6 --hash phash --cache D:\temp\picture-hashes.sqlite D:\Pictures
+
+HASH_BITS = 64
+DEFAULT_RADIUS = 6
+# pHash takes the low frequencies of the DCT of a picture scaled down to this size
+DCT_SIZE = 32
+DCT_KEEP = 8
+
+
+def distance(a, b):
+    """ Hamming distance of two hashes. """
+    return bin(a ^ b).count("1")
+
+
+def dhash(im):
+    """ Difference hash: is each pixel of a 9x8 grayscale thumbnail brighter than its right neighbour. """
+    pixels = im.resize((9, 8), Image.LANCZOS).tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+# cosine table for the DCT-II rows pHash keeps, computed once per process
+_COSINES = [[math.cos(math.pi * (2 * x + 1) * u / (2 * DCT_SIZE)) for x in range(DCT_SIZE)] for u in range(DCT_KEEP)]
+
+
+def phash(im):
+    """
+    DCT hash: which of the 8x8 lowest frequencies (DC left out) of a 32x32 grayscale thumbnail are above
+    their median. Only those 64 coefficients are computed, so no numpy is needed.
+    """
+    pixels = im.resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS).tobytes()
+    rows = [pixels[y * DCT_SIZE:(y + 1) * DCT_SIZE] for y in range(DCT_SIZE)]
+    # along the rows first, then down the columns of the result
+    by_row = [[sum(c * p for (c, p) in zip(cosines, row)) for cosines in _COSINES] for row in rows]
+    coefficients = [sum(cosines[y] * by_row[y][u] for y in range(DCT_SIZE))
+                    for cosines in _COSINES for u in range(DCT_KEEP)]
+    median = sorted(coefficients[1:])[(len(coefficients) - 1) // 2]
+    value = 0
+    for coefficient in coefficients:
+        value = (value << 1) | (coefficient > median)
+    return value
+
+
+def image_hashes(path):
+    """ (path, [dhash, phash, width, height]) of one picture, (path, None) when Pillow can't read it. """
+    try:
+        im = Image.open(path)
+        size = im.size
+        # JPEGs get decoded at 1/8 scale right in the DCT, plenty for a 32x32 thumbnail
+        im.draft("L", (DCT_SIZE * 2, DCT_SIZE * 2))
+        im = im.convert("L")
+        return path, [dhash(im), phash(im), size[0], size[1]]
+    except Exception as e:
+        # decompression bombs and decoder errors too, one bad picture mustn't end the whole pool run
+        print("cannot read '%s': %s" % (path, e))
+        return path, None
+
+
+class MultiIndex:
+    """
+    Multi-index hash table for Hamming distance search. Hashes are cut into bands, two hashes within
+    radius r differ in at most r // bands bits in one of the bands at least, so only entries sharing such
+    a band value are compared. With 16 bit bands the buckets stay small up to millions of hashes.
+    """
+    def __init__(self, radius=DEFAULT_RADIUS, bits=HASH_BITS, bands=4):
+        self.radius = radius
+        self.bands = bands
+        self.band_bits = bits // bands
+        self.band_radius = radius // bands
+        self.mask = (1 << self.band_bits) - 1
+        # xor-ing a band value with these gives every value within band_radius bits of it
+        self.flips = [sum(1 << bit for bit in bits) for flipped in range(self.band_radius + 1)
+                      for bits in combinations(range(self.band_bits), flipped)]
+        self.tables = [{} for _ in range(bands)]
+        self.hashes = []
+
+    def _band(self, value, band):
+        return (value >> (band * self.band_bits)) & self.mask
+
+    def add(self, value):
+        """ Adds a hash, returns its id. """
+        item = len(self.hashes)
+        self.hashes.append(value)
+        for band in range(self.bands):
+            self.tables[band].setdefault(self._band(value, band), []).append(item)
+        return item
+
+    def search(self, value):
+        """ Ids of the hashes within radius of value. """
+        candidates = set()
+        for band in range(self.bands):
+            (table, key) = (self.tables[band], self._band(value, band))
+            for flip in self.flips:
+                bucket = table.get(key ^ flip)
+                if bucket:
+                    candidates.update(bucket)
+        return sorted(item for item in candidates if distance(self.hashes[item], value) <= self.radius)
+
+
+def near_duplicate_groups(hashes, radius=DEFAULT_RADIUS):
+    """ Groups (lists of indexes into hashes) of two or more hashes linked by distances within radius. """
+    index = MultiIndex(radius)
+    parent = list(range(len(hashes)))
+
+    def root(item):
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    for (item, value) in enumerate(hashes):
+        # everything found was added before, so each pair is looked at once
+        for other in index.search(value):
+            parent[root(other)] = root(item)
+        index.add(value)
+    groups = {}
+    for item in range(len(hashes)):
+        groups.setdefault(root(item), []).append(item)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def picture_hashes(paths, cache, jobs=None):
+    """ [dhash, phash, width, height] or None for each of paths, new pictures are hashed on jobs processes. """
+    found = {}
+    missing = []
+    stamps = {}
+    for path in paths:
+        stat = os.stat(path)
+        stamps[path] = "%d:%d" % (stat.st_mtime_ns, stat.st_size)
+        found[path] = cache.get(path, stamps[path])
+        if found[path] is None:
+            missing.append(path)
+    if missing:
+        with Pool(jobs) as pool:
+            for (path, hashes) in pool.imap_unordered(image_hashes, missing, chunksize=16):
+                found[path] = hashes
+                if hashes is not None:
+                    cache.put(path, stamps[path], hashes)
+    return [found[path] for path in paths]
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog [options] dir ...")
+    parser.add_option("-r", "--radius", dest="radius", type="int", default=DEFAULT_RADIUS,
+                      help="max differing bits of two near duplicates")
+    parser.add_option("--hash", dest="hash", default="dhash", help="dhash (resizes, re-saves) or phash (also edits)")
+    parser.add_option("--cache", dest="cache", default=os.path.expanduser("~/.picture-hashes.sqlite"))
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=os.cpu_count(), help="number of processes")
+    (options, args) = parser.parse_args()
+
+    started = time.perf_counter()
+    cache = StatCache(options.cache, "picture_hashes")
+    paths = sorted(file.path for top in args for file in walk_files(top, PICTURE_EXTENSIONS))
+    hashes = picture_hashes(paths, cache, options.jobs)
+    cache.close()
+    pictures = [(path, hashed) for (path, hashed) in zip(paths, hashes) if hashed is not None]
+    column = 0 if options.hash == "dhash" else 1
+    groups = near_duplicate_groups([hashed[column] for (_, hashed) in pictures], options.radius)
+    # biggest picture first, that's usually the one to keep
+    for group in sorted(groups, key=len, reverse=True):
+        for item in sorted(group, key=lambda item: -pictures[item][1][2] * pictures[item][1][3]):
+            (path, (_, _, width, height)) = pictures[item]
+            print("%5dx%-5d %s" % (width, height, path))
+        print()
+    print("%d pictures, %d groups, %.1fs" % (len(pictures), len(groups), time.perf_counter() - started))
@@ -0,0 +1,70 @@
+__author__ = 'looser'
+
+import queue
+import threading
+import traceback
+
+
+class ByteBudget:
+    """
+    Bytes that may be taken at once, e.g. temp space. acquire() blocks until enough has been released.
+    A single request bigger than the whole budget is let through once nothing else is taken, so it can't hang.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, size):
+        with self.condition:
+            self.condition.wait_for(lambda: self.used == 0 or self.used + size <= self.limit)
+            self.used += size
+
+    def release(self, size):
+        with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+
+class Stage:
+    """
+    Worker threads that call fn(item) for every item put in. The queue in front of them holds queue_size items,
+    put() blocks when it is full, so a slow stage holds back the one feeding it.
+    An item fails when fn raises or returns False.
+    """
+    _DONE = object()
+
+    def __init__(self, name, fn, workers=1, queue_size=None):
+        self.name = name
+        self.fn = fn
+        self.queue = queue.Queue(queue_size or workers)
+        self.failed = 0
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._work, name="%s-%d" % (name, i), daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def close(self):
+        """ Waits for everything put so far to be done and stops the workers, returns number of failed items. """
+        for _ in self.threads:
+            self.queue.put(Stage._DONE)
+        for thread in self.threads:
+            thread.join()
+        return self.failed
+
+    def _work(self):
+        for item in iter(self.queue.get, Stage._DONE):
+            try:
+                ok = self.fn(item) is not False
+            except Exception:
+                # one bad file shouldn't stop the rest of the batch
+                ok = False
+                print("ERROR!!! %s failed on %r" % (self.name, item))
+                traceback.print_exc()
+            if not ok:
+                with self.lock:
+                    self.failed += 1
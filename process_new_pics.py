@@ -1,16 +1,70 @@
 __author__ = 'looser'
 
-import os, sys
+from collections import Counter
+from multiprocessing import Pool
+from optparse import OptionParser
+import os
+import time
 from PIL import Image
 
-size = 128, 128
-
-for infile in sys.argv[1:]:
-    outfile = os.path.splitext(infile)[0] + ".thumbnail"
-    if infile != outfile:
-        try:
-            im = Image.open(infile)
-            im.thumbnail(size, Image.ANTIALIAS)
-            im.save(outfile, "JPEG")
-        except IOError:
-            print "cannot create thumbnail for '%s'" % infile
+# Makes thumbnails for new pictures on all cores
+# example args: -s 128,1024 D:\Pictures\new\*.jpg
+
+DEFAULT_SIZE = 128
+
+
+def thumbnail_name(infile, size):
+    # the default size keeps the name it always had
+    suffix = ".thumbnail" if size == DEFAULT_SIZE else ".%d.thumbnail" % (size,)
+    return os.path.splitext(infile)[0] + suffix
+
+
+def is_current(infile, outfile):
+    try:
+        return os.path.getmtime(outfile) >= os.path.getmtime(infile)
+    except OSError:
+        return False
+
+
+def make_thumbnails(job):
+    """
+    Makes all missing or outdated thumbnails of one picture from a single decode.
+    Returns "converted", "up to date" or "failed".
+    """
+    (infile, sizes) = job
+    sizes = [size for size in sizes
+             if thumbnail_name(infile, size) != infile and not is_current(infile, thumbnail_name(infile, size))]
+    if not sizes:
+        return "up to date"
+    try:
+        im = Image.open(infile)
+        # JPEGs get decoded at 1/2, 1/4 or 1/8 scale right in the DCT, which is most of the speedup
+        im.draft("RGB", (max(sizes), max(sizes)))
+        # biggest first, each smaller one is resized from the previous
+        for size in sorted(sizes, reverse=True):
+            im.thumbnail((size, size), Image.LANCZOS)
+            im.save(thumbnail_name(infile, size), "JPEG")
+    except Exception as e:
+        # whatever Pillow raises (DecompressionBombError isn't an IOError) costs only this picture
+        print("cannot create thumbnail for '%s': %s" % (infile, e))
+        return "failed"
+    return "converted"
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-s", "--sizes", dest="sizes", default=str(DEFAULT_SIZE),
+                      help="comma separated thumbnail sizes")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=os.cpu_count(),
+                      help="number of processes")
+    (options, args) = parser.parse_args()
+    sizes = [int(size) for size in options.sizes.split(",")]
+
+    started = time.perf_counter()
+    with Pool(options.jobs) as pool:
+        counts = Counter(pool.imap_unordered(make_thumbnails, [(infile, sizes) for infile in args], chunksize=16))
+    elapsed = time.perf_counter() - started
+    # failed pictures don't count towards the rate, a decode error is quick
+    print("%d images, %d up to date, %d failed, %.1fs, %.1f images/sec"
+          % (counts["converted"], counts["up to date"], counts["failed"], elapsed,
+             counts["converted"] / elapsed if elapsed else 0))
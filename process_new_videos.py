@@ -1,11 +1,18 @@
 # script to process new downloads from devices
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from optparse import OptionParser
 import os
-import shutil
-from hb_encoder import HbEncoder
+from bulk_rename import RenameBatch, check_and_apply
+from encode_journal import EncodeJournal, JOURNAL_NAME
+from encode_queue import EncodeQueue, default_workers
+from encode_report import EncodeReport
+from hb_encoder import SEGMENTS_SUFFIX
+from media_date import capture_dates
 from renamer import proper_name
+from walker import walk_files
+from watch import NewFileWatcher, DEFAULT_SETTLE
 
 # todo
 # 1) preserver creation date time for encoder
@@ -13,29 +20,126 @@ from renamer import proper_name
 # 3) preserver timezone ? for encoding
 
 parser = OptionParser()
+parser.add_option("-j", "--jobs", dest="jobs", type="int", default=default_workers(),
+                  help="number of encodes to run at once")
+parser.add_option("--journal", dest="journal", help="progress journal, default is " + JOURNAL_NAME + " in work dir")
+parser.add_option("--report", dest="report", help="CSV (or .json) file to append per-encode metrics to")
+parser.add_option("--split-over", dest="split_over", type="float",
+                  help="encode sources bigger than this many GB in segments at once (needs ffmpeg to join them)")
+parser.add_option("-w", "--watch", dest="watch", action="store_true", default=False,
+                  help="keep running and process new files as they arrive (Linux inotify)")
+parser.add_option("--settle", dest="settle", type="float", default=DEFAULT_SETTLE,
+                  help="seconds a new file must stay unchanged before it is processed")
 (options, args) = parser.parse_args()
 work_dir = args[0]
-encoder = HbEncoder()
-for root, dirs, files in os.walk(work_dir):
-    for file in files:
-        full_name = os.path.join(root, file)
-        original_mtime = os.path.getmtime(full_name)
-        create_time = datetime.fromtimestamp(original_mtime)
+
+
+def finish_encode(full_name, new_name, ret, original_mtime, size, mtime_ns):
+    if ret == 0:
+        journal.mark(full_name, size, mtime_ns, "encoded")
+        os.utime(new_name, (-1, original_mtime))
+        os.remove(full_name)
+    else:
+        print("ERROR!!! " + full_name)
+    done_producing(new_name)
+
+
+def new_queue():
+    return EncodeQueue(options.jobs, report=report, split_over=options.split_over and options.split_over * 1e9)
+
+
+def process(files, queue):
+    """ Renames new files and queues the MOD ones for encoding, files is a list of (path, stat). """
+    # all renames go as one journaled batch, bulk_rename.py --rollback undoes it
+    renames = RenameBatch(label="process_new_videos")
+    planned = []
+    for ((full_name, stat), (_, taken)) in zip(files, capture_dates(path for (path, _) in files)):
+        # the date the device wrote into the file beats mtime, which copies tend to change
+        create_time = taken or datetime.fromtimestamp(stat.st_mtime)
         rename_to = proper_name(full_name, create_time)
         if rename_to != full_name:
-            shutil.move(full_name, rename_to)
-            print("%s => %s" % (full_name, rename_to))
+            produced.add(rename_to)
+            renames.add(full_name, rename_to)
+        planned.append((full_name, rename_to, stat))
+    renamed = set(check_and_apply(renames))
+    for (full_name, rename_to, _) in planned:
+        if rename_to != full_name:
+            done_producing(rename_to, (full_name, rename_to) in renamed)
+
+    for (full_name, rename_to, stat) in planned:
+        if rename_to != full_name and (full_name, rename_to) not in renamed:
+            # left alone until the clash is sorted out
+            continue
+        root = os.path.dirname(full_name)
+        original_mtime = stat.st_mtime
         full_name = rename_to
 
         # maybe encode
         (no_ext_name, ext) = os.path.splitext(os.path.split(full_name)[1])
         if ext.lower() == ".mod":
             new_name = os.path.join(root, no_ext_name + ".mp4")
+            # a rename keeps size and mtime, so the stat from the listing is still good
+            if "encoded" in journal.done_stages(full_name, stat.st_size, stat.st_mtime_ns) \
+                    and os.path.exists(new_name):
+                finish_encode(full_name, new_name, 0, original_mtime, stat.st_size, stat.st_mtime_ns)
+                continue
+            reason = queue.encoder.skip_reason(full_name, new_name)
+            if reason is not None:
+                # not ours to finish, so the original stays
+                print("skipping %s: %s" % (full_name, reason))
+                continue
             print("encoding to %s" % (new_name,))
-            if encoder.encode(full_name, new_name) == 0:
-                os.utime(new_name, (-1, original_mtime))
-                os.remove(full_name)
-                full_name = new_name
-            else:
-                print("ERROR!!! " + full_name)
+            produced.add(new_name)
+            queue.add(full_name, new_name,
+                      lambda src, dst, ret, mtime=original_mtime, size=stat.st_size, mtime_ns=stat.st_mtime_ns:
+                      finish_encode(src, dst, ret, mtime, size, mtime_ns), stat.st_size)
+
+
+def encode_in_background(queue):
+    def report_failure(future):
+        if future.exception() is not None:
+            print("ERROR!!! encoding batch failed: %s" % (future.exception(),))
+    encoding.submit(queue.run).add_done_callback(report_failure)
+
+
+journal_file = options.journal or os.path.join(work_dir, JOURNAL_NAME)
+journal = EncodeJournal(journal_file)
+report = EncodeReport(options.report) if options.report else None
+# renames and encodes of this script in progress, the watcher must not pick them up as new
+produced = set()
+
+
+def done_producing(path, written=True):
+    """ Once written, the watcher tells path apart from new files by its size and mtime, so produced stays small. """
+    if options.watch and written:
+        watcher.written_here(path)
+    produced.discard(path)
+
+
+def is_segment_work(path):
+    """ Parts of a segmented encode (--split-over) in progress, or left by one that was killed. """
+    return path.endswith(SEGMENTS_SUFFIX) or SEGMENTS_SUFFIX + os.sep in path
+
+
+if options.watch:
+    # set up before the first pass, so nothing arriving meanwhile is missed
+    watcher = NewFileWatcher(work_dir, options.settle,
+                             ignore=lambda path: path.startswith(journal_file) or path in produced
+                             or is_segment_work(path))
 
+queue = new_queue()
+# the journal itself and its sqlite side files are left alone
+process([(file.path, file.stat()) for file in walk_files(work_dir, skip_dir=is_segment_work)
+         if not file.path.startswith(journal_file)], queue)
+if not options.watch:
+    queue.run()
+    journal.close()
+else:
+    # renames happen as soon as files settle, encodes run batch after batch behind them
+    encoding = ThreadPoolExecutor(max_workers=1)
+    encode_in_background(queue)
+    print("watching %s" % (work_dir,))
+    while True:
+        queue = new_queue()
+        process(watcher.wait(), queue)
+        encode_in_background(queue)
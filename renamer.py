@@ -1,26 +1,33 @@
+from functools import lru_cache
 import os
 import re
 
+HEX_NAME = re.compile("^MOV[0-9A-F]{3}$")
+HEX_NUMBER = re.compile("MOV([0-9A-F]{3})")
+EMBEDDED_DATE = re.compile("[-._ ]?(?P<Y>\d{4})[-._ ]?(?P<m>\d{2})[-._ ]?(?P<d>\d{2})[-._ ]?(?P<H>\d{2})[-._ ]?(?P<M>\d{2})[-._ ]?(?P<S>\d{2})[-._ ]?")
+DUP_DATE = re.compile("[-._ ]?\d\d\d\d\.\d\d\.\d\d$")
+DATE_PREFIX = re.compile("\d\d\d\d\.\d\d\.\d\d[_ ]")
+PROPER_DATE = re.compile("\d\d\d\d\.\d\d\.\d\d_\d\d-\d\d-\d\d")
+
 
 def apply_timestamp_convention(name, timestamp):
     return  timestamp.strftime("%Y.%m.%d_%H-%M-%S") + "_" + name
 
 
-def proper_name(file, timestamp):
-    """ Finds  proper name based on given timestamp. """
-    (folder, full_name) = os.path.split(file)
-    (name, ext) = os.path.splitext(full_name)
-
-    fix_hex = re.match("^MOV[0-9A-F]{3}$", name)
+@lru_cache(maxsize=65536)
+def _proper_stem(name):
+    """ Renames the stem as far as it can be done without the timestamp, returns (needs_timestamp, stem). """
+    fix_hex = HEX_NAME.match(name)
+    needs_timestamp = False
 
     # first pull the date out
     # try to find embedded date
-    existing_date = re.search("[-._ ]?(?P<Y>\d{4})[-._ ]?(?P<m>\d{2})[-._ ]?(?P<d>\d{2})[-._ ]?(?P<H>\d{2})[-._ ]?(?P<M>\d{2})[-._ ]?(?P<S>\d{2})[-._ ]?", name)
+    existing_date = EMBEDDED_DATE.search(name)
     if existing_date:
         name = name.replace(existing_date.group(0), "").__str__()
 
         # check there's no dup date
-        dup_match = re.search("[-._ ]?\d\d\d\d\.\d\d\.\d\d$", name)
+        dup_match = DUP_DATE.search(name)
         if dup_match:
             name = name.replace(dup_match.group(0), "")
 
@@ -35,20 +42,35 @@ def proper_name(file, timestamp):
             name
         )
     else:
-        date_match = re.search("\d\d\d\d\.\d\d\.\d\d[_ ]", name)
+        date_match = DATE_PREFIX.search(name)
         if not date_match:
-            name = apply_timestamp_convention(name, timestamp)
-        elif not re.match("\d\d\d\d\.\d\d\.\d\d_\d\d-\d\d-\d\d", name):
+            needs_timestamp = True
+        elif not PROPER_DATE.match(name):
             name = name.replace(date_match.group(0), "")
-            name = apply_timestamp_convention(name, timestamp)
+            needs_timestamp = True
 
     if fix_hex:
-        # now unwrap hex number from JVC
-        match = re.search("MOV([0-9A-F]{3})", name)
+        # now unwrap hex number from JVC, the timestamp prefix never contains one
+        match = HEX_NUMBER.search(name)
         if match:
             number = int(match.group(1), 16)
             name = name.replace(match.group(0), "MOV" + ("%03d" % (number,)))
 
-    return os.path.join(folder, name + ext)
+    return needs_timestamp, name
 
 
+def proper_names(files):
+    """ Batch version of proper_name, takes an iterable of (file, timestamp) and yields the proper names in order. """
+    for (file, timestamp) in files:
+        (folder, full_name) = os.path.split(file)
+        (name, ext) = os.path.splitext(full_name)
+        (needs_timestamp, name) = _proper_stem(name)
+        if needs_timestamp:
+            name = apply_timestamp_convention(name, timestamp)
+        yield os.path.join(folder, name + ext)
+
+
+def proper_name(file, timestamp):
+    """ Finds  proper name based on given timestamp. """
+    return next(proper_names(((file, timestamp),)))
+
@@ -0,0 +1,250 @@
+__author__ = 'looser'
+
+from concurrent.futures import ThreadPoolExecutor, wait, ALL_COMPLETED, FIRST_COMPLETED
+import ctypes
+import ctypes.util
+from datetime import datetime
+from optparse import OptionParser
+import os
+import platform
+import sqlite3
+import sys
+import time
+
+from file_hash import full_hash
+from walker import walk_files
+
+# Catches bit rot in the backup and library trees before a file fails to play years later
+# Keeps a checksum of every file in a SQLite manifest. New and changed files are hashed when first seen,
+# then every run re-reads a budget of the files verified longest ago and reports the ones whose content
+# changed while size and mtime did not (corrupt), and the ones that are gone (missing).
+# Runs at low CPU and idle I/O priority, so it can go in cron next to everything else.
+# example args: --gb 200 --minutes 60 --manifest D:\scrub.sqlite "D:\backup" "D:\vid"
+
+# ioprio_set(2), from linux/ioprio.h and the syscall tables
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+SYS_IOPRIO_SET = {"x86_64": 251, "aarch64": 30, "i386": 289, "i686": 289}
+
+
+def lower_priority(nice=10):
+    """ Low CPU priority everywhere, idle I/O class on Linux: reads only get the disk when nobody else wants it. """
+    if hasattr(os, "nice"):
+        os.nice(nice)
+    number = SYS_IOPRIO_SET.get(platform.machine())
+    libc_name = ctypes.util.find_library("c")
+    if number is None or not libc_name or not sys.platform.startswith("linux"):
+        return False
+    libc = ctypes.CDLL(libc_name, use_errno=True)
+    return libc.syscall(number, IOPRIO_WHO_PROCESS, 0, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) == 0
+
+
+def disk_hash(path):
+    """ full_hash of what is on the disk: cached pages of the file are dropped first, they'd hide bit rot. """
+    if hasattr(os, "posix_fadvise"):
+        with open(path, "rb") as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    return full_hash(path)
+
+
+def _under(top):
+    """ Bounds of the paths under top, for a range query on the path column. """
+    top = os.path.join(os.path.abspath(top), "")
+    return top, top[:-1] + chr(ord(os.sep) + 1)
+
+
+class ScrubManifest:
+    """
+    Checksums of the files under some trees. status is ok, corrupt (content changed, size and mtime didn't)
+    or missing. verified is when the hash was last found to match, 0 for never.
+    """
+    def __init__(self, db_file):
+        self.db_file = os.path.abspath(db_file)
+        self.db = sqlite3.connect(db_file)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT,
+                verified REAL NOT NULL DEFAULT 0, seen REAL, status TEXT NOT NULL DEFAULT 'ok');
+            CREATE INDEX IF NOT EXISTS files_verified ON files (verified, path);
+        """)
+
+    def refresh(self, top, run):
+        """ Records what is under top now. New and changed files get no hash, so they are hashed next. """
+        changed = 0
+        for file in walk_files(os.path.abspath(top)):
+            if file.path.startswith(self.db_file):
+                # the manifest itself and its journal
+                continue
+            stat = file.stat()
+            row = self.db.execute("SELECT size, mtime_ns FROM files WHERE path = ?", (file.path,)).fetchone()
+            if row is None:
+                self.db.execute("INSERT INTO files (path, size, mtime_ns, seen) VALUES (?, ?, ?, ?)",
+                                (file.path, stat.st_size, stat.st_mtime_ns, run))
+            elif row != (stat.st_size, stat.st_mtime_ns):
+                # rewritten on purpose, bit rot doesn't touch the mtime
+                changed += 1
+                self.db.execute("UPDATE files SET size = ?, mtime_ns = ?, hash = NULL, verified = 0, seen = ?, "
+                                "status = 'ok' WHERE path = ?", (stat.st_size, stat.st_mtime_ns, run, file.path))
+            else:
+                self.db.execute("UPDATE files SET seen = ?, status = CASE status WHEN 'missing' THEN 'ok' "
+                                "ELSE status END WHERE path = ?", (run, file.path))
+        (low, high) = _under(top)
+        self.db.execute("UPDATE files SET status = 'missing' WHERE path >= ? AND path < ? AND seen < ?",
+                        (low, high, run))
+        self.db.commit()
+        return changed
+
+    def unhashed(self, top, page=1000):
+        """ (path, size) of the files under top that have no hash yet. """
+        (last, high) = _under(top)
+        while True:
+            rows = self.db.execute("SELECT path, size FROM files WHERE path > ? AND path < ? AND hash IS NULL "
+                                   "AND status != 'missing' ORDER BY path LIMIT ?", (last, high, page)).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last = rows[-1][0]
+
+    def oldest(self, tops, before, page=1000):
+        """
+        (path, size) of the hashed files under any of tops not verified since before, verified longest ago first
+        over all of them, so a budget smaller than one tree still reaches the others.
+        Read a page at a time, so a million files don't sit in memory and verified() can run in between.
+        """
+        ranges = [_under(top) for top in tops]
+        within = " OR ".join(["(path >= ? AND path < ?)"] * len(ranges))
+        bounds = [bound for pair in ranges for bound in pair]
+        (verified, last) = (-1, "")
+        while True:
+            rows = self.db.execute("SELECT path, size, verified FROM files WHERE (" + within + ") "
+                                   "AND hash IS NOT NULL AND status != 'missing' AND verified < ? "
+                                   "AND (verified > ? OR (verified = ? AND path > ?)) ORDER BY verified, path LIMIT ?",
+                                   bounds + [before, verified, verified, last, page]).fetchall()
+            if not rows:
+                return
+            for (path, size, _) in rows:
+                yield path, size
+            (last, _, verified) = rows[-1]
+
+    def hashed(self, path, value):
+        self.db.execute("UPDATE files SET hash = ?, verified = ?, status = 'ok' WHERE path = ?",
+                        (value, time.time(), path))
+
+    def verified(self, path, value):
+        """ Compares a fresh hash with the manifest, returns True when it matches. """
+        (expected,) = self.db.execute("SELECT hash FROM files WHERE path = ?", (path,)).fetchone()
+        if value == expected:
+            self.db.execute("UPDATE files SET verified = ?, status = 'ok' WHERE path = ?", (time.time(), path))
+            return True
+        self.db.execute("UPDATE files SET status = 'corrupt' WHERE path = ?", (path,))
+        return False
+
+    def with_status(self, top, status):
+        (low, high) = _under(top)
+        return [path for (path,) in self.db.execute("SELECT path FROM files WHERE path >= ? AND path < ? "
+                                                    "AND status = ? ORDER BY path", (low, high, status))]
+
+    def oldest_check(self, top):
+        """ When the file under top verified longest ago was checked, None if none was. """
+        (low, high) = _under(top)
+        (verified,) = self.db.execute("SELECT MIN(verified) FROM files WHERE path >= ? AND path < ? "
+                                      "AND status = 'ok' AND hash IS NOT NULL", (low, high)).fetchone()
+        return verified
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+class ScrubRun:
+    """ One scrub of some trees: hashes what's new, then re-verifies until max_bytes or max_seconds are used up. """
+    def __init__(self, manifest, tops, max_bytes=None, max_seconds=None, workers=4):
+        self.manifest = manifest
+        self.tops = tops
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.workers = workers
+        self.new = 0
+        self.changed = 0
+        self.checked = 0
+        self.checked_bytes = 0
+        self.started_bytes = 0
+        self.corrupt = []
+        self.unreadable = []
+
+    def run(self):
+        started = time.time()
+        for top in self.tops:
+            self.changed += self.manifest.refresh(top, started)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            # first sight, outside of the budget
+            for top in self.tops:
+                for (path, _, value) in self._hash_all(pool, self.manifest.unhashed(top)):
+                    self.manifest.hashed(path, value)
+                    self.new += 1
+            deadline = started + self.max_seconds if self.max_seconds else None
+            for (path, size, value) in self._hash_all(pool, self.manifest.oldest(self.tops, started), deadline, True):
+                self.checked += 1
+                self.checked_bytes += size
+                if not self.manifest.verified(path, value):
+                    self.corrupt.append(path)
+                    print("CORRUPT " + path)
+        self.manifest.commit()
+        return self
+
+    def _hash_all(self, pool, files, deadline=None, budgeted=False):
+        """ Yields (path, size, hash) as the readers finish, a few files in flight per reader. """
+        running = {}
+        for (path, size) in files:
+            if budgeted and self._spent(deadline):
+                break
+            if budgeted:
+                # counted when started, so the files in flight don't overshoot the budget
+                self.started_bytes += size
+            running[pool.submit(disk_hash, path)] = (path, size)
+            if len(running) >= self.workers * 2:
+                yield from self._finished(running, FIRST_COMPLETED)
+        yield from self._finished(running, ALL_COMPLETED)
+
+    def _spent(self, deadline):
+        return (self.max_bytes is not None and self.started_bytes >= self.max_bytes) or \
+            (deadline is not None and time.time() >= deadline)
+
+    def _finished(self, running, return_when):
+        (finished, _) = wait(running, return_when=return_when)
+        for future in finished:
+            (path, size) = running.pop(future)
+            try:
+                yield path, size, future.result()
+            except OSError as e:
+                print("cannot read '%s': %s" % (path, e))
+                self.unreadable.append(path)
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog [options] dir ...")
+    parser.add_option("--manifest", dest="manifest", default=os.path.expanduser("~/.scrub-manifest.sqlite"))
+    parser.add_option("--gb", dest="gb", type="float", help="GB to re-verify this run")
+    parser.add_option("--minutes", dest="minutes", type="float", help="minutes to spend re-verifying this run")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=4, help="files to read at once")
+    parser.add_option("--nice", dest="nice", type="int", default=10, help="CPU niceness, I/O is always idle class")
+    (options, args) = parser.parse_args()
+
+    lower_priority(options.nice)
+    manifest = ScrubManifest(options.manifest)
+    scrub = ScrubRun(manifest, args, options.gb and options.gb * 1e9, options.minutes and options.minutes * 60,
+                     options.jobs).run()
+    missing = [path for top in args for path in manifest.with_status(top, "missing")]
+    corrupt = [path for top in args for path in manifest.with_status(top, "corrupt")]
+    for path in missing:
+        print("MISSING " + path)
+    oldest = min([manifest.oldest_check(top) or time.time() for top in args] or [time.time()])
+    manifest.close()
+    print("%d new, %d changed, %d re-verified (%.1f GB), %d corrupt, %d missing, oldest check %s"
+          % (scrub.new, scrub.changed, scrub.checked, scrub.checked_bytes / 1e9, len(corrupt), len(missing),
+             datetime.fromtimestamp(oldest).strftime("%Y-%m-%d")))
+    if corrupt or missing or scrub.unreadable:
+        sys.exit(1)
@@ -0,0 +1,43 @@
+__author__ = 'looser'
+
+import json
+import sqlite3
+import threading
+
+
+class StatCache:
+    """
+    Remembers values computed from file contents in SQLite, so reruns don't read the files again.
+    Every value is stored with a stamp (usually mtime) and only handed back while the stamp still matches.
+    Values must be JSON serializable.
+    """
+    def __init__(self, db_file, table="cache", commit_every=1000):
+        self.lock = threading.Lock()
+        self.table = table
+        self.commit_every = commit_every
+        self.uncommitted = 0
+        self.db = sqlite3.connect(db_file, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS %s (key TEXT PRIMARY KEY, stamp TEXT NOT NULL, value TEXT)"
+                        % (table,))
+        self.db.commit()
+
+    def get(self, key, stamp, default=None):
+        with self.lock:
+            row = self.db.execute("SELECT stamp, value FROM %s WHERE key = ?" % (self.table,), (key,)).fetchone()
+        if row is None or row[0] != str(stamp):
+            return default
+        return json.loads(row[1])
+
+    def put(self, key, stamp, value):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO %s VALUES (?, ?, ?)" % (self.table,),
+                            (key, str(stamp), json.dumps(value)))
+            self.uncommitted += 1
+            if self.uncommitted >= self.commit_every:
+                self.db.commit()
+                self.uncommitted = 0
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+
+from bulk_rename import RenameBatch, read_journal, rollback
+
+
+class TestRenameBatch(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.journals = os.path.join(self.dir.name, "journals")
+
+    def touch(self, name):
+        path = os.path.join(self.dir.name, name)
+        open(path, "w").close()
+        return path
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def test_applies_and_rolls_back(self):
+        batch = RenameBatch(self.journals)
+        batch.add(self.touch("MOV03D.mp4"), self.path("2012.03.27_10-23-17_MOV061.mp4"))
+        batch.add(self.touch("VID_20120307_193607.mp4"), self.path("2012.03.07_19-36-07_VID.mp4"))
+        self.assertEqual({}, batch.problems())
+        self.assertEqual([], batch.apply(workers=2))
+        self.assertEqual(["2012.03.07_19-36-07_VID.mp4", "2012.03.27_10-23-17_MOV061.mp4", "journals"],
+                         sorted(os.listdir(self.dir.name)))
+        self.assertEqual("done", read_journal(batch.journal_file)[1])
+
+        self.assertEqual(2, rollback(batch.journal_file))
+        self.assertEqual(["MOV03D.mp4", "VID_20120307_193607.mp4", "journals"], sorted(os.listdir(self.dir.name)))
+        self.assertEqual("rolled back", read_journal(batch.journal_file)[1])
+
+    def test_finds_collisions_first(self):
+        batch = RenameBatch(self.journals)
+        batch.add(self.touch("a.mp4"), self.touch("taken.mp4"))
+        batch.add(self.touch("b.mp4"), self.path("same.mp4"))
+        batch.add(self.touch("c.mp4"), self.path("same.mp4"))
+        self.assertEqual({(self.path("a.mp4"), self.path("taken.mp4")), (self.path("c.mp4"), self.path("same.mp4"))},
+                         set(batch.problems()))
+
+    def test_rollback_of_interrupted_batch(self):
+        batch = RenameBatch(self.journals)
+        batch.add(self.touch("a.mp4"), self.path("x.mp4"))
+        batch.add(self.touch("b.mp4"), self.path("y.mp4"))
+        batch.apply()
+        # as if the second rename never happened
+        os.rename(self.path("y.mp4"), self.path("b.mp4"))
+        self.assertEqual(1, rollback(batch.journal_file))
+        self.assertEqual(["a.mp4", "b.mp4", "journals"], sorted(os.listdir(self.dir.name)))
+
+
+if __name__ == '__main__':
+    unittest.main()
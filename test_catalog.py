@@ -0,0 +1,96 @@
+import os
+import tempfile
+import time
+import unittest
+
+from catalog import Catalog
+
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.lib = os.path.join(self.dir.name, "vid")
+        self.catalog = Catalog(os.path.join(self.dir.name, "catalog.sqlite"))
+        self.addCleanup(self.catalog.close)
+        self.touch("2012", "MOV03D.MOD")
+        self.touch("2012", "2013.02.13_20-47-44_MOV064.mp4")
+        self.touch("2013", "deep", "notes.txt")
+
+    def touch(self, *parts):
+        path = os.path.join(self.lib, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "w").close()
+        os.utime(path, (1332843797, 1332843797))
+        return path
+
+    def paths(self):
+        return sorted(os.path.relpath(path, self.lib) for (path, _, _) in self.catalog.files(self.lib))
+
+    def test_indexes_media(self):
+        self.assertEqual(4, self.catalog.refresh(self.lib))
+        self.assertEqual([os.path.join("2012", "2013.02.13_20-47-44_MOV064.mp4"), os.path.join("2012", "MOV03D.MOD")],
+                         self.paths())
+        ((path, proper),) = self.catalog.non_canonical(self.lib)
+        self.assertEqual(os.path.join(self.lib, "2012", "MOV03D.MOD"), path)
+        self.assertTrue(proper.endswith("_MOV061.MOD"))
+
+    def test_only_lists_changed_dirs(self):
+        self.catalog.refresh(self.lib)
+        self.assertEqual(0, self.catalog.refresh(self.lib))
+        time.sleep(0.01)
+        self.touch("2013", "deep", "VID_1.mp4")
+        self.assertEqual(1, self.catalog.refresh(self.lib))
+        self.assertIn(os.path.join("2013", "deep", "VID_1.mp4"), self.paths())
+
+    def test_forgets_removed(self):
+        self.catalog.refresh(self.lib)
+        os.remove(os.path.join(self.lib, "2012", "MOV03D.MOD"))
+        os.remove(os.path.join(self.lib, "2013", "deep", "notes.txt"))
+        os.rmdir(os.path.join(self.lib, "2013", "deep"))
+        self.catalog.refresh(self.lib)
+        self.assertEqual([os.path.join("2012", "2013.02.13_20-47-44_MOV064.mp4")], self.paths())
+        self.assertEqual(3, self.catalog.db.execute("SELECT COUNT(*) FROM dirs").fetchone()[0])
+
+    @unittest.skipUnless(hasattr(os, "symlink"), "needs symlinks")
+    def test_dangling_symlink_skips_only_itself(self):
+        self.touch("2012", "deeper", "y.mp4")
+        os.symlink(os.path.join(self.lib, "nowhere.mp4"), os.path.join(self.lib, "2012", "broken.mp4"))
+        self.catalog.refresh(self.lib)
+        self.assertEqual([os.path.join("2012", "2013.02.13_20-47-44_MOV064.mp4"), os.path.join("2012", "MOV03D.MOD"),
+                          os.path.join("2012", "deeper", "y.mp4")], self.paths())
+
+    def test_subtree_refresh_stays_linked(self):
+        self.catalog.refresh(self.lib)
+        self.catalog.refresh(os.path.join(self.lib, "2012"))
+        self.touch("2012", "sub", "new", "d.mp4")
+        self.catalog.refresh(self.lib)
+        self.assertIn(os.path.join("2012", "sub", "new", "d.mp4"), self.paths())
+
+    def test_subtree_catalogued_first_gets_linked(self):
+        self.catalog.refresh(os.path.join(self.lib, "2012"))
+        self.catalog.refresh(self.lib)
+        time.sleep(0.01)
+        self.touch("2012", "sub", "d.mp4")
+        self.catalog.refresh(self.lib)
+        self.assertIn(os.path.join("2012", "sub", "d.mp4"), self.paths())
+
+    def test_moved_gets_proper_name_of_new_path(self):
+        self.catalog.refresh(self.lib)
+        ((path, proper),) = self.catalog.non_canonical(self.lib)
+        os.rename(path, proper)
+        self.catalog.moved(path, proper)
+        self.assertEqual([], list(self.catalog.non_canonical(self.lib)))
+        # moved back by hand to a name that isn't canonical
+        os.rename(proper, path)
+        self.catalog.moved(proper, path)
+        self.assertEqual([(path, proper)], list(self.catalog.non_canonical(self.lib)))
+
+    def test_hashes_on_demand(self):
+        self.catalog.refresh(self.lib)
+        self.assertEqual(2, self.catalog.hash_missing(self.lib))
+        self.assertEqual(0, self.catalog.hash_missing(self.lib))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+from datetime import datetime
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "copy-back-meta.py")
+TAKEN = datetime(2012, 3, 27, 14, 23, 17).timestamp()
+
+
+class TestCopyBackMeta(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.backup = os.path.join(self.dir.name, "backup")
+        self.target = os.path.join(self.dir.name, "vid")
+
+    def touch(self, top, *parts, mtime=1500000000):
+        path = os.path.join(top, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "w").close()
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def run_script(self, *options):
+        # rename journals go to ~/.rename-journals, kept out of the real home
+        env = dict(os.environ, HOME=self.dir.name)
+        result = subprocess.run([sys.executable, SCRIPT] + list(options) + [self.backup, self.target],
+                                env=env, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        return result.stdout
+
+    def files(self):
+        return sorted((os.path.relpath(os.path.join(root, name), self.target),
+                       int(os.path.getmtime(os.path.join(root, name))))
+                      for (root, _, names) in os.walk(self.target) for name in names)
+
+    def test_matches_on_relative_dir_and_stem(self):
+        self.touch(self.backup, "2012", "MOV00A.MOD", mtime=TAKEN)
+        self.touch(self.target, "2012", "MOV00A.mp4")
+        # same name in another dir is another recording
+        self.touch(self.backup, "2013", "MOV00A.MOD", mtime=TAKEN + 3600)
+        self.touch(self.backup, "2012", "MOV00B.MOD", mtime=TAKEN)
+        self.touch(self.target, "2012", "MOV00B.avi")
+        out = self.run_script()
+        self.assertEqual([(os.path.join("2012", "2012.03.27_14-23-17_MOV010.mp4"), int(TAKEN)),
+                          (os.path.join("2012", "MOV00B.avi"), 1500000000)], self.files())
+        self.assertIn("3 backup files: 1 renamed, 0 times fixed, 0 already fine", out)
+        self.assertIn("1 missing:\n  " + os.path.join(self.target, "2013", "MOV00A.mp4"), out)
+        self.assertIn("1 not mp4:\n  " + os.path.join(self.target, "2012", "MOV00B.avi"), out)
+
+    def test_fixes_time_of_renamed_file(self):
+        self.touch(self.backup, "2012", "MOV00A.MOD", mtime=TAKEN)
+        # renamed by an earlier run, its time got lost since
+        self.touch(self.target, "2012", "2012.03.27_14-23-17_MOV010.mp4")
+        out = self.run_script("--catalog", os.path.join(self.dir.name, "catalog.sqlite"))
+        self.assertEqual([(os.path.join("2012", "2012.03.27_14-23-17_MOV010.mp4"), int(TAKEN))], self.files())
+        self.assertIn("1 backup files: 0 renamed, 1 times fixed, 0 already fine", out)
+        out = self.run_script("--catalog", os.path.join(self.dir.name, "catalog.sqlite"))
+        self.assertIn("1 backup files: 0 renamed, 0 times fixed, 1 already fine", out)
+
+    def test_leaves_taken_names_alone(self):
+        self.touch(self.backup, "2012", "MOV00A.MOD", mtime=TAKEN)
+        self.touch(self.target, "2012", "MOV00A.mp4")
+        self.touch(self.target, "2012", "2012.03.27_14-23-17_MOV010.mp4", mtime=1400000000)
+        out = self.run_script()
+        self.assertEqual([(os.path.join("2012", "2012.03.27_14-23-17_MOV010.mp4"), 1400000000),
+                          (os.path.join("2012", "MOV00A.mp4"), 1500000000)], self.files())
+        self.assertIn("1 name taken:", out)
+
+
+if __name__ == '__main__':
+    unittest.main()
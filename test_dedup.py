@@ -0,0 +1,91 @@
+import os
+import tempfile
+import unittest
+
+import dedup
+from dedup import Deduplicator, replace_with_link
+from stat_cache import StatCache
+
+
+class TestDeduplicator(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.cache = StatCache(os.path.join(self.dir.name, "cache.sqlite"))
+        self.addCleanup(self.cache.close)
+
+    def make(self, name, data):
+        path = os.path.join(self.dir.name, "lib", name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def find(self, **options):
+        finder = Deduplicator(self.cache, **options)
+        self.addCleanup(finder.close)
+        finder.scan(os.path.join(self.dir.name, "lib"))
+        return sorted(sorted(os.path.relpath(record.path, self.dir.name) for record in group)
+                      for group in finder.groups())
+
+    def test_finds_identical_files(self):
+        big = os.urandom(300 * 1024)
+        middle = bytearray(big)
+        middle[150 * 1024] ^= 1
+        self.make("2012/MOV001.MOD", big)
+        self.make("takeout/MOV001.MOD", big)
+        self.make("other/MOV002.MOD", bytes(middle))
+        self.make("a/IMG_1.jpg", b"small")
+        self.make("b/IMG_1(1).jpg", b"small")
+        self.make("c/IMG_2.jpg", b"other")
+        self.make("c/notes.txt", b"small")
+        self.assertEqual([[os.path.join("lib", "2012", "MOV001.MOD"), os.path.join("lib", "takeout", "MOV001.MOD")],
+                          [os.path.join("lib", "a", "IMG_1.jpg"), os.path.join("lib", "b", "IMG_1(1).jpg")]],
+                         self.find())
+        self.assertEqual(3, len(self.find(extensions=None)[1]))
+
+    def test_hardlinks_are_one_file(self):
+        path = self.make("a/IMG_1.jpg", b"same")
+        os.link(path, os.path.join(self.dir.name, "lib", "IMG_1.jpg"))
+        self.assertEqual([], self.find())
+
+    def test_batches_and_cache(self):
+        for i in range(30):
+            self.make("a/IMG_%d.jpg" % (i,), b"%d" % (i,) * 1000)
+            self.make("b/IMG_%d.jpg" % (i,), b"%d" % (i,) * 1000)
+        (batch, dedup.BATCH_FILES) = (dedup.BATCH_FILES, 7)
+        try:
+            self.assertEqual(30, len(self.find()))
+            self.assertEqual(30, len(self.find()))
+        finally:
+            dedup.BATCH_FILES = batch
+
+    def test_replace_with_hardlink(self):
+        keep = self.make("a/IMG_1.jpg", b"same")
+        duplicate = self.make("b/IMG_1.jpg", b"same")
+        finder = Deduplicator(self.cache)
+        self.addCleanup(finder.close)
+        finder.scan(self.dir.name)
+        (group,) = list(finder.groups())
+        group.sort(key=lambda record: record.path)
+        self.assertTrue(replace_with_link(group[0], group[1], "hardlink"))
+        self.assertTrue(os.path.samefile(keep, duplicate))
+
+    def test_changed_keep_is_not_linked(self):
+        keep = self.make("a/IMG_1.jpg", b"same")
+        duplicate = self.make("b/IMG_1.jpg", b"same")
+        finder = Deduplicator(self.cache)
+        self.addCleanup(finder.close)
+        finder.scan(self.dir.name)
+        (group,) = list(finder.groups())
+        group.sort(key=lambda record: record.path)
+        with open(keep, "wb") as f:
+            f.write(b"edited")
+        self.assertFalse(replace_with_link(group[0], group[1], "hardlink"))
+        self.assertFalse(os.path.samefile(keep, duplicate))
+        with open(duplicate, "rb") as f:
+            self.assertEqual(b"same", f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import multiprocessing
+import os
+import tempfile
+import time
+import unittest
+
+from encode_farm import EncodeFarm, work
+
+
+def encode_all(farm_dir, log_dir):
+    """ Worker process: 'encodes' by writing a file per job into log_dir. """
+    farm = EncodeFarm(farm_dir, lease=60)
+
+    def process(job):
+        with open(os.path.join(log_dir, "%s.%d" % (job.id, os.getpid())), "w"):
+            pass
+        time.sleep(0.01)
+        return 0
+    work(farm, process, poll=0.1)
+
+
+class TestEncodeFarm(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.farm_dir = os.path.join(self.dir.name, "farm")
+        self.farm = EncodeFarm(self.farm_dir, lease=60)
+
+    def submit(self, count):
+        for i in range(count):
+            self.assertTrue(self.farm.submit("/vid/MOV%03d.MOD" % (i,), "/processed/MOV%03d.mp4" % (i,), i * 100))
+
+    def test_submit_is_idempotent(self):
+        self.submit(3)
+        self.assertFalse(self.farm.submit("/vid/MOV000.MOD", "/elsewhere.mp4", 0))
+        self.assertEqual(3, len(self.farm.remaining()))
+
+    def test_claims_biggest_first_and_once(self):
+        self.submit(3)
+        first = self.farm.claim()
+        self.assertEqual("/vid/MOV002.MOD", first.source)
+        other = EncodeFarm(self.farm_dir, lease=60, worker="other")
+        self.assertEqual("/vid/MOV001.MOD", other.claim().source)
+        first.finish(0)
+        first.finish(0)
+        self.assertEqual({first.id}, self.farm.done())
+        self.assertEqual(0, self.farm.result(first.id)["ret"])
+
+    @unittest.skipUnless(hasattr(os, "symlink"), "needs symlinks")
+    def test_hosts_with_other_mount_points_share_jobs(self):
+        share = os.path.join(self.dir.name, "share")
+        farm = EncodeFarm(os.path.join(share, "farm"), lease=60)
+        self.assertTrue(farm.submit(os.path.join(share, "vid", "MOV001.MOD"),
+                                    os.path.join(share, "processed", "MOV001.mp4"), 100))
+        # the same share mounted somewhere else on another host
+        mount = os.path.join(self.dir.name, "mnt")
+        os.symlink(share, mount)
+        other = EncodeFarm(os.path.join(mount, "farm"), lease=60, worker="other")
+        self.assertFalse(other.submit(os.path.join(mount, "vid", "MOV001.MOD"),
+                                      os.path.join(mount, "processed", "MOV001.mp4"), 100))
+        job = other.claim()
+        self.assertEqual((os.path.join(mount, "vid", "MOV001.MOD"), os.path.join(mount, "processed", "MOV001.mp4")),
+                         (job.source, job.target))
+
+    def test_dead_workers_job_is_taken_over(self):
+        self.submit(1)
+        dead = self.farm.claim()
+        dead.mark("encoded")
+        # the dead worker's last heartbeat was long ago
+        os.utime(dead.lock_file, (time.time() - 3600, time.time() - 3600))
+        other = EncodeFarm(self.farm_dir, lease=60, worker="other")
+        job = other.claim()
+        self.assertEqual(dead.id, job.id)
+        self.assertEqual({"encoded"}, job.done_stages())
+        self.assertFalse(dead.heartbeat())
+        self.assertTrue(job.heartbeat())
+
+    def test_lost_claim_is_not_finished(self):
+        self.submit(1)
+
+        def process(job):
+            # taken over and finished by another worker while this one was busy
+            os.utime(job.lock_file, (time.time() - 3600, time.time() - 3600))
+            EncodeFarm(self.farm_dir, lease=60, worker="other").claim().finish(0)
+            self.assertFalse(job.heartbeat())
+            return 1
+        self.assertEqual(0, work(self.farm, process, poll=0.01))
+        (id,) = self.farm.done()
+        self.assertEqual("other", self.farm.result(id)["worker"])
+        self.assertEqual(0, self.farm.result(id)["ret"])
+
+    def test_live_claim_is_not_taken_over(self):
+        self.submit(1)
+        self.assertIsNotNone(self.farm.claim())
+        self.assertIsNone(EncodeFarm(self.farm_dir, lease=60, worker="other").claim())
+
+    def test_processes_share_the_jobs(self):
+        self.submit(40)
+        log_dir = os.path.join(self.dir.name, "log")
+        os.makedirs(log_dir)
+        workers = [multiprocessing.Process(target=encode_all, args=(self.farm_dir, log_dir)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(60)
+            self.assertEqual(0, worker.exitcode)
+        encoded = [name.split(".")[0] for name in os.listdir(log_dir)]
+        self.assertEqual(40, len(set(encoded)))
+        self.assertEqual(40, len(encoded))
+        self.assertEqual(set(), self.farm.remaining())
+        self.assertEqual([], os.listdir(os.path.join(self.farm_dir, "locks")))
+
+
+if __name__ == '__main__':
+    unittest.main()
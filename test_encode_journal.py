@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+
+from encode_journal import EncodeJournal
+
+
+class TestEncodeJournal(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.journal = EncodeJournal(os.path.join(self.dir.name, "journal.sqlite"))
+        self.addCleanup(lambda: self.journal.close())
+
+    def test_remembers_stages(self):
+        self.journal.mark("a.MOD", 10, 1000, "encoded")
+        self.journal.mark("a.MOD", 10, 1000, "backed_up")
+        self.assertEqual({"encoded", "backed_up"}, self.journal.done_stages("a.MOD", 10, 1000))
+
+    def test_changed_file_starts_over(self):
+        self.journal.mark("a.MOD", 10, 1000, "encoded")
+        self.assertEqual(set(), self.journal.done_stages("a.MOD", 10, 2000))
+        self.assertEqual(set(), self.journal.done_stages("a.MOD", 10, 1000))
+
+    def test_pending_lists_half_finished(self):
+        for stage in ("encoded", "backed_up", "removed"):
+            self.journal.mark("half.MOD", 10, 1000, stage)
+        for stage in ("encoded", "backed_up", "removed", "copied_back"):
+            self.journal.mark("done.MOD", 10, 1000, stage)
+        self.journal.mark("encoding.MOD", 10, 1000, "encoded")
+        self.assertEqual([("half.MOD", 10, 1000, {"encoded", "backed_up", "removed"})],
+                         self.journal.pending("removed", "copied_back"))
+
+    def test_survives_reopen(self):
+        self.journal.mark("a.MOD", 10, 1000, "encoded")
+        self.journal.close()
+        self.journal = EncodeJournal(os.path.join(self.dir.name, "journal.sqlite"))
+        self.assertEqual({"encoded"}, self.journal.done_stages("a.MOD", 10, 1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from encode_queue import EncodeQueue
+
+
+class RecordingEncoder:
+    def __init__(self, fail=()):
+        self.fail = fail
+        self.started = []
+        self.lock = threading.Lock()
+
+    def encode(self, source, target):
+        with self.lock:
+            self.started.append(os.path.basename(source))
+        return 1 if os.path.basename(source) in self.fail else 0
+
+
+class TestEncodeQueue(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def make(self, name, size):
+        path = os.path.join(self.dir.name, name)
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+        return path
+
+    def test_runs_biggest_first(self):
+        encoder = RecordingEncoder()
+        queue = EncodeQueue(1, encoder)
+        for name, size in (("small.MOD", 10), ("big.MOD", 300), ("mid.MOD", 100)):
+            queue.add(self.make(name, size), name + ".mp4")
+        queue.run()
+        self.assertEqual(["big.MOD", "mid.MOD", "small.MOD"], encoder.started)
+
+    def test_reports_each_job_result(self):
+        done = {}
+        queue = EncodeQueue(3, RecordingEncoder(fail=("bad.MOD",)))
+        for name in ("good.MOD", "bad.MOD"):
+            queue.add(self.make(name, 10), name + ".mp4",
+                      lambda src, dst, ret: done.__setitem__(os.path.basename(src), ret))
+        results = queue.run()
+        self.assertEqual({"good.MOD": 0, "bad.MOD": 1}, done)
+        self.assertEqual(2, len(results))
+
+
+if __name__ == '__main__':
+    unittest.main()
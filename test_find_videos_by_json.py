@@ -0,0 +1,145 @@
+from datetime import datetime
+import json
+import ntpath
+import os
+import tempfile
+import unittest
+import zipfile
+
+import find_videos_by_json
+from file_hash import EDGE_SIZE, full_hash, partial_hash
+from find_videos_by_json import CopyDirIndex, ZipMember, ZipReader, copy_from_archives, copy_with_new_name, \
+    find_sidecar, member_hashes, sidecar_index
+from stat_cache import StatCache
+from transfer import PART_SUFFIX
+
+
+class TestCopyWithNewName(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.copy_dir = os.path.join(self.dir.name, "copy")
+        os.makedirs(self.copy_dir)
+
+    def make(self, folder, name, content):
+        path = os.path.join(self.dir.name, folder, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def test_skips_same_content(self):
+        big = os.urandom(300 * 1024)
+        index = CopyDirIndex(self.copy_dir)
+        first = copy_with_new_name(self.make("a", "IMG_1.jpg", big), self.copy_dir, index)
+        again = copy_with_new_name(self.make("b", "IMG_1(1).jpg", big), self.copy_dir, index)
+        self.assertEqual(first, again)
+        self.assertEqual(["IMG_1.jpg"], os.listdir(self.copy_dir))
+
+    def test_renames_real_collision(self):
+        index = CopyDirIndex(self.copy_dir)
+        copy_with_new_name(self.make("a", "IMG_1.jpg", b"a" * 1000), self.copy_dir, index)
+        # same size, same head and tail, different middle
+        copied = copy_with_new_name(self.make("b", "IMG_1.jpg", b"a" * 1000), self.copy_dir, index)
+        self.assertEqual(os.path.join(self.copy_dir, "IMG_1.jpg"), copied)
+        middle = bytearray(b"a" * (300 * 1024))
+        middle[150 * 1024] = ord("b")
+        copy_with_new_name(self.make("c", "IMG_2.jpg", b"a" * (300 * 1024)), self.copy_dir, index)
+        copied = copy_with_new_name(self.make("d", "IMG_2.jpg", bytes(middle)), self.copy_dir, index)
+        self.assertEqual(os.path.join(self.copy_dir, "IMG_2_1.jpg"), copied)
+
+    def test_index_sees_existing_files(self):
+        self.make("copy", "IMG_3.jpg", b"old")
+        copied = copy_with_new_name(self.make("a", "IMG_3.jpg", b"new"), self.copy_dir)
+        self.assertEqual(os.path.join(self.copy_dir, "IMG_3_1.jpg"), copied)
+
+    def test_index_leaves_out_unfinished_copies(self):
+        self.make("copy", ".IMG_3.jpgk2j4" + PART_SUFFIX, b"old")
+        self.assertEqual({}, CopyDirIndex(self.copy_dir).by_size)
+
+
+class TestFindSidecar(unittest.TestCase):
+    class Entry:
+        def __init__(self, name):
+            self.name = name
+
+    def test_finds_suffixed_sidecar(self):
+        sidecars = sidecar_index([self.Entry("IMG_1.jpg.json"), self.Entry("IMG_1.jpg")])
+        self.assertEqual("IMG_1.jpg.json", find_sidecar("IMG_1(1).jpg", sidecars).name)
+        self.assertIsNone(find_sidecar("IMG_2.jpg", sidecars))
+
+    def test_case_insensitive_on_windows(self):
+        normcase = find_videos_by_json.os.path.normcase
+        find_videos_by_json.os.path.normcase = ntpath.normcase
+        try:
+            sidecars = sidecar_index([self.Entry("IMG_1.JPG.JSON"), self.Entry("PXL_2.MP.JPG.json")])
+            self.assertEqual("IMG_1.JPG.JSON", find_sidecar("IMG_1.jpg", sidecars).name)
+            self.assertEqual("PXL_2.MP.JPG.json", find_sidecar("PXL_2.MP", sidecars).name)
+        finally:
+            find_videos_by_json.os.path.normcase = normcase
+
+
+class TestCopyFromArchives(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.copy_dir = os.path.join(self.dir.name, "copy")
+        os.makedirs(self.copy_dir)
+        self.cache = StatCache(os.path.join(self.dir.name, "cache.sqlite"), "sidecar_timestamps")
+        self.addCleanup(self.cache.close)
+
+    def archive(self, name, members):
+        path = os.path.join(self.dir.name, name)
+        with zipfile.ZipFile(path, "w") as zf:
+            for (member, data) in members.items():
+                zf.writestr("Takeout/Google Фото/Album/" + member, data)
+        return path
+
+    def sidecar(self, day):
+        return json.dumps({"creationTime": {"timestamp": str(int(datetime(2023, 1, day).timestamp()))}})
+
+    def copy(self):
+        copy_from_archives([self.first, self.second], self.copy_dir, CopyDirIndex(self.copy_dir), self.cache,
+                           datetime(2023, 1, 1), datetime(2023, 1, 10), workers=3, archive_workers=2)
+
+    def test_copies_selected_members(self):
+        # the album is split over both zips, IMG_2's sidecar is in the other one
+        self.first = self.archive("takeout-001.zip", {
+            "IMG_1.jpg": b"one" * 1000, "IMG_1.jpg.json": self.sidecar(2),
+            "IMG_2.jpg": b"two" * 1000, "IMG_3.jpg.json": self.sidecar(20),
+            "IMG_4.jpg": b"no sidecar"})
+        self.second = self.archive("takeout-002.zip", {
+            "IMG_2.jpg.json": self.sidecar(3), "IMG_3.jpg": b"three",
+            "IMG_1(1).jpg": b"one" * 1000, "IMG_1.jpg(1).json": self.sidecar(2)})
+        self.copy()
+        self.assertEqual(["IMG_1.jpg", "IMG_2.jpg"], sorted(os.listdir(self.copy_dir)))
+        with open(os.path.join(self.copy_dir, "IMG_2.jpg"), "rb") as f:
+            self.assertEqual(b"two" * 1000, f.read())
+        # second run finds everything in place and the timestamps in the cache, duplicates are never written
+        written = []
+        mkstemp = find_videos_by_json.tempfile.mkstemp
+        find_videos_by_json.tempfile.mkstemp = lambda *args: written.append(args) or mkstemp(*args)
+        try:
+            self.copy()
+        finally:
+            find_videos_by_json.tempfile.mkstemp = mkstemp
+        self.assertEqual([], written)
+        self.assertEqual(["IMG_1.jpg", "IMG_2.jpg"], sorted(os.listdir(self.copy_dir)))
+
+    def test_member_hashes_match_file_hashes(self):
+        contents = [os.urandom(size) for size in (10, EDGE_SIZE + 7, 2 * EDGE_SIZE - 1, 3 * EDGE_SIZE + 5)]
+        path = self.archive("takeout-001.zip", {"IMG_%d.jpg" % (i,): data for (i, data) in enumerate(contents)})
+        reader = ZipReader()
+        self.addCleanup(reader.close)
+        with zipfile.ZipFile(path) as zf:
+            members = [ZipMember(path, info) for info in zf.infolist()]
+        for (member, data) in zip(members, contents):
+            extracted = os.path.join(self.dir.name, member.name)
+            with open(extracted, "wb") as f:
+                f.write(data)
+            self.assertEqual((partial_hash(extracted, len(data)), full_hash(extracted)),
+                             member_hashes(member, reader))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import csv
+import os
+import stat
+import sys
+import tempfile
+import unittest
+
+from encode_report import EncodeReport
+from hb_encoder import EncodeProgress, HbEncoder
+from test_media_probe import mpeg_ps
+
+FAKE_HANDBRAKE = """#!%s
+import sys
+args = sys.argv[1:]
+with open(args[args.index("-i") + 1], "rb") as src, open(args[args.index("-o") + 1], "wb") as dst:
+    dst.write(src.read()[:10])
+sys.stdout.write("Encoding: task 1 of 1, 10.00 %%\\r")
+sys.stdout.write("Encoding: task 1 of 1, 55.50 %% (120.00 fps, avg 110.00 fps, ETA 00h01m05s)\\r")
+sys.stdout.write("\\nEncode done!\\n")
+"""
+
+
+class TestProgressParsing(unittest.TestCase):
+    def test_parses_full_line(self):
+        progress = EncodeProgress.parse("Encoding: task 1 of 1, 42.17 % (231.52 fps, avg 245.03 fps, ETA 00h02m10s)")
+        self.assertEqual((42.17, 231.52, 245.03, 130), (progress.percent, progress.fps, progress.avg_fps, progress.eta))
+
+    def test_parses_early_line(self):
+        progress = EncodeProgress.parse("Encoding: task 2 of 2, 50.00 %")
+        self.assertEqual((75.0, None), (progress.percent, progress.eta))
+
+    def test_ignores_other_output(self):
+        self.assertIsNone(EncodeProgress.parse("Encode done!"))
+
+
+@unittest.skipIf(os.name == "nt", "fake HandBrakeCLI is a shebang script")
+class TestHbEncoder(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.handbrake = os.path.join(self.dir.name, "HandBrakeCLI")
+        with open(self.handbrake, "w") as f:
+            f.write(FAKE_HANDBRAKE % (sys.executable,))
+        os.chmod(self.handbrake, stat.S_IRWXU)
+        self.source = os.path.join(self.dir.name, "MOV001.MOD")
+        with open(self.source, "wb") as f:
+            f.write(b"x" * 40)
+
+    def test_streams_progress_and_reports(self):
+        seen = []
+        report_file = os.path.join(self.dir.name, "report.csv")
+        encoder = HbEncoder(lambda source, progress: seen.append(progress.percent), EncodeReport(report_file),
+                            self.handbrake)
+        target = os.path.join(self.dir.name, "MOV001.mp4")
+        self.assertEqual(0, encoder.encode(self.source, target))
+        self.assertEqual([10.0, 55.5], seen)
+        with open(report_file) as f:
+            (row,) = list(csv.DictReader(f))
+        self.assertEqual(("40", "10", "4.0", "110.0"),
+                         (row["input_bytes"], row["output_bytes"], row["ratio"], row["avg_fps"]))
+
+    def test_encodes_long_source_in_segments(self):
+        with open(self.handbrake, "w") as f:
+            # writes the time range it was asked for, so the joined outputs show which ranges were encoded
+            f.write(FAKE_HANDBRAKE.replace("src.read()[:10]", "' '.join(args[args.index('-i'):args.index('-o')])"
+                                           ".encode() + b'\\n'") % (sys.executable,))
+        with open(self.source, "wb") as f:
+            for i in range(6):
+                f.write(mpeg_ps(scr=i * 90000) + bytes([i]) * 3000)
+        os.utime(self.source, (1000000000, 1000000000))
+        joined = []
+
+        def concat(parts, target):
+            joined.append([os.path.basename(part) for part in parts])
+            with open(target, "wb") as out:
+                for part in parts:
+                    with open(part, "rb") as f:
+                        out.write(f.read())
+            return 0
+
+        seen = []
+        encoder = HbEncoder(lambda source, progress: seen.append(progress.percent), handbrake=self.handbrake,
+                            split_over=1000, segments=3, concat=concat)
+        target = os.path.join(self.dir.name, "MOV001.mp4")
+        self.assertEqual(0, encoder.encode(self.source, target))
+        self.assertEqual([["MOV001.000.mp4", "MOV001.001.mp4", "MOV001.002.mp4"]], joined)
+        with open(target) as f:
+            # the source itself is read by every HandBrakeCLI, no copies of its parts are made
+            self.assertEqual(["-i %s -t 1 -c 1 --stop-at pts:180000" % (self.source,),
+                              "-i %s -t 1 -c 1 --start-at pts:180000 --stop-at pts:180000" % (self.source,),
+                              "-i %s -t 1 -c 1 --start-at pts:360000" % (self.source,)], f.read().splitlines())
+        self.assertEqual(1000000000, int(os.path.getmtime(target)))
+        self.assertFalse(os.path.exists(target + ".segments"))
+        self.assertAlmostEqual(55.5, max(seen), places=3)
+
+    def test_small_source_is_not_split(self):
+        encoder = HbEncoder(handbrake=self.handbrake, split_over=1000, concat=None)
+        self.assertEqual(0, encoder.encode(self.source, os.path.join(self.dir.name, "MOV001.mp4")))
+
+
+if __name__ == '__main__':
+    unittest.main()
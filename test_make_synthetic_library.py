@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+
+from find_videos_by_json import find_sidecar, sidecar_index
+from make_synthetic_library import make_camera_tree, make_date_folders, make_takeout
+from walker import walk_dirs, walk_files
+
+
+class TestSyntheticLibrary(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def test_camera_tree_names_are_unique(self):
+        top = os.path.join(self.dir.name, "vid")
+        self.assertEqual(500, make_camera_tree(top, 500, depth=3, size=4096))
+        files = list(walk_files(top))
+        self.assertEqual(500, len(files))
+        self.assertEqual(500, len({file.name for file in files}))
+        self.assertTrue(all(file.size == 4096 for file in files))
+        self.assertTrue(all(file.path.count(os.sep) - top.count(os.sep) == 4 for file in files))
+
+    def test_date_folders(self):
+        top = os.path.join(self.dir.name, "pictures")
+        self.assertEqual(30, make_date_folders(top, 30, files_per_folder=2))
+        self.assertEqual(30, len(os.listdir(top)))
+        self.assertEqual(60, len(list(walk_files(top))))
+
+    def test_every_takeout_file_has_a_sidecar(self):
+        top = os.path.join(self.dir.name, "takeout")
+        make_takeout(top, 100)
+        media = 0
+        for (root, files) in walk_dirs(top):
+            sidecars = sidecar_index(files)
+            for file in files:
+                if not file.name.endswith(".json"):
+                    media += 1
+                    self.assertIsNotNone(find_sidecar(file.name, sidecars), file.name)
+        self.assertEqual(100, media)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import struct
+import tempfile
+import unittest
+from datetime import datetime
+
+from media_date import capture_date, capture_dates, MP4_EPOCH_OFFSET
+from test_media_probe import box
+
+
+def jpeg(taken=b"2019:07:14 18:03:59"):
+    # IFD0 with one entry pointing at the Exif IFD, which holds DateTimeOriginal
+    ifd0 = struct.pack("<H", 1) + struct.pack("<HHII", 0x8769, 4, 1, 26) + struct.pack("<I", 0)
+    exif_ifd = struct.pack("<H", 1) + struct.pack("<HHII", 0x9003, 2, 20, 44) + struct.pack("<I", 0)
+    tiff = b"II*\x00" + struct.pack("<I", 8) + ifd0 + exif_ifd + taken + b"\x00"
+    app0 = b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\x00" + b"\x00" * 9
+    app1 = b"\xff\xe1" + struct.pack(">H", 8 + len(tiff)) + b"Exif\x00\x00" + tiff
+    return b"\xff\xd8" + app0 + app1 + b"\xff\xda" + b"\x00" * 100 + b"\xff\xd9"
+
+
+def mp4(created):
+    mvhd = box(b"mvhd", b"\x00\x00\x00\x00" + struct.pack(">II", created, created) + b"\x00" * 88)
+    return box(b"ftyp", b"isom\x00\x00\x02\x00") + box(b"mdat", b"\x00" * 3000) + box(b"moov", mvhd)
+
+
+class TestMediaDate(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_reads_exif_date(self):
+        self.assertEqual(datetime(2019, 7, 14, 18, 3, 59), capture_date(self.write("IMG_1.jpg", jpeg())))
+
+    def test_unset_exif_date(self):
+        self.assertIsNone(capture_date(self.write("IMG_1.jpg", jpeg(b"0000:00:00 00:00:00"))))
+
+    def test_reads_mvhd_creation_time(self):
+        taken = datetime(2013, 2, 13, 20, 47, 44)
+        path = self.write("MOV064.mp4", mp4(int(taken.timestamp()) + MP4_EPOCH_OFFSET))
+        self.assertEqual(taken, capture_date(path))
+
+    def test_zero_creation_time(self):
+        self.assertIsNone(capture_date(self.write("MOV064.mp4", mp4(0))))
+
+    def test_batch_keeps_order(self):
+        paths = [self.write("IMG_1.jpg", jpeg()), self.write("notes.txt", b"hello"),
+                 os.path.join(self.dir.name, "missing.mp4")]
+        self.assertEqual([(paths[0], datetime(2019, 7, 14, 18, 3, 59)), (paths[1], None), (paths[2], None)],
+                         list(capture_dates(paths)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import struct
+import tempfile
+import unittest
+
+from media_probe import PACK_START, is_encoded, probe, skip_reason, split_points, split_times
+
+
+def box(box_type, payload):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def mp4(codec=b"avc1", width=1024, height=576, with_moov=True):
+    entry = box(codec, b"\x00" * 24 + struct.pack(">HH", width, height) + b"\x00" * 50)
+    stsd = box(b"stsd", b"\x00" * 4 + struct.pack(">I", 1) + entry)
+    moov = box(b"moov", box(b"mvhd", b"\x00" * 100) +
+               box(b"trak", box(b"mdia", box(b"minf", box(b"stbl", stsd)))))
+    data = box(b"ftyp", b"isom\x00\x00\x02\x00isomavc1") + box(b"mdat", b"\x00" * 5000)
+    return data + moov if with_moov else data
+
+
+def pack_header(scr=0):
+    """ MPEG-2 pack header with the system clock reference scr (90 kHz ticks). """
+    return PACK_START + bytes([0x44 | ((scr >> 30) & 7) << 3 | (scr >> 28) & 3, (scr >> 20) & 0xff,
+                               ((scr >> 15) & 0x1f) << 3 | 0x04 | (scr >> 13) & 3, (scr >> 5) & 0xff,
+                               (scr & 0x1f) << 3 | 0x04, 0x01]) + b"\x00" * 4
+
+
+def mpeg_ps(width=720, height=576, scr=0):
+    pack = pack_header(scr)
+    sequence = b"\x00\x00\x01\xb3" + bytes([width >> 4, ((width & 0x0f) << 4) | (height >> 8), height & 0xff])
+    return pack + b"\x00" * 100 + sequence + b"\x00" * 1000
+
+
+class TestMediaProbe(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_reads_mpeg_ps(self):
+        info = probe(self.write("MOV001.MOD", mpeg_ps()))
+        self.assertEqual(("mpeg-ps", "mpeg2", 720, 576), (info.container, info.codec, info.width, info.height))
+
+    def test_reads_mp4_moov_after_mdat(self):
+        info = probe(self.write("MOV001.mp4", mp4()))
+        self.assertEqual(("mp4+moov", "avc1", 1024, 576), (info.container, info.codec, info.width, info.height))
+
+    def test_unfinished_mp4_is_not_encoded(self):
+        self.assertFalse(is_encoded(self.write("half.mp4", mp4(with_moov=False)), "avc1", 1024, 576))
+        self.assertFalse(is_encoded(self.write("cut.mp4", mp4()[:-20]), "avc1", 1024, 576))
+        self.assertFalse(is_encoded(os.path.join(self.dir.name, "missing.mp4"), "avc1", 1024, 576))
+
+    def test_unknown_and_empty_files(self):
+        self.assertIsNone(probe(self.write("empty.MOD", b"")))
+        self.assertIsNone(probe(self.write("text.MOD", b"hello world")))
+
+    def test_splits_at_gop_packs(self):
+        # 8 GOPs of a pack with the sequence header and 4 packs of pictures each
+        gops = [mpeg_ps() + (PACK_START + b"\x44" + b"\x01" * 2000) * 4 for _ in range(8)]
+        starts = [sum(len(gop) for gop in gops[:i]) for i in range(8)]
+        points = split_points(self.write("MOV001.MOD", b"".join(gops)), 4)
+        self.assertEqual(3, len(points))
+        self.assertTrue(set(points) <= set(starts[1:]))
+        self.assertEqual(sorted(points), points)
+
+    def test_split_times_from_pack_clocks(self):
+        # 6 GOPs of half a second, the clock starts somewhere and wraps around after the third
+        start = (1 << 33) - 100000
+        gops = [mpeg_ps(scr=(start + i * 45000) % (1 << 33)) + b"\x01" * 3000 for i in range(6)]
+        path = self.write("MOV001.MOD", b"".join(gops))
+        times = split_times(path, 3)
+        self.assertEqual(split_points(path, 3), [offset for (offset, _) in times])
+        self.assertEqual([90000, 180000], [ticks for (_, ticks) in times])
+
+    def test_no_split_points_without_gops(self):
+        self.assertEqual([], split_points(self.write("MOV001.MOD", mpeg_ps()), 4))
+        self.assertEqual([], split_points(self.write("MOV001.mp4", mp4()), 4))
+        self.assertEqual([], split_points(self.write("empty.MOD", b""), 4))
+
+    def test_skip_reasons(self):
+        source = self.write("MOV001.MOD", mpeg_ps())
+        target = os.path.join(self.dir.name, "MOV001.mp4")
+        self.assertIsNone(skip_reason(source, target, "avc1", 1024, 576))
+        self.write("MOV001.mp4", mp4())
+        self.assertIsNotNone(skip_reason(source, target, "avc1", 1024, 576))
+        self.assertIsNotNone(skip_reason(self.write("MOV002.MOD", mp4()), target + "x", "avc1", 1024, 576))
+
+
+if __name__ == '__main__':
+    unittest.main()
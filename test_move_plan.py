@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+
+from move_plan import MovePlan
+
+
+class TestMovePlan(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def path(self, *parts):
+        return os.path.join(self.dir.name, *parts)
+
+    def touch(self, *parts):
+        os.makedirs(os.path.dirname(self.path(*parts)), exist_ok=True)
+        open(self.path(*parts), "w").close()
+        return self.path(*parts)
+
+    def test_finds_clashes_before_moving(self):
+        plan = MovePlan()
+        plan.add(self.touch("a", "MOV001.MOD"), self.path("vid", "MOV001.MOD"))
+        plan.add(self.touch("b", "MOV001.MOD"), self.path("vid", "MOV001.MOD"))
+        plan.add(self.touch("c", "MOV002.MOD"), self.touch("vid", "MOV002.MOD"))
+        plan.add(self.path("d", "gone.MOD"), self.path("vid", "gone.MOD"))
+        problems = plan.problems()
+        self.assertEqual({(self.path("b", "MOV001.MOD"), self.path("vid", "MOV001.MOD")),
+                          (self.path("c", "MOV002.MOD"), self.path("vid", "MOV002.MOD")),
+                          (self.path("d", "gone.MOD"), self.path("vid", "gone.MOD"))}, set(problems))
+        self.assertTrue(os.path.exists(self.path("a", "MOV001.MOD")))
+
+    def test_executes_files_and_dirs(self):
+        plan = MovePlan()
+        plan.add(self.touch("a", "MOV001.MOD"), self.path("vid", "2012", "MOV001.MOD"))
+        self.touch("2012.01.01", "pic.jpg")
+        plan.add(self.path("2012.01.01"), self.path("2012", "01.01"))
+        self.assertEqual({}, plan.problems())
+        self.assertEqual([], plan.execute())
+        self.assertTrue(os.path.exists(self.path("vid", "2012", "MOV001.MOD")))
+        self.assertTrue(os.path.exists(self.path("2012", "01.01", "pic.jpg")))
+        self.assertFalse(os.path.exists(self.path("2012.01.01")))
+
+    def test_target_appearing_after_planning_is_kept(self):
+        plan = MovePlan()
+        plan.add(self.touch("a", "MOV001.MOD"), self.path("vid", "MOV001.MOD"))
+        self.touch("b", "pic.jpg")
+        plan.add(self.path("b"), self.path("pics"))
+        self.assertEqual({}, plan.problems())
+        with open(self.touch("vid", "MOV001.MOD"), "w") as f:
+            f.write("there first")
+        self.touch("pics", "other.jpg")
+        self.assertEqual(sorted(plan.moves), sorted(plan.execute()))
+        with open(self.path("vid", "MOV001.MOD")) as f:
+            self.assertEqual("there first", f.read())
+        self.assertTrue(os.path.exists(self.path("a", "MOV001.MOD")))
+        self.assertEqual(["other.jpg"], os.listdir(self.path("pics")))
+
+    def test_groups_by_device(self):
+        plan = MovePlan()
+        plan.add(self.touch("a", "MOV001.MOD"), self.path("new", "deeper", "MOV001.MOD"))
+        ((src_dev, dst_dev),) = plan.groups()
+        self.assertEqual(src_dev, dst_dev)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import random
+import tempfile
+import unittest
+from PIL import Image, ImageDraw
+
+from near_duplicates import MultiIndex, distance, image_hashes, near_duplicate_groups, picture_hashes
+from stat_cache import StatCache
+
+
+def picture(seed, size=(640, 480)):
+    rnd = random.Random(seed)
+    im = Image.new("RGB", size, (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+    draw = ImageDraw.Draw(im)
+    for _ in range(12):
+        (x, y) = (rnd.randrange(size[0]), rnd.randrange(size[1]))
+        draw.ellipse((x, y, x + size[0] // 3, y + size[1] // 3),
+                     fill=(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+    return im
+
+
+class TestMultiIndex(unittest.TestCase):
+    def test_finds_what_brute_force_finds(self):
+        rnd = random.Random(1)
+        hashes = [rnd.getrandbits(64) for _ in range(300)]
+        # plant near copies
+        hashes += [value ^ (1 << rnd.randrange(64)) ^ (1 << rnd.randrange(64)) for value in hashes[:50]]
+        index = MultiIndex(radius=6)
+        for value in hashes:
+            index.add(value)
+        for value in hashes[:80]:
+            expected = [i for (i, other) in enumerate(hashes) if distance(value, other) <= 6]
+            self.assertEqual(expected, index.search(value))
+
+    def test_groups_chain_through_neighbours(self):
+        groups = near_duplicate_groups([0b0, 0b111, 0b111111, (1 << 64) - 1], radius=3)
+        self.assertEqual([[0, 1, 2]], groups)
+
+
+class TestPictureHashes(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def save(self, im, name, **options):
+        path = os.path.join(self.dir.name, name)
+        im.save(path, **options)
+        return path
+
+    def test_resized_and_resaved_copies_are_near(self):
+        original = picture(1)
+        paths = [self.save(original, "IMG_1.jpg", quality=95),
+                 self.save(original.resize((320, 240)), "IMG_1-small.jpg"),
+                 self.save(original, "IMG_1-измененный.jpg", quality=40),
+                 self.save(picture(2), "IMG_2.jpg"),
+                 self.save(picture(3), "IMG_3.png")]
+        for column in (0, 1):
+            hashes = [image_hashes(path)[1][column] for path in paths]
+            self.assertEqual([[0, 1, 2]], near_duplicate_groups(hashes, radius=6))
+
+    def test_cached_by_mtime(self):
+        path = self.save(picture(1), "IMG_1.jpg")
+        broken = os.path.join(self.dir.name, "broken.jpg")
+        with open(broken, "wb") as f:
+            f.write(b"not a picture")
+        cache = StatCache(os.path.join(self.dir.name, "hashes.sqlite"))
+        self.addCleanup(cache.close)
+        (hashes, missing) = picture_hashes([path, broken], cache, 1)
+        self.assertIsNone(missing)
+        self.assertEqual([640, 480], hashes[2:])
+        os.remove(path)
+        self.save(picture(2), "IMG_1.jpg")
+        os.utime(path, (1000000000, 1000000000))
+        self.assertNotEqual(hashes, picture_hashes([path], cache, 1)[0])
+
+    def test_decompression_bomb_is_skipped(self):
+        path = self.save(picture(1), "IMG_1.jpg")
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = 100
+        try:
+            self.assertEqual((path, None), image_hashes(path))
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import threading
+import time
+import unittest
+
+from pipeline import ByteBudget, Stage
+
+
+class TestByteBudget(unittest.TestCase):
+    def test_blocks_until_released(self):
+        budget = ByteBudget(100)
+        budget.acquire(60)
+        acquired = threading.Event()
+        thread = threading.Thread(target=lambda: (budget.acquire(60), acquired.set()))
+        thread.start()
+        self.assertFalse(acquired.wait(0.1))
+        budget.release(60)
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+        self.assertEqual(60, budget.used)
+
+    def test_oversized_request_goes_through_alone(self):
+        budget = ByteBudget(100)
+        budget.acquire(500)
+        self.assertEqual(500, budget.used)
+
+
+class TestStage(unittest.TestCase):
+    def test_runs_every_item_and_counts_failures(self):
+        done = []
+        lock = threading.Lock()
+
+        def work(item):
+            if item == 3:
+                raise ValueError(item)
+            if item == 5:
+                return False
+            with lock:
+                done.append(item)
+        stage = Stage("test", work, workers=3)
+        for item in range(10):
+            stage.put(item)
+        self.assertEqual(2, stage.close())
+        self.assertEqual([0, 1, 2, 4, 6, 7, 8, 9], sorted(done))
+
+    def test_failures_of_many_workers_all_count(self):
+        stage = Stage("test", lambda item: False, workers=8, queue_size=64)
+        for item in range(2000):
+            stage.put(item)
+        self.assertEqual(2000, stage.close())
+
+    def test_full_queue_holds_back_the_feeder(self):
+        release = threading.Event()
+        stage = Stage("slow", lambda item: release.wait(), workers=1, queue_size=1)
+        # one item in the worker, one in the queue, the third put has to wait
+        stage.put(1)
+        stage.put(2)
+        fed = threading.Event()
+        feeder = threading.Thread(target=lambda: (stage.put(3), fed.set()))
+        feeder.start()
+        time.sleep(0.1)
+        self.assertFalse(fed.is_set())
+        release.set()
+        feeder.join(5)
+        self.assertTrue(fed.is_set())
+        self.assertEqual(0, stage.close())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+from PIL import Image
+
+from process_new_pics import make_thumbnails, thumbnail_name
+
+
+class TestProcessNewPics(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.picture = os.path.join(self.dir.name, "IMG_1.jpg")
+        Image.new("RGB", (800, 600), (200, 100, 50)).save(self.picture)
+        os.utime(self.picture, (1000000000, 1000000000))
+
+    def test_thumbnail_names(self):
+        self.assertEqual(os.path.join("pics", "IMG_1.thumbnail"),
+                         thumbnail_name(os.path.join("pics", "IMG_1.jpg"), 128))
+        self.assertEqual(os.path.join("pics", "IMG_1.1024.thumbnail"),
+                         thumbnail_name(os.path.join("pics", "IMG_1.jpg"), 1024))
+
+    def test_makes_every_size(self):
+        self.assertEqual("converted", make_thumbnails((self.picture, [128, 400])))
+        for (size, expected) in ((128, (128, 96)), (400, (400, 300))):
+            with Image.open(thumbnail_name(self.picture, size)) as im:
+                self.assertEqual(("JPEG", expected), (im.format, im.size))
+
+    def test_up_to_date_thumbnails_are_skipped(self):
+        self.assertEqual("converted", make_thumbnails((self.picture, [128, 400])))
+        self.assertEqual("up to date", make_thumbnails((self.picture, [128, 400])))
+        # only the outdated one is made again
+        small = thumbnail_name(self.picture, 128)
+        os.utime(small, (900000000, 900000000))
+        self.assertEqual("converted", make_thumbnails((self.picture, [128, 400])))
+        self.assertGreater(os.path.getmtime(small), 1000000000)
+
+    def test_unreadable_picture_is_skipped(self):
+        broken = os.path.join(self.dir.name, "broken.jpg")
+        with open(broken, "wb") as f:
+            f.write(b"not a picture")
+        self.assertEqual("failed", make_thumbnails((broken, [128])))
+        self.assertFalse(os.path.exists(thumbnail_name(broken, 128)))
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = 100
+        try:
+            self.assertEqual("failed", make_thumbnails((self.picture, [128])))
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+        self.assertFalse(os.path.exists(thumbnail_name(self.picture, 128)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,8 @@
 from datetime import datetime
+import os
 import unittest
 
-from renamer import proper_name
+from renamer import proper_name, proper_names
 
 
 class TestRenaming(unittest.TestCase):
@@ -48,6 +49,22 @@ class TestRenaming(unittest.TestCase):
         self.assertEqual(expected, proper_name(start, self.timestamp))
 
 
+class TestBatchRenaming(unittest.TestCase):
+    timestamp = TestRenaming.timestamp
+
+    def test_batch_matches_single(self):
+        names = ["MOV03D.mp4", "2012.10.19 1.mp4", "VID_20120307_193607.mp4", "video-2010-05-09-12-52-10.3gp",
+                 "2013.02.13_20-47-44_MOV064.mp4", "2012.12.15_162651.mp4", "2012.08.18_11-55-12_2012.08.18.3gp",
+                 "MOV03D.mp4"]
+        files = [(os.path.join("vid", "6m-9m", name), self.timestamp) for name in names]
+        self.assertEqual([proper_name(file, timestamp) for (file, timestamp) in files], list(proper_names(files)))
+
+    def test_batch_uses_each_timestamp(self):
+        other = datetime.strptime("2014.01.02 03:04:05", "%Y.%m.%d %H:%M:%S")
+        files = [("MOV03D.mp4", self.timestamp), ("MOV03D.mp4", other)]
+        self.assertEqual(["2012.03.27_10-23-17_MOV061.mp4", "2014.01.02_03-04-05_MOV061.mp4"],
+                         list(proper_names(files)))
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import time
+import unittest
+
+from scrub import ScrubManifest, ScrubRun
+
+
+class TestScrub(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.top = os.path.join(self.dir.name, "backup")
+        self.manifest = ScrubManifest(os.path.join(self.dir.name, "scrub.sqlite"))
+        self.addCleanup(self.manifest.close)
+
+    def make(self, name, data, mtime=1000000000):
+        path = os.path.join(self.top, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def scrub(self, max_bytes=None):
+        return ScrubRun(self.manifest, [self.top], max_bytes, workers=2).run()
+
+    def test_finds_corrupt_and_missing(self):
+        rotting = self.make("2012/MOV001.MOD", b"a" * 1000)
+        gone = self.make("2012/MOV002.MOD", b"b" * 1000)
+        self.assertEqual(2, self.scrub().new)
+        # same size and mtime, different content: bit rot
+        self.make("2012/MOV001.MOD", b"a" * 500 + b"x" + b"a" * 499)
+        os.remove(gone)
+        run = self.scrub()
+        self.assertEqual([rotting], run.corrupt)
+        self.assertEqual([rotting], self.manifest.with_status(self.top, "corrupt"))
+        self.assertEqual([gone], self.manifest.with_status(self.top, "missing"))
+
+    def test_rewritten_file_is_hashed_again(self):
+        self.make("MOV001.MOD", b"a" * 1000)
+        self.scrub()
+        self.make("MOV001.MOD", b"new", mtime=1100000000)
+        run = self.scrub()
+        self.assertEqual((1, 1, []), (run.changed, run.new, run.corrupt))
+
+    def test_budget_goes_to_oldest_first(self):
+        for i in range(6):
+            self.make("MOV%03d.MOD" % (i,), bytes([i]) * 100)
+        self.scrub()
+        hashed = time.time()
+        first = self.scrub(max_bytes=300)
+        self.assertEqual((3, 300), (first.checked, first.checked_bytes))
+        second = self.scrub(max_bytes=300)
+        self.assertEqual(3, second.checked)
+        # every file got its turn in one of the two runs
+        (oldest,) = self.manifest.db.execute("SELECT MIN(verified) FROM files").fetchone()
+        self.assertGreater(oldest, hashed)
+
+    def test_budget_is_shared_by_all_trees(self):
+        library = os.path.join(self.dir.name, "vid")
+        for i in range(4):
+            self.make("MOV%03d.MOD" % (i,), bytes([i]) * 100)
+            path = os.path.join(library, "MOV%03d.mp4" % (i,))
+            os.makedirs(library, exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(bytes([i]) * 100)
+        tops = [self.top, library]
+        ScrubRun(self.manifest, tops, workers=2).run()
+        hashed = time.time()
+        # less than either tree per run, the oldest checks come first whichever tree they are in
+        for _ in range(4):
+            self.assertEqual(2, ScrubRun(self.manifest, tops, 200, workers=2).run().checked)
+        for top in tops:
+            self.assertGreater(self.manifest.oldest_check(top), hashed)
+
+    def test_stays_within_tree(self):
+        self.make("MOV001.MOD", b"a")
+        other = ScrubRun(self.manifest, [self.top + "-other"], workers=1)
+        os.makedirs(self.top + "-other")
+        other.run()
+        self.assertEqual(0, other.new)
+        self.assertEqual([], self.manifest.with_status(self.top, "missing"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import os
+import tempfile
+import unittest
+
+from stat_cache import StatCache
+
+
+class TestStatCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.db_file = os.path.join(self.dir.name, "cache.sqlite")
+
+    def test_value_survives_reopen(self):
+        cache = StatCache(self.db_file)
+        cache.put("a.json", 1000, "1671000000")
+        cache.close()
+        cache = StatCache(self.db_file)
+        self.assertEqual("1671000000", cache.get("a.json", 1000))
+        cache.close()
+
+    def test_changed_stamp_misses(self):
+        cache = StatCache(self.db_file)
+        cache.put("a.json", 1000, [1, 2])
+        self.assertEqual([1, 2], cache.get("a.json", 1000))
+        self.assertIsNone(cache.get("a.json", 2000))
+        self.assertEqual("none", cache.get("b.json", 1000, "none"))
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
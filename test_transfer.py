@@ -0,0 +1,129 @@
+import os
+import tempfile
+import unittest
+
+import transfer
+from file_hash import full_hash, partial_hash
+from transfer import copy_file, copy_verified, move_file, move_verified, same_device, PART_SUFFIX
+
+
+class TestTransfer(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.src = os.path.join(self.dir.name, "MOV001.MOD")
+        self.data = os.urandom(5 * 1024 * 1024 + 17)
+        with open(self.src, "wb") as f:
+            f.write(self.data)
+        os.utime(self.src, (1000000000, 1000000000))
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_copy_keeps_data_and_mtime(self):
+        os.makedirs(os.path.join(self.dir.name, "backup"))
+        copied = copy_file(self.src, os.path.join(self.dir.name, "backup"))
+        self.assertEqual(os.path.join(self.dir.name, "backup", "MOV001.MOD"), copied)
+        self.assertEqual(self.data, self.read(copied))
+        self.assertEqual(1000000000, int(os.path.getmtime(copied)))
+        self.assertFalse(os.path.exists(copied + PART_SUFFIX))
+
+    def test_copy_resumes_partial(self):
+        dst = os.path.join(self.dir.name, "copy.MOD")
+        with open(dst + PART_SUFFIX, "wb") as f:
+            f.write(self.data[:3 * 1024 * 1024])
+        copy_file(self.src, dst)
+        self.assertEqual(self.data, self.read(dst))
+
+    def test_copy_restarts_mismatched_partial(self):
+        dst = os.path.join(self.dir.name, "copy.MOD")
+        with open(dst + PART_SUFFIX, "wb") as f:
+            f.write(b"x" * (3 * 1024 * 1024))
+        copy_file(self.src, dst)
+        self.assertEqual(self.data, self.read(dst))
+
+    def test_chunked_fallback(self):
+        dst = os.path.join(self.dir.name, "copy.MOD")
+        def unsupported(*args):
+            raise AttributeError
+        originals = (transfer._reflink, transfer._copy_file_range_chunk, transfer._sendfile_chunk)
+        transfer._reflink = lambda fsrc, fdst: False
+        transfer._copy_file_range_chunk = transfer._sendfile_chunk = unsupported
+        try:
+            copy_file(self.src, dst)
+        finally:
+            (transfer._reflink, transfer._copy_file_range_chunk, transfer._sendfile_chunk) = originals
+        self.assertEqual(self.data, self.read(dst))
+
+    def test_copy_verified_to_several(self):
+        dsts = [os.path.join(self.dir.name, name) for name in ("backup", "nas")]
+        for dst in dsts:
+            os.makedirs(dst)
+        self.assertEqual(full_hash(self.src), copy_verified(self.src, dsts))
+        for dst in dsts:
+            copied = os.path.join(dst, "MOV001.MOD")
+            self.assertEqual(self.data, self.read(copied))
+            self.assertEqual(1000000000, int(os.path.getmtime(copied)))
+            self.assertFalse(os.path.exists(copied + PART_SUFFIX))
+
+    def test_move_verified_keeps_original_on_bad_copy(self):
+        dsts = [os.path.join(self.dir.name, name) for name in ("backup.MOD", "nas.MOD")]
+        transfer.same_device = lambda src, dst: False
+        # the NAS hands back something else than what was written
+        transfer.full_hash = lambda path: "bad" if "nas" in path else full_hash(path)
+        try:
+            with self.assertRaises(IOError):
+                move_verified(self.src, dsts, read_back=True)
+        finally:
+            (transfer.same_device, transfer.full_hash) = (same_device, full_hash)
+        self.assertEqual(self.data, self.read(self.src))
+        self.assertEqual(["MOV001.MOD"], os.listdir(self.dir.name))
+
+    def test_move_verified_checks_copies_without_read_back(self):
+        dsts = [os.path.join(self.dir.name, name) for name in ("backup.MOD", "nas.MOD")]
+        transfer.same_device = lambda src, dst: False
+        # the tail of the NAS copy came back wrong
+        transfer.partial_hash = lambda path, size: "bad" if "nas" in path else partial_hash(path, size)
+        try:
+            with self.assertRaises(IOError):
+                move_verified(self.src, dsts)
+        finally:
+            (transfer.same_device, transfer.partial_hash) = (same_device, partial_hash)
+        self.assertEqual(self.data, self.read(self.src))
+        self.assertEqual(["MOV001.MOD"], os.listdir(self.dir.name))
+
+    def test_failed_read_leaves_no_parts(self):
+        # a dir opens fine for listing but not for reading
+        src = os.path.join(self.dir.name, "MOV002.MOD")
+        os.makedirs(src)
+        with self.assertRaises(OSError):
+            copy_verified(src, [os.path.join(self.dir.name, "backup.MOD")])
+        self.assertEqual(["MOV001.MOD", "MOV002.MOD"], sorted(os.listdir(self.dir.name)))
+
+    def test_move_verified(self):
+        dsts = [os.path.join(self.dir.name, name) for name in ("backup.MOD", "nas.MOD")]
+        self.assertEqual(dsts, move_verified(self.src, dsts))
+        self.assertFalse(os.path.exists(self.src))
+        for dst in dsts:
+            self.assertEqual(self.data, self.read(dst))
+
+    def test_move_renames(self):
+        dst = os.path.join(self.dir.name, "moved.MOD")
+        inode = os.stat(self.src).st_ino
+        self.assertEqual(dst, move_file(self.src, dst))
+        self.assertFalse(os.path.exists(self.src))
+        self.assertEqual(inode, os.stat(dst).st_ino)
+
+    def test_move_never_overwrites(self):
+        dst = os.path.join(self.dir.name, "moved.MOD")
+        with open(dst, "wb") as f:
+            f.write(b"there first")
+        with self.assertRaises(FileExistsError):
+            move_file(self.src, dst)
+        self.assertEqual(self.data, self.read(self.src))
+        self.assertEqual(b"there first", self.read(dst))
+
+
+if __name__ == '__main__':
+    unittest.main()
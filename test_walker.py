@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+
+from walker import walk_dirs, walk_files
+
+
+class TestWalker(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        for path in ("a/MOV001.MOD", "a/b/MOV002.mod", "a/b/notes.txt", "c/VID_1.mp4", "skip/MOV003.MOD"):
+            full = os.path.join(self.dir.name, path)
+            os.makedirs(os.path.dirname(full), exist_ok=True)
+            with open(full, "w") as f:
+                f.write(path)
+
+    def names(self, **kwargs):
+        return sorted(os.path.relpath(f.path, self.dir.name).replace(os.sep, "/")
+                      for f in walk_files(self.dir.name, **kwargs))
+
+    def test_matches_os_walk(self):
+        expected = sorted(os.path.relpath(os.path.join(root, file), self.dir.name).replace(os.sep, "/")
+                          for root, dirs, files in os.walk(self.dir.name) for file in files)
+        self.assertEqual(expected, self.names(workers=1))
+        self.assertEqual(expected, self.names(workers=4))
+
+    def test_filters_extensions(self):
+        self.assertEqual(["a/MOV001.MOD", "a/b/MOV002.mod", "skip/MOV003.MOD"], self.names(extensions=[".MOD"]))
+
+    def test_skips_dirs(self):
+        names = self.names(extensions=[".mod"], skip_dir=lambda d: os.path.basename(d) == "skip")
+        self.assertEqual(["a/MOV001.MOD", "a/b/MOV002.mod"], names)
+
+    def test_records_root_and_stat(self):
+        (found,) = walk_files(os.path.join(self.dir.name, "c"))
+        self.assertEqual(os.path.join(self.dir.name, "c"), found.root)
+        self.assertEqual("VID_1.mp4", found.name)
+        self.assertEqual(len("c/VID_1.mp4"), found.size)
+
+    def test_lists_each_dir_once(self):
+        roots = [os.path.relpath(root, self.dir.name) for (root, files) in walk_dirs(self.dir.name)]
+        self.assertEqual(sorted([".", "a", os.path.join("a", "b"), "c", "skip"]), sorted(roots))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import inotify
+from watch import NewFileWatcher
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+class TestNewFileWatcher(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.watcher = NewFileWatcher(self.dir.name, settle=0.2, ignore=lambda path: path.endswith(".ignored"))
+        self.addCleanup(self.watcher.close)
+
+    def write(self, *parts):
+        path = os.path.join(self.dir.name, *parts)
+        with open(path, "w") as f:
+            f.write("data")
+        return path
+
+    def test_reports_settled_files_in_new_dirs(self):
+        os.makedirs(os.path.join(self.dir.name, "dump"))
+        expected = {self.write("dump", "MOV001.MOD"), self.write("VID_1.mp4")}
+        self.write("skip.ignored")
+        found = set()
+        while found != expected:
+            found.update(path for (path, stat) in self.watcher.wait())
+            self.assertTrue(found <= expected, found)
+
+    def test_skips_files_written_here(self):
+        own = self.write("VID_0.mp4")
+        self.watcher.written_here(own)
+        os.utime(own)
+        self.watcher.written_here(own)
+        new = self.write("VID_1.mp4")
+        self.assertEqual([new], [path for (path, stat) in self.watcher.wait()])
+        # a removed file is forgotten, a changed one handed out again
+        os.remove(own)
+        os.utime(new, ns=(0, 0))
+        self.assertEqual([new], [path for (path, stat) in self.watcher.wait()])
+        self.assertNotIn(own, self.watcher.known)
+
+    def test_rescans_after_overflow(self):
+        old = self.write("VID_0.mp4")
+        self.assertEqual([old], [path for (path, stat) in self.watcher.wait()])
+        # events lost in the kernel: the file is there but no event says so
+        self.watcher.notify.close()
+        self.watcher.notify = inotify.Inotify()
+        missed = self.write("VID_1.mp4")
+        overflow = [[(None, "", inotify.IN_Q_OVERFLOW)]]
+        read = self.watcher.notify.read
+        self.watcher.notify.read = lambda timeout: overflow.pop() if overflow else read(timeout)
+        self.assertEqual([missed], [path for (path, stat) in self.watcher.wait()])
+
+
+if __name__ == '__main__':
+    unittest.main()
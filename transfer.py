@@ -0,0 +1,269 @@
+__author__ = 'looser'
+
+import errno
+import hashlib
+import os
+import queue
+import shutil
+import threading
+
+from file_hash import full_hash, partial_hash
+
+# ioctl from linux/fs.h, makes dst share src's extents on btrfs/xfs
+FICLONE = 0x40049409
+CHUNK_SIZE = 8 * 1024 * 1024
+# unfinished copies are written here and renamed into place once complete
+PART_SUFFIX = ".part"
+# a leftover .part is only trusted if its tail matches the source over this many bytes
+RESUME_CHECK_SIZE = 1024 * 1024
+# errors after which the next, simpler copy method is tried
+FALLBACK_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF)
+
+
+def _target(src, dst):
+    """ Like shutil, a dst that is a dir means a file of the same name in it. """
+    return os.path.join(dst, os.path.basename(src)) if os.path.isdir(dst) else dst
+
+
+def same_device(src, dst):
+    dst_dir = dst if os.path.isdir(dst) else os.path.dirname(os.path.abspath(dst))
+    return os.stat(src).st_dev == os.stat(dst_dir).st_dev
+
+
+def move_file(src, dst):
+    """
+    Renames when src and dst share a filesystem, else copies with copy_file and removes src. Returns new path.
+    Never overwrites: FileExistsError when dst exists, also when it only appeared a moment ago.
+    """
+    dst = _target(src, dst)
+    if same_device(src, dst):
+        try:
+            # unlike rename, link fails when dst exists
+            os.link(src, dst)
+            os.unlink(src)
+            return dst
+        except FileExistsError:
+            raise
+        except OSError:
+            # no hard links on this filesystem
+            pass
+    _reserve(dst)
+    try:
+        if same_device(src, dst):
+            os.replace(src, dst)
+        else:
+            copy_file(src, dst)
+            os.remove(src)
+    except BaseException:
+        if os.path.exists(src):
+            _remove([dst])
+        raise
+    return dst
+
+
+def _reserve(dst):
+    """ Creates an empty dst, FileExistsError when there already is one. """
+    os.close(os.open(dst, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+
+
+def copy_file(src, dst):
+    """
+    Copies data and times like shutil.copy2, but lets the kernel do the work: reflink where the filesystem
+    can share extents, copy_file_range or sendfile otherwise, plain chunked copy as the last resort.
+    An interrupted copy of a big file is continued on the next call instead of restarted. Returns new path.
+    """
+    dst = _target(src, dst)
+    part = dst + PART_SUFFIX
+    size = os.stat(src).st_size
+    with open(src, "rb") as fsrc:
+        offset = _resume_offset(fsrc, part, size)
+        with open(part, "r+b" if offset else "wb") as fdst:
+            if offset or not _reflink(fsrc, fdst):
+                fdst.truncate(offset)
+                _copy_range(fsrc, fdst, offset, size)
+    shutil.copystat(src, part)
+    os.replace(part, dst)
+    return dst
+
+
+def copy_verified(src, dsts, read_back=False):
+    """
+    Copies src to every one of dsts with a single read of src. The chunks are hashed (blake2b, as file_hash does)
+    in a thread of their own and written by one thread per destination, so a slow NAS doesn't hold up the local
+    disk for longer than a few chunks. Copies are fsync'ed, then read back from disk before they get their final
+    name: size, head and tail (file_hash.partial_hash) always, a few hundred KB per copy. read_back=True reads
+    every copy back whole and compares the full hash: twice the I/O, and twice the traffic for a copy on the NAS.
+    Returns the hex digest of src, raises IOError when a copy differs. No .part file is left behind on failure.
+    """
+    dsts = [_target(src, dst) for dst in dsts]
+    parts = [dst + PART_SUFFIX for dst in dsts]
+    try:
+        digest = _copy_hashed(src, parts)
+        size = os.path.getsize(src)
+        if read_back:
+            (check, expected) = (full_hash, digest)
+        else:
+            (check, expected) = (lambda path: partial_hash(path, size), partial_hash(src, size))
+        checks = {}
+
+        def read_back_one(part):
+            checks[part] = check(part) if os.path.getsize(part) == size else None
+        readers = [threading.Thread(target=read_back_one, args=(part,)) for part in parts]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        bad = [dst for (dst, part) in zip(dsts, parts) if checks.get(part) != expected]
+        if bad:
+            raise IOError("copy of %s differs from the original: %s" % (src, ", ".join(bad)))
+    except BaseException:
+        _remove(parts)
+        raise
+    for (dst, part) in zip(dsts, parts):
+        shutil.copystat(src, part)
+        os.replace(part, dst)
+    return digest
+
+
+def _copy_hashed(src, parts):
+    """ The single read of copy_verified, writes parts and returns the hash of src. """
+    digest = hashlib.blake2b()
+    errors = []
+
+    def consume(chunks, use):
+        try:
+            for chunk in iter(chunks.get, None):
+                use(chunk)
+        except Exception as e:
+            errors.append(e)
+            # keep taking chunks, so the reader doesn't block on this queue
+            for _ in iter(chunks.get, None):
+                pass
+
+    outputs = []
+    try:
+        for part in parts:
+            outputs.append(open(part, "wb"))
+        consumers = [digest.update] + [output.write for output in outputs]
+        # a few chunks in flight per consumer, the reader is held back by the slowest one
+        queues = [queue.Queue(4) for _ in consumers]
+        threads = [threading.Thread(target=consume, args=(chunks, use)) for (chunks, use) in zip(queues, consumers)]
+        for thread in threads:
+            thread.start()
+        try:
+            with open(src, "rb") as fsrc:
+                _advise(fsrc, "POSIX_FADV_SEQUENTIAL")
+                for chunk in iter(lambda: fsrc.read(CHUNK_SIZE), b""):
+                    for chunks in queues:
+                        chunks.put(chunk)
+        finally:
+            for chunks in queues:
+                chunks.put(None)
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+        for output in outputs:
+            output.flush()
+            os.fsync(output.fileno())
+            # so the read back comes from the disk and not from the page cache
+            _advise(output, "POSIX_FADV_DONTNEED")
+    finally:
+        for output in outputs:
+            output.close()
+    return digest.hexdigest()
+
+
+def move_verified(src, dsts, read_back=False):
+    """
+    Moves src to all of dsts, the original is only removed once every copy was read back and matched
+    (copy_verified, read_back as there). A destination on the same filesystem as src gets it by rename. Returns the new paths.
+    """
+    dsts = [_target(src, dst) for dst in dsts]
+    same = [dst for dst in dsts if same_device(src, dst)]
+    copies = [dst for dst in dsts if not same or dst != same[0]]
+    if copies:
+        copy_verified(src, copies, read_back)
+    if same:
+        os.replace(src, same[0])
+    else:
+        os.remove(src)
+    return dsts
+
+
+def _advise(f, advice):
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(f.fileno(), 0, 0, getattr(os, advice))
+
+
+def _remove(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def clone_file(src, dst):
+    """ Makes dst a reflink of src: a file of its own that shares src's extents. OSError where that's not possible. """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        if not _reflink(fsrc, fdst):
+            raise OSError(errno.EOPNOTSUPP, "filesystem can't share extents", dst)
+
+
+def _resume_offset(fsrc, part, size):
+    try:
+        done = os.path.getsize(part)
+    except OSError:
+        return 0
+    if done <= RESUME_CHECK_SIZE or done > size:
+        return 0
+    with open(part, "rb") as fpart:
+        fpart.seek(done - RESUME_CHECK_SIZE)
+        fsrc.seek(done - RESUME_CHECK_SIZE)
+        if fpart.read(RESUME_CHECK_SIZE) != fsrc.read(RESUME_CHECK_SIZE):
+            return 0
+    print("Resuming copy of %s at %d MB" % (fsrc.name, done // (1024 * 1024)))
+    return done
+
+
+def _reflink(fsrc, fdst):
+    try:
+        import fcntl
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except (ImportError, OSError):
+        return False
+
+
+def _copy_range(fsrc, fdst, offset, size):
+    """ Copies src[offset:size] to the same place in dst with the best method that works here. """
+    for copy_chunk in (_copy_file_range_chunk, _sendfile_chunk):
+        try:
+            while offset < size:
+                copied = copy_chunk(fsrc, fdst, offset, min(CHUNK_SIZE, size - offset))
+                if copied == 0:
+                    break
+                offset += copied
+            if offset >= size:
+                return
+        except (AttributeError, OSError) as e:
+            if isinstance(e, OSError) and e.errno not in FALLBACK_ERRORS:
+                raise
+    fsrc.seek(offset)
+    fdst.seek(offset)
+    while offset < size:
+        chunk = fsrc.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        fdst.write(chunk)
+        offset += len(chunk)
+
+
+def _copy_file_range_chunk(fsrc, fdst, offset, count):
+    return os.copy_file_range(fsrc.fileno(), fdst.fileno(), count, offset, offset)
+
+
+def _sendfile_chunk(fsrc, fdst, offset, count):
+    os.lseek(fdst.fileno(), offset, os.SEEK_SET)
+    return os.sendfile(fdst.fileno(), fsrc.fileno(), offset, count)
@@ -0,0 +1,99 @@
+__author__ = 'looser'
+
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# directory listings on the NAS are mostly waiting on the network, so a few threads go a long way
+DEFAULT_WORKERS = 8
+
+
+class LibraryFile:
+    """
+    File found by walk_files. Wraps the os.DirEntry from the listing, so stat() is only done once per file
+    (and on Windows comes for free with the listing).
+    """
+    __slots__ = ("root", "entry")
+
+    def __init__(self, root, entry):
+        self.root = root
+        self.entry = entry
+
+    @property
+    def name(self):
+        return self.entry.name
+
+    @property
+    def path(self):
+        return self.entry.path
+
+    def stat(self):
+        return self.entry.stat()
+
+    @property
+    def size(self):
+        return self.entry.stat().st_size
+
+    @property
+    def mtime(self):
+        return self.entry.stat().st_mtime
+
+    def __repr__(self):
+        return "LibraryFile(%r)" % (self.path,)
+
+
+def _list_dir(path, extensions):
+    files = []
+    dirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    # same as os.walk: symlinked dirs are neither files nor followed
+                    if not entry.is_symlink():
+                        dirs.append(entry.path)
+                elif extensions is None or os.path.splitext(entry.name)[1].lower() in extensions:
+                    files.append(LibraryFile(path, entry))
+    except OSError:
+        # os.walk skips unreadable dirs silently too
+        pass
+    return files, dirs
+
+
+def walk_dirs(top, extensions=None, workers=DEFAULT_WORKERS, skip_dir=None):
+    """
+    Yields (root, [LibraryFile]) once per directory under top, in no particular order.
+    extensions - only files with these extensions (like ".mod", any case) are returned
+    workers - number of directories listed at once, 1 lists them one by one top-down
+    skip_dir - predicate on a dir path, matching dirs are not entered
+    """
+    if extensions is not None:
+        extensions = {ext.lower() for ext in extensions}
+    if skip_dir is not None and skip_dir(top):
+        return
+
+    if workers <= 1:
+        pending = [top]
+        while pending:
+            root = pending.pop()
+            (files, dirs) = _list_dir(root, extensions)
+            yield root, files
+            pending.extend(reversed([d for d in dirs if skip_dir is None or not skip_dir(d)]))
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(_list_dir, top, extensions): top}
+        while pending:
+            (done, _) = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                root = pending.pop(future)
+                (files, dirs) = future.result()
+                for d in dirs:
+                    if skip_dir is None or not skip_dir(d):
+                        pending[pool.submit(_list_dir, d, extensions)] = d
+                yield root, files
+
+
+def walk_files(top, extensions=None, workers=DEFAULT_WORKERS, skip_dir=None):
+    """ Yields LibraryFile for every file under top, in no particular order. Arguments are as for walk_dirs. """
+    for (_, files) in walk_dirs(top, extensions, workers, skip_dir):
+        yield from files
@@ -0,0 +1,103 @@
+__author__ = 'looser'
+
+import os
+import time
+
+import inotify
+from walker import walk_dirs
+
+# no IN_MODIFY, a big copy would flood the queue with one per write, the settle check polls stat instead
+WATCH_MASK = inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO | inotify.IN_CREATE | inotify.IN_ATTRIB
+# files that are gone are forgotten, so known only holds what is in the tree
+GONE_MASK = inotify.IN_DELETE | inotify.IN_MOVED_FROM
+# a file has to keep its size and mtime this long before it counts as fully written
+DEFAULT_SETTLE = 5.0
+
+
+class NewFileWatcher:
+    """
+    Watches a dir tree with inotify and hands out files once they stopped changing.
+    New subdirs are watched (and scanned) as they appear. Sleeps in the kernel while nothing happens.
+    When the kernel drops events because its queue overflowed, the whole tree is scanned again.
+    """
+    def __init__(self, top, settle=DEFAULT_SETTLE, ignore=None):
+        self.top = top
+        self.settle = settle
+        self.ignore = ignore
+        self.notify = inotify.Inotify()
+        # path -> ((size, mtime_ns), last time it changed)
+        self.pending = {}
+        # path -> (size, mtime_ns) of the files there at the start, handed out or written_here since,
+        # those are not handed out again as long as they stay the same
+        self.known = {}
+        self._watch_tree(top, report_files=False)
+
+    def _watch_tree(self, top, report_files=True):
+        for (root, files) in walk_dirs(top, workers=1):
+            self.notify.add_watch(root, WATCH_MASK | GONE_MASK)
+            for file in files:
+                try:
+                    stat = file.stat()
+                except OSError:
+                    continue
+                if not report_files:
+                    self.known[file.path] = (stat.st_size, stat.st_mtime_ns)
+                elif self.known.get(file.path) != (stat.st_size, stat.st_mtime_ns) and file.path not in self.pending:
+                    # written before the watch was in place, or while events were lost
+                    self._touched(file.path)
+
+    def _touched(self, path):
+        if self.ignore is None or not self.ignore(path):
+            self.pending[path] = (None, time.monotonic())
+
+    def _settled(self):
+        now = time.monotonic()
+        ready = []
+        for (path, (seen, changed)) in list(self.pending.items()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != seen:
+                self.pending[path] = (current, now)
+            elif now - changed >= self.settle:
+                del self.pending[path]
+                if self.known.get(path) != current:
+                    self.known[path] = current
+                    ready.append((path, stat))
+        return ready
+
+    def written_here(self, path):
+        """ The caller wrote path itself: its events are not handed out unless it changes again. """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        self.known[path] = (stat.st_size, stat.st_mtime_ns)
+
+    def wait(self):
+        """ Blocks until some files settled, returns [(path, stat)]. """
+        while True:
+            events = self.notify.read(self.settle if self.pending else None)
+            for (root, name, mask) in events:
+                if mask & inotify.IN_Q_OVERFLOW:
+                    print("inotify queue overflowed, scanning %s again" % (self.top,))
+                    self._watch_tree(self.top)
+                    continue
+                path = os.path.join(root, name)
+                if mask & GONE_MASK:
+                    if not mask & inotify.IN_ISDIR:
+                        self.known.pop(path, None)
+                elif mask & inotify.IN_ISDIR:
+                    if mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                        self._watch_tree(path)
+                else:
+                    self._touched(path)
+            ready = self._settled()
+            if ready:
+                return ready
+
+    def close(self):
+        self.notify.close()